@@ -0,0 +1,4 @@
+#!/bin/sh
+# Let the timescaledb-replica service (docker compose --profile replica up) stream
+# WAL from this server. Only runs when the data directory is first created.
+echo "host replication all all scram-sha-256" >> "$PGDATA/pg_hba.conf"
@@ -0,0 +1,277 @@
+"""
+Cold tier exporter.
+
+posts and embeddings are dropped by their retention policies after 7 days. Before
+that happens this writes every chunk of them to Parquet (see archive.parquet for
+the layout), so there is history to analyze and replay without keeping it in
+Postgres. A chunk is exported once it's `archive_after_hours` past its end, when
+nothing more is written to it, and recorded in `archived_chunks` so it's exported
+exactly once. Chunks are read in created_at order with a server-side cursor and
+written a row group at a time, so memory doesn't depend on chunk size.
+
+    uv run python -m archive.main           # keep exporting
+    uv run python -m archive.main --once    # export what's due and exit
+
+Historical queries over the files are in archive.query.
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import create_engine, text
+
+from archive.parquet import (
+    EMBEDDINGS,
+    EMBEDDINGS_DICTIONARY,
+    POSTS,
+    POSTS_DICTIONARY,
+    POSTS_SCHEMA,
+    UNDETERMINED,
+    PartitionedWriter,
+    embeddings_schema,
+    embeddings_table,
+)
+from shared.config import settings
+from shared.text_search import valid_language
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# chunk ranges come back as timestamptz, read them (and write created_at) as UTC
+engine = create_engine(settings.database_url, connect_args={"options": "-c timezone=UTC"})
+
+# Chunks that are due and not exported yet, oldest first, with whether the retention
+# policy will drop them within a day
+pending_chunks_query = text(
+    """
+    SELECT c.hypertable_name, c.chunk_name, c.range_start, c.range_end,
+        c.range_end < now() - CAST(j.config ->> 'drop_after' AS interval) + INTERVAL '1 day' AS at_risk
+    FROM timescaledb_information.chunks c
+    LEFT JOIN archived_chunks a ON a.hypertable = c.hypertable_name AND a.chunk = c.chunk_name
+    LEFT JOIN timescaledb_information.jobs j
+        ON j.proc_name = 'policy_retention' AND j.hypertable_name = c.hypertable_name
+    WHERE c.hypertable_schema = 'public' AND c.hypertable_name IN ('posts', 'embeddings')
+        AND c.range_end < :before AND a.chunk IS NULL
+    ORDER BY c.range_start
+    """
+)
+
+# Posts as they'd be fetched from the firehose again: authors and reply targets as
+# DIDs and URIs, not actor ids that only mean something in this database
+posts_query = text(
+    """
+    SELECT p.id, author.did, p.commit_rkey, p.commit_cid, p.created_at, p.langs, p.lang,
+        p.record_text,
+        'at://' || parent.did || '/app.bsky.feed.post/' || p.reply_parent_rkey AS reply_parent_uri,
+        'at://' || root.did || '/app.bsky.feed.post/' || p.reply_root_rkey AS reply_root_uri,
+        p.ingest_time, p.cursor, p.canonical_id
+    FROM posts p
+    JOIN actors author ON author.id = p.actor_id
+    LEFT JOIN actors parent ON parent.id = p.reply_parent_actor_id
+    LEFT JOIN actors root ON root.id = p.reply_root_actor_id
+    WHERE p.created_at >= :start AND p.created_at < :end
+    ORDER BY p.created_at
+    """
+)
+
+# real[] rather than pgvector's text format, psycopg2 returns those as lists of floats
+embeddings_query = text(
+    """
+    SELECT post_id, post_created_at, created_at, CAST(embedding AS real[]) AS embedding
+    FROM embeddings
+    WHERE model_id = :model_id AND post_created_at >= :start AND post_created_at < :end
+    ORDER BY post_created_at
+    """
+)
+
+models_query = text(
+    """
+    SELECT id, name, dimensions FROM embedding_models ORDER BY id
+    """
+)
+
+record_chunk_query = text(
+    """
+    INSERT INTO archived_chunks (hypertable, chunk, range_start, range_end, rows, files, bytes, archived_at)
+    VALUES (:hypertable, :chunk, :range_start, :range_end, :rows, :files, :bytes, now())
+    ON CONFLICT (hypertable, chunk) DO NOTHING
+    """
+)
+
+
+# read chunks through a server-side cursor, a row group at a time
+STREAM = {"stream_results": True, "yield_per": settings.archive_row_group_size}
+
+
+def utc(value: datetime) -> datetime:
+    """A timestamp column without time zone, which we always store in UTC, as aware."""
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def uuid_bytes(value) -> bytes | None:
+    if value is None:
+        return None
+    return value.bytes if isinstance(value, uuid.UUID) else uuid.UUID(value).bytes
+
+
+def day(value: datetime) -> str:
+    return f"day={value.date().isoformat()}"
+
+
+def chunk_range(chunk) -> dict:
+    # posts.created_at and embeddings.post_created_at have no time zone, the range is UTC
+    return {
+        "start": chunk.range_start.astimezone(timezone.utc).replace(tzinfo=None),
+        "end": chunk.range_end.astimezone(timezone.utc).replace(tzinfo=None),
+    }
+
+
+def post_rows(conn, chunk):
+    """(partition, row) of every post in the chunk."""
+    for post in conn.execute(posts_query, chunk_range(chunk), execution_options=STREAM):
+        created_at = utc(post.created_at)
+        lang = post.lang if post.lang and valid_language(post.lang) else UNDETERMINED
+        yield f"{day(created_at)}/lang={lang}", (
+            uuid_bytes(post.id),
+            post.did,
+            post.commit_rkey,
+            post.commit_cid and bytes(post.commit_cid),
+            created_at,
+            post.langs,
+            post.record_text,
+            post.reply_parent_uri,
+            post.reply_root_uri,
+            post.ingest_time,
+            post.cursor,
+            uuid_bytes(post.canonical_id),
+        )
+
+
+def embedding_rows(conn, chunk, model_id: int):
+    params = {**chunk_range(chunk), "model_id": model_id}
+    for embedding in conn.execute(embeddings_query, params, execution_options=STREAM):
+        # by the day of the post, like the posts they belong to
+        post_created_at = utc(embedding.post_created_at)
+        yield day(post_created_at), (
+            uuid_bytes(embedding.post_id),
+            post_created_at,
+            embedding.created_at,
+            embedding.embedding,
+        )
+
+
+def posts_exports(conn, chunk):
+    yield POSTS, POSTS_SCHEMA, POSTS_DICTIONARY, post_rows(conn, chunk)
+
+
+def embeddings_exports(conn, chunk):
+    # a table per model, with the model's dimensions. Models without embeddings in
+    # the chunk don't write any files.
+    for model in conn.execute(models_query).fetchall():
+        yield (
+            embeddings_table(model.name),
+            embeddings_schema(model.dimensions),
+            EMBEDDINGS_DICTIONARY,
+            embedding_rows(conn, chunk, model.id),
+        )
+
+
+# hypertable -> the (table, schema, dictionary encoded columns, rows) its chunks are written to
+EXPORTS = {
+    POSTS: posts_exports,
+    EMBEDDINGS: embeddings_exports,
+}
+
+
+def export_chunk(chunk) -> None:
+    started = time.monotonic()
+    writers = []
+    files = size = rows_written = 0
+    with engine.connect() as conn:
+        try:
+            for table, schema, dictionary, rows in EXPORTS[chunk.hypertable_name](conn, chunk):
+                writer = PartitionedWriter(
+                    f"{settings.archive_dir}/{table}",
+                    chunk.chunk_name,
+                    schema,
+                    dictionary,
+                    settings.archive_row_group_size,
+                )
+                writers.append(writer)
+                for partition, row in rows:
+                    writer.write(partition, row)
+            # only once every table's files are written
+            for writer in writers:
+                table_files, table_size = writer.commit()
+                files += table_files
+                size += table_size
+                rows_written += writer.rows
+        except Exception:
+            for writer in writers:
+                writer.abort()
+            raise
+        conn.execute(
+            record_chunk_query,
+            {
+                "hypertable": chunk.hypertable_name,
+                "chunk": chunk.chunk_name,
+                "range_start": chunk.range_start,
+                "range_end": chunk.range_end,
+                "rows": rows_written,
+                "files": files,
+                "bytes": size,
+            },
+        )
+        conn.commit()
+    logger.info(
+        f"Archived {chunk.hypertable_name} chunk {chunk.chunk_name} ({chunk.range_start} to "
+        f"{chunk.range_end}): {rows_written} rows in {files} files, {size / 1024 / 1024:.1f} MB, "
+        f"{time.monotonic() - started:.1f} seconds"
+    )
+
+
+def export_pending() -> int:
+    """Export every chunk that's due, the number exported."""
+    before = datetime.now(timezone.utc) - timedelta(hours=settings.archive_after_hours)
+    with engine.connect() as conn:
+        chunks = conn.execute(pending_chunks_query, {"before": before}).fetchall()
+    for chunk in chunks:
+        if chunk.at_risk:
+            logger.warning(
+                f"{chunk.hypertable_name} chunk {chunk.chunk_name} is dropped by retention within a day, "
+                "the exporter is falling behind"
+            )
+        export_chunk(chunk)
+    return len(chunks)
+
+
+async def run_archive(once: bool):
+    logger.info(
+        f"Archiving chunks {settings.archive_after_hours} hours after they end to {settings.archive_dir}"
+    )
+    while True:
+        try:
+            exported = await asyncio.to_thread(export_pending)
+            if once:
+                logger.info(f"Exported {exported} chunks")
+                return
+        except Exception as e:
+            logger.error(f"Error archiving chunks: {e}")
+            if once:
+                raise
+        await asyncio.sleep(settings.archive_check_seconds)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--once", action="store_true", help="export the chunks that are due and exit")
+    try:
+        asyncio.run(run_archive(parser.parse_args().once))
+    except asyncio.exceptions.CancelledError:
+        logger.info("Cancelled, stopping...")
@@ -0,0 +1,170 @@
+"""
+Layout of the cold tier.
+
+Every table is a directory of Hive-partitioned Parquet files, one file per exported
+chunk and partition:
+
+    {archive_dir}/posts/day=2026-10-18/lang=en/_hyper_3_41_chunk.parquet
+    {archive_dir}/embeddings/all-MiniLM-L6-v2/day=2026-10-18/_hyper_2_977_chunk.parquet
+
+The partition values are in the path, not in the files, so a query for a day or a
+language never opens the other files. Files are zstd compressed, columns that
+repeat a lot (authors, thread URIs) are dictionary encoded, and embeddings are
+fixed-size float32 lists, so they read back as one contiguous array. Each model's
+embeddings are a table of their own, their dimensions differ.
+"""
+
+import os
+from typing import Dict, List, Tuple
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as fs
+import pyarrow.parquet as pq
+
+POSTS = "posts"
+EMBEDDINGS = "embeddings"
+
+# posts without a (usable) language go in lang=und, "undetermined" in BCP 47
+UNDETERMINED = "und"
+
+POSTS_SCHEMA = pa.schema(
+    [
+        ("id", pa.binary(16)),
+        ("did", pa.string()),
+        ("rkey", pa.string()),
+        ("cid", pa.binary()),
+        ("created_at", pa.timestamp("us", tz="UTC")),
+        ("langs", pa.list_(pa.string())),
+        ("text", pa.string()),
+        ("reply_parent_uri", pa.string()),
+        ("reply_root_uri", pa.string()),
+        ("ingest_time", pa.timestamp("us", tz="UTC")),
+        ("cursor", pa.int64()),
+        ("canonical_id", pa.binary(16)),
+    ]
+)
+POSTS_DICTIONARY = ["did", "reply_parent_uri", "reply_root_uri"]
+POSTS_PARTITIONING = ds.partitioning(
+    pa.schema([("day", pa.string()), ("lang", pa.string())]), flavor="hive"
+)
+
+
+def embeddings_schema(dimensions: int) -> pa.Schema:
+    return pa.schema(
+        [
+            ("post_id", pa.binary(16)),
+            ("post_created_at", pa.timestamp("us", tz="UTC")),
+            ("created_at", pa.timestamp("us", tz="UTC")),
+            ("embedding", pa.list_(pa.float32(), dimensions)),
+        ]
+    )
+
+
+EMBEDDINGS_DICTIONARY: List[str] = []
+
+
+def embeddings_table(model: str) -> str:
+    """The directory of a model's embeddings, "org/name" models as "org--name"."""
+    return f"{EMBEDDINGS}/{model.replace('/', '--')}"
+
+
+EMBEDDINGS_PARTITIONING = ds.partitioning(pa.schema([("day", pa.string())]), flavor="hive")
+
+
+class PartitionedWriter:
+    """
+    Writes one exported chunk: a Parquet file per partition it has rows for, named
+    after the chunk. Files are written next to their final name and only renamed
+    into place by `commit()`, so readers never see a half-written chunk, and an
+    export that died is simply done again over the same names.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        name: str,
+        schema: pa.Schema,
+        dictionary: List[str],
+        row_group_size: int,
+    ):
+        self.root = root
+        self.name = name
+        self.schema = schema
+        self.dictionary = dictionary
+        self.row_group_size = row_group_size
+        self._writers: Dict[str, pq.ParquetWriter] = {}
+        # rows waiting for a full row group, per partition: column -> values
+        self._pending: Dict[str, Dict[str, list]] = {}
+        self.rows = 0
+
+    def _path(self, partition: str) -> str:
+        return os.path.join(self.root, partition, f"{self.name}.parquet")
+
+    def _temporary_path(self, partition: str) -> str:
+        # hidden from readers, see dataset()
+        return os.path.join(self.root, partition, f".{self.name}.parquet.tmp")
+
+    def write(self, partition: str, row: Tuple) -> None:
+        """Add a row, its values in schema order, to the partition (e.g. 'day=2026-10-18/lang=en')."""
+        pending = self._pending.get(partition)
+        if pending is None:
+            pending = self._pending[partition] = {column: [] for column in self.schema.names}
+        for column, value in zip(self.schema.names, row):
+            pending[column].append(value)
+        self.rows += 1
+        if len(pending[self.schema.names[0]]) >= self.row_group_size:
+            self._flush(partition)
+
+    def _flush(self, partition: str) -> None:
+        pending = self._pending.pop(partition, None)
+        if not pending or not pending[self.schema.names[0]]:
+            return
+        writer = self._writers.get(partition)
+        if writer is None:
+            path = self._temporary_path(partition)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            writer = self._writers[partition] = pq.ParquetWriter(
+                path,
+                self.schema,
+                compression="zstd",
+                use_dictionary=self.dictionary,
+            )
+        writer.write_table(pa.Table.from_pydict(pending, self.schema), self.row_group_size)
+
+    def commit(self) -> Tuple[int, int]:
+        """Finish every file and move it into place, (files, bytes) written."""
+        for partition in list(self._pending):
+            self._flush(partition)
+        size = 0
+        for partition, writer in self._writers.items():
+            writer.close()
+            path = self._path(partition)
+            os.replace(self._temporary_path(partition), path)
+            size += os.path.getsize(path)
+        return len(self._writers), size
+
+    def abort(self) -> None:
+        for partition, writer in self._writers.items():
+            writer.close()
+            if os.path.exists(self._temporary_path(partition)):
+                os.remove(self._temporary_path(partition))
+        self._writers.clear()
+        self._pending.clear()
+
+
+def dataset(root: str, table: str) -> ds.Dataset:
+    """
+    An exported table, POSTS or embeddings_table(model). Files are memory-mapped
+    rather than read, so scans only touch the pages of the row groups and columns
+    they need.
+    """
+    partitioning = POSTS_PARTITIONING if table == POSTS else EMBEDDINGS_PARTITIONING
+    return ds.dataset(
+        os.path.join(root, table),
+        format="parquet",
+        partitioning=partitioning,
+        filesystem=fs.LocalFileSystem(use_mmap=True),
+        # skips the files of an export in progress, but not the chunk names (_hyper_...)
+        ignore_prefixes=["."],
+    )
@@ -0,0 +1,191 @@
+"""
+Historical queries over the Parquet cold tier, without loading anything back into
+Postgres.
+
+Keywords use the same language as feeds (see feed_service.query), matched as
+case-insensitive whole words rather than stemmed. Everything is pushed down into
+the scan: days and languages prune whole directories, the created_at range skips
+row groups by their statistics, and only the columns a query needs are read, from
+memory-mapped files. Keyword matching runs on each batch as it's read.
+
+    uv run python -m archive.query search 'python & !snake' --after 2026-10-01 --language en
+    uv run python -m archive.query trend 'election' --after 2026-10-01 --bucket hour
+"""
+
+import argparse
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from archive.parquet import POSTS, dataset, embeddings_table
+from feed_service.query import And, Node, Not, Or, Term, parse_keywords
+from shared.config import settings
+from shared.text_search import has_cjk
+
+# anything that isn't part of a word, RE2's \b and \W only know ASCII
+_BOUNDARY = r"[^\pL\pN_]"
+
+
+def _term_pattern(term: Term) -> str:
+    words = [re.escape(word) for word in term.words]
+    if any(has_cjk(word) for word in term.words):
+        # no spaces between words to look for
+        return f"{_BOUNDARY}*".join(words)
+    return f"(?:^|{_BOUNDARY})" + f"{_BOUNDARY}+".join(words) + f"(?:{_BOUNDARY}|$)"
+
+
+def keyword_filter(node: Node, column: str = "text") -> ds.Expression:
+    """A dataset filter matching a parsed keyword expression against a text column."""
+    if isinstance(node, Term):
+        return pc.match_substring_regex(ds.field(column), pattern=_term_pattern(node), ignore_case=True)
+    if isinstance(node, Not):
+        return ~keyword_filter(node.child, column)
+    children = [keyword_filter(child, column) for child in node.children]
+    combined = children[0]
+    for child in children[1:]:
+        combined = combined & child if isinstance(node, And) else combined | child
+    return combined
+
+
+def _utc(value: datetime) -> datetime:
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def time_filter(after: datetime, before: datetime, column: str = "created_at") -> ds.Expression:
+    """Rows in [after, before), and only the day partitions that can have them."""
+    after, before = _utc(after), _utc(before)
+    last_day = (before - timedelta(microseconds=1)).date().isoformat()
+    return (
+        (ds.field("day") >= after.date().isoformat())
+        & (ds.field("day") <= last_day)
+        & (ds.field(column) >= pa.scalar(after, pa.timestamp("us", tz="UTC")))
+        & (ds.field(column) < pa.scalar(before, pa.timestamp("us", tz="UTC")))
+    )
+
+
+def posts_filter(
+    after: datetime,
+    before: datetime,
+    keywords: Optional[List[str]] = None,
+    languages: Optional[List[str]] = None,
+) -> ds.Expression:
+    expression = time_filter(after, before)
+    if languages:
+        expression = expression & ds.field("lang").isin(languages)
+    if keywords:
+        expression = expression & keyword_filter(parse_keywords(keywords))
+    return expression
+
+
+def _dataset(table: str, root: Optional[str]) -> Optional[ds.Dataset]:
+    root = root or settings.archive_dir
+    if not os.path.isdir(os.path.join(root, table)):
+        return None
+    return dataset(root, table)
+
+
+def search(
+    keywords: List[str],
+    after: datetime,
+    before: datetime,
+    languages: Optional[List[str]] = None,
+    limit: int = 50,
+    root: Optional[str] = None,
+) -> pa.Table:
+    """The newest archived posts matching the keywords, like a feed page."""
+    posts = _dataset(POSTS, root)
+    columns = ["id", "did", "rkey", "created_at", "lang", "text", "reply_parent_uri", "reply_root_uri"]
+    if posts is None:
+        return pa.table({c: [] for c in columns})
+    # days are scanned newest first, so a full page usually doesn't need the older ones
+    after = _utc(after)
+    pages = []
+    found = 0
+    day_end = _utc(before)
+    while day_end > after and found < limit:
+        day = (day_end - timedelta(microseconds=1)).date()
+        day_start = max(after, datetime.combine(day, datetime.min.time(), timezone.utc))
+        page = posts.to_table(columns=columns, filter=posts_filter(day_start, day_end, keywords, languages))
+        pages.append(page)
+        found += page.num_rows
+        day_end = day_start
+    table = pa.concat_tables(pages) if pages else pa.table({c: [] for c in columns})
+    return table.sort_by([("created_at", "descending")]).slice(0, limit)
+
+
+def trend(
+    keywords: List[str],
+    after: datetime,
+    before: datetime,
+    languages: Optional[List[str]] = None,
+    bucket: str = "day",
+    root: Optional[str] = None,
+) -> List[dict]:
+    """Posts matching the keywords per bucket ('hour' or 'day'), and their share of all posts."""
+    posts = _dataset(POSTS, root)
+    if posts is None:
+        return []
+
+    def counts(filter: ds.Expression) -> dict:
+        # just the timestamps (and text, for the keyword filter) are read
+        times = posts.to_table(columns=["created_at"], filter=filter).column("created_at")
+        buckets = pa.table({"bucket": pc.floor_temporal(times, unit=bucket)})
+        grouped = buckets.group_by("bucket").aggregate([("bucket", "count")])
+        return dict(zip(grouped.column("bucket").to_pylist(), grouped.column("bucket_count").to_pylist()))
+
+    totals = counts(posts_filter(after, before, None, languages))
+    matches = counts(posts_filter(after, before, keywords, languages))
+    return [
+        {"bucket": b, "posts": total, "matches": matches.get(b, 0), "share": matches.get(b, 0) / total}
+        for b, total in sorted(totals.items())
+    ]
+
+
+def embeddings(
+    after: datetime,
+    before: datetime,
+    model: Optional[str] = None,
+    root: Optional[str] = None,
+) -> pa.Table:
+    """A model's embeddings of the posts created in [after, before), see embedding_matrix()."""
+    table = _dataset(embeddings_table(model or settings.embedding_model), root)
+    if table is None:
+        return pa.table({"post_id": [], "post_created_at": [], "embedding": []})
+    return table.to_table(
+        columns=["post_id", "post_created_at", "embedding"],
+        filter=time_filter(after, before, "post_created_at"),
+    )
+
+
+def embedding_matrix(table: pa.Table):
+    """The embedding column as a (rows, dimensions) float32 numpy array, one contiguous buffer."""
+    column = table.column("embedding").combine_chunks()
+    return column.flatten().to_numpy().reshape(len(column), column.type.list_size)
+
+
+def _datetime(value: str) -> datetime:
+    return _utc(datetime.fromisoformat(value))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["search", "trend"])
+    parser.add_argument("keywords", nargs="+", help="feed keywords, all of them must match")
+    parser.add_argument("--after", type=_datetime, default=datetime.now(timezone.utc) - timedelta(days=30))
+    parser.add_argument("--before", type=_datetime, default=datetime.now(timezone.utc))
+    parser.add_argument("--language", action="append", help="only posts in this language, repeat for several")
+    parser.add_argument("--limit", type=int, default=20, help="posts shown by search")
+    parser.add_argument("--bucket", choices=["hour", "day"], default="day", help="trend granularity")
+    args = parser.parse_args()
+
+    if args.command == "search":
+        for post in search(args.keywords, args.after, args.before, args.language, args.limit).to_pylist():
+            print(f"{post['created_at']:%Y-%m-%d %H:%M:%S} [{post['lang']}] {post['did']}: {post['text']!r}")
+    else:
+        for row in trend(args.keywords, args.after, args.before, args.language, args.bucket):
+            print(f"{row['bucket']:%Y-%m-%d %H:%M}  {row['matches']:>8} of {row['posts']:>10}  {row['share']:.4%}")
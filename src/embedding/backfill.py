@@ -0,0 +1,448 @@
+"""
+Re-embed past posts with another model.
+
+A new model (settings.embedding_model, or --model) gets embeddings for new posts
+from its own embedding worker (embedding.main) as soon as it's registered, and for
+the posts before that from a backfill:
+
+    uv run python -m embedding.backfill run --model nomic-ai/nomic-embed-text-v1.5 --workers 4
+    uv run python -m embedding.backfill status
+    uv run python -m embedding.backfill activate --model nomic-ai/nomic-embed-text-v1.5
+
+The time range is split into shards, one per chunk of posts, recorded in
+`embedding_backfill`. Worker processes lease a shard at a time, newest first, and
+page through it in (created_at, id) order, encoding a batch at a time. Each batch's
+embeddings and the shard's checkpoint are written in one transaction, so a backfill
+that's stopped, or a worker that dies, carries on from the last batch: run it again,
+and a shard whose lease ran out is taken over.
+
+Backfills must not slow down the live workers, which keep feeds fresh. Workers run
+at a lower CPU priority, together they embed at most backfill_posts_per_second, and
+they pause while more than backfill_max_live_backlog recent posts are waiting for
+the live workers of the active model or the model being backfilled.
+
+Readers keep using the active model until `activate`, which switches them all at
+once (see embedding.models), and refuses while shards or feeds aren't embedded yet.
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import socket
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import create_engine, text
+
+from embedding.models import activate, active_model, get_model, load_model, register_model
+from shared.config import settings
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# chunk ranges are timestamptz, posts.created_at is UTC without a time zone
+engine = create_engine(settings.database_url, connect_args={"options": "-c timezone=UTC"})
+
+# one shard per chunk of posts overlapping the range, clipped to it. Shards that are
+# already there (from an earlier run) are kept with their progress.
+plan_shards_query = text(
+    """
+    INSERT INTO embedding_backfill (model_id, shard_start, shard_end)
+    SELECT :model_id,
+        greatest(CAST(range_start AS timestamp), :after),
+        least(CAST(range_end AS timestamp), :before)
+    FROM timescaledb_information.chunks
+    WHERE hypertable_schema = 'public' AND hypertable_name = 'posts'
+        AND range_end > :after AND range_start < :before
+    ON CONFLICT (model_id, shard_start) DO NOTHING
+    """
+)
+
+# the newest shard nobody holds, taken without waiting on other workers' claims
+claim_shard_query = text(
+    """
+    UPDATE embedding_backfill b
+    SET claimed_by = :worker, claimed_until = now() + make_interval(secs => :lease)
+    WHERE (b.model_id, b.shard_start) = (
+        SELECT model_id, shard_start
+        FROM embedding_backfill
+        WHERE model_id = :model_id AND finished_at IS NULL
+            AND (claimed_until IS NULL OR claimed_until < now())
+        ORDER BY shard_start DESC
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING b.shard_start, b.shard_end, b.last_created_at, b.last_post_id
+    """
+)
+
+# the next page of the shard after the checkpoint. Every post, including the ones that
+# aren't embedded (near-duplicates, no text), so the checkpoint moves past them.
+posts_page_query = text(
+    """
+    SELECT p.id, p.created_at, p.record_text, p.canonical_id
+    FROM posts p
+    WHERE p.created_at >= :shard_start AND p.created_at < :shard_end
+        AND (CAST(:last_created_at AS timestamp) IS NULL
+            OR (p.created_at, p.id) > (CAST(:last_created_at AS timestamp), CAST(:last_post_id AS uuid)))
+    ORDER BY p.created_at, p.id
+    LIMIT :limit
+    """
+)
+
+# posts of the page the model has already, from its live worker or an earlier run
+existing_query = text(
+    """
+    SELECT post_id FROM embeddings
+    WHERE model_id = :model_id AND post_created_at >= :first AND post_created_at <= :last
+        AND post_id = ANY(CAST(:post_ids AS uuid[]))
+    """
+)
+
+# vectors as text, one array parameter per column, however many rows there are
+insert_embeddings_query = text(
+    """
+    INSERT INTO embeddings (model_id, post_id, post_created_at, embedding)
+    SELECT :model_id, post_id, post_created_at, CAST(embedding AS vector)
+    FROM unnest(
+        CAST(:post_ids AS uuid[]), CAST(:post_created_ats AS timestamp[]), CAST(:embeddings AS text[])
+    ) AS batch(post_id, post_created_at, embedding)
+    ON CONFLICT DO NOTHING
+    """
+)
+
+# only while the lease is ours, a worker that lost it stops
+checkpoint_query = text(
+    """
+    UPDATE embedding_backfill
+    SET last_created_at = :last_created_at, last_post_id = :last_post_id,
+        embedded = embedded + :embedded, claimed_until = now() + make_interval(secs => :lease)
+    WHERE model_id = :model_id AND shard_start = :shard_start AND claimed_by = :worker
+    """
+)
+
+renew_lease_query = text(
+    """
+    UPDATE embedding_backfill SET claimed_until = now() + make_interval(secs => :lease)
+    WHERE model_id = :model_id AND shard_start = :shard_start AND claimed_by = :worker
+    """
+)
+
+finish_shard_query = text(
+    """
+    UPDATE embedding_backfill
+    SET finished_at = now(), claimed_by = NULL, claimed_until = NULL
+    WHERE model_id = :model_id AND shard_start = :shard_start AND claimed_by = :worker
+    """
+)
+
+# recent posts the live workers haven't embedded yet, counted up to :limit
+live_backlog_query = text(
+    """
+    SELECT count(*) FROM (
+        SELECT 1
+        FROM posts p
+        JOIN embedding_models m ON m.id = :model_id OR m.active
+        WHERE p.created_at >= :since AND p.created_at >= m.live_from
+            AND p.canonical_id IS NULL AND p.record_text <> ''
+            AND NOT EXISTS (
+                SELECT 1 FROM embeddings e
+                WHERE e.model_id = m.id AND e.post_id = p.id AND e.post_created_at = p.created_at
+            )
+        LIMIT :limit
+    ) backlog
+    """
+)
+
+status_query = text(
+    """
+    SELECT m.name, m.active, m.live_from,
+        count(b.shard_start) AS shards,
+        count(b.finished_at) AS finished,
+        count(b.claimed_by) FILTER (WHERE b.claimed_until > now()) AS claimed,
+        coalesce(sum(b.embedded), 0) AS embedded,
+        min(b.shard_start) AS first_shard,
+        max(b.shard_end) AS last_shard
+    FROM embedding_models m
+    LEFT JOIN embedding_backfill b ON b.model_id = m.id
+    GROUP BY m.id
+    ORDER BY m.id
+    """
+)
+
+unfinished_shards_query = text(
+    """
+    SELECT count(*) FROM embedding_backfill WHERE model_id = :model_id AND finished_at IS NULL
+    """
+)
+
+feeds_missing_query = text(
+    """
+    SELECT count(*)
+    FROM feeds f
+    WHERE NOT EXISTS (SELECT 1 FROM feed_embeddings fe WHERE fe.feed_id = f.id AND fe.model_id = :model_id)
+        AND EXISTS (SELECT 1 FROM user_keywords k WHERE k.feed_id = f.id)
+    """
+)
+
+# how far back "recent" goes when measuring the live workers' backlog
+LIVE_BACKLOG_WINDOW = timedelta(hours=1)
+# seconds between backlog checks while paused
+PAUSE_SECONDS = 5
+
+
+def utc_naive(value: datetime) -> datetime:
+    """As stored in posts.created_at: UTC without a time zone."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def vector_text(embedding) -> str:
+    return "[" + ",".join(f"{value:.7g}" for value in embedding) + "]"
+
+
+class RateLimiter:
+    """A token bucket: at most `rate` posts a second, in bursts of up to a second's worth."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    def wait(self, posts: int) -> None:
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # a batch larger than the bucket only has to wait for a full one
+            needed = min(posts, self.rate)
+            if self.tokens >= needed:
+                self.tokens -= posts
+                return
+            time.sleep((needed - self.tokens) / self.rate)
+
+
+def live_backlog(conn, model_id: int) -> int:
+    since = utc_naive(datetime.now(timezone.utc) - LIVE_BACKLOG_WINDOW)
+    limit = settings.backfill_max_live_backlog + 1
+    return conn.execute(live_backlog_query, {"model_id": model_id, "since": since, "limit": limit}).scalar()
+
+
+def wait_for_live_workers(model_id: int, shard_start: datetime, worker: str) -> bool:
+    """Pause while the live workers are behind, keeping the lease. False if it was lost."""
+    while True:
+        with engine.begin() as conn:
+            backlog = live_backlog(conn, model_id)
+            if backlog <= settings.backfill_max_live_backlog:
+                return True
+            # extend the lease without moving the checkpoint
+            held = conn.execute(
+                renew_lease_query,
+                {
+                    "model_id": model_id,
+                    "shard_start": shard_start,
+                    "worker": worker,
+                    "lease": settings.backfill_lease_seconds,
+                },
+            ).rowcount
+        if not held:
+            return False
+        logger.info(f"{backlog - 1}+ recent posts waiting for live embedding, backfill paused")
+        time.sleep(PAUSE_SECONDS)
+
+
+def backfill_shard(model, model_id: int, shard, worker: str, limiter: RateLimiter) -> int:
+    """Embed the rest of a claimed shard, the number of posts embedded."""
+    last_created_at, last_post_id = shard.last_created_at, shard.last_post_id
+    embedded = 0
+    while True:
+        if not wait_for_live_workers(model_id, shard.shard_start, worker):
+            logger.warning(f"Lost the lease on shard {shard.shard_start}, leaving it")
+            return embedded
+        with engine.connect() as conn:
+            posts = conn.execute(
+                posts_page_query,
+                {
+                    "shard_start": shard.shard_start,
+                    "shard_end": shard.shard_end,
+                    "last_created_at": last_created_at,
+                    "last_post_id": last_post_id and str(last_post_id),
+                    "limit": settings.backfill_batch_size,
+                },
+            ).fetchall()
+            if not posts:
+                conn.execute(
+                    finish_shard_query,
+                    {"model_id": model_id, "shard_start": shard.shard_start, "worker": worker},
+                )
+                conn.commit()
+                return embedded
+            existing = {
+                str(row.post_id)
+                for row in conn.execute(
+                    existing_query,
+                    {
+                        "model_id": model_id,
+                        "first": posts[0].created_at,
+                        "last": posts[-1].created_at,
+                        "post_ids": [str(post.id) for post in posts],
+                    },
+                )
+            }
+        # near-duplicates and posts without text aren't embedded, like in the live worker
+        todo = [
+            post for post in posts
+            if post.record_text and post.canonical_id is None and str(post.id) not in existing
+        ]
+        limiter.wait(len(todo))
+        embeddings = (
+            model.encode(
+                [post.record_text for post in todo],
+                batch_size=settings.backfill_batch_size,
+                convert_to_numpy=True,
+                show_progress_bar=False,
+            )
+            if todo
+            else []
+        )
+        with engine.begin() as conn:
+            held = conn.execute(
+                checkpoint_query,
+                {
+                    "model_id": model_id,
+                    "shard_start": shard.shard_start,
+                    "worker": worker,
+                    "last_created_at": posts[-1].created_at,
+                    "last_post_id": str(posts[-1].id),
+                    "embedded": len(todo),
+                    "lease": settings.backfill_lease_seconds,
+                },
+            ).rowcount
+            if not held:
+                conn.rollback()
+                logger.warning(f"Lost the lease on shard {shard.shard_start}, leaving it")
+                return embedded
+            if todo:
+                conn.execute(
+                    insert_embeddings_query,
+                    {
+                        "model_id": model_id,
+                        "post_ids": [str(post.id) for post in todo],
+                        "post_created_ats": [post.created_at for post in todo],
+                        "embeddings": [vector_text(embedding) for embedding in embeddings],
+                    },
+                )
+        last_created_at, last_post_id = posts[-1].created_at, posts[-1].id
+        embedded += len(todo)
+
+
+def run_worker(model_name: str, model_id: int, index: int, workers: int) -> int:
+    """One worker process: claim shards until there are none left."""
+    # the live workers come first
+    os.nice(10)
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    model = load_model(model_name)
+    limiter = RateLimiter(settings.backfill_posts_per_second / workers)
+    total = 0
+    while True:
+        with engine.begin() as conn:
+            shard = conn.execute(
+                claim_shard_query,
+                {"model_id": model_id, "worker": worker, "lease": settings.backfill_lease_seconds},
+            ).fetchone()
+        if shard is None:
+            logger.info(f"Worker {index} is done, {total} posts embedded")
+            return total
+        started = time.monotonic()
+        embedded = backfill_shard(model, model_id, shard, worker, limiter)
+        total += embedded
+        logger.info(
+            f"Worker {index} embedded {embedded} posts of shard {shard.shard_start} to {shard.shard_end} "
+            f"in {time.monotonic() - started:.1f} seconds"
+        )
+
+
+def run(model_name: str, after: datetime | None, before: datetime | None, workers: int) -> None:
+    with engine.begin() as conn:
+        model = get_model(conn, model_name)
+        if model is None:
+            # from now on the model's live worker embeds new posts, once it runs
+            dimensions = load_model(model_name).get_sentence_embedding_dimension()
+            model = register_model(conn, model_name, dimensions)
+        # posts from live_from on are the live worker's. The model the embeddings table
+        # started with has always been live ('-infinity', which psycopg2 reads as
+        # datetime.min), there's nothing before it.
+        if model.live_from == datetime.min:
+            raise SystemExit(f"Nothing to backfill, {model_name}'s live worker has embedded every post")
+        before = min(utc_naive(before), model.live_from) if before else model.live_from
+        after = utc_naive(after) if after else before - timedelta(days=7)
+        if after < before:
+            conn.execute(plan_shards_query, {"model_id": model.id, "after": after, "before": before})
+    if after >= before:
+        raise SystemExit(f"Nothing to backfill, {model_name} is live from {model.live_from}")
+    logger.info(f"Backfilling {model_name} from {after} to {before} with {workers} workers")
+
+    started = time.monotonic()
+    # CUDA doesn't survive a fork
+    with multiprocessing.get_context("spawn").Pool(workers) as pool:
+        embedded = pool.starmap(run_worker, [(model_name, model.id, i, workers) for i in range(workers)])
+    logger.info(f"Embedded {sum(embedded)} posts in {time.monotonic() - started:.1f} seconds")
+    status()
+
+
+def status() -> None:
+    with engine.connect() as conn:
+        for model in conn.execute(status_query):
+            state = "active" if model.active else "inactive"
+            print(f"{model.name} ({state}, live from {model.live_from})")
+            if model.shards:
+                print(
+                    f"  {model.finished} of {model.shards} shards done, {model.claimed} in progress, "
+                    f"{model.embedded} posts embedded, {model.first_shard} to {model.last_shard}"
+                )
+
+
+def activate_model(model_name: str, force: bool) -> None:
+    with engine.begin() as conn:
+        model = get_model(conn, model_name)
+        if model is None:
+            raise SystemExit(f"Unknown model {model_name}, run its embedding worker or a backfill first")
+        if model.active:
+            print(f"{model_name} is already active")
+            return
+        unfinished = conn.execute(unfinished_shards_query, {"model_id": model.id}).scalar()
+        feeds = conn.execute(feeds_missing_query, {"model_id": model.id}).scalar()
+        if (unfinished or feeds) and not force:
+            raise SystemExit(
+                f"{model_name} has {unfinished} shards to backfill and {feeds} feeds without embeddings, "
+                "use --force to activate it anyway"
+            )
+        previous = active_model(conn)
+        activate(conn, model.id)
+    print(f"Activated {model_name}" + (f", was {previous.name}" if previous else ""))
+
+
+def _datetime(value: str) -> datetime:
+    return datetime.fromisoformat(value)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["run", "status", "activate"])
+    parser.add_argument("--model", default=settings.embedding_model)
+    parser.add_argument("--after", type=_datetime, help="default is a week before --before")
+    parser.add_argument("--before", type=_datetime, help="default is when the model's live worker took over")
+    parser.add_argument("--workers", type=int, default=1, help="processes, each with its own copy of the model")
+    parser.add_argument("--force", action="store_true", help="activate even if the backfill isn't finished")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        run(args.model, args.after, args.before, args.workers)
+    elif args.command == "status":
+        status()
+    else:
+        activate_model(args.model, args.force)
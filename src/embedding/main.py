@@ -1,11 +1,11 @@
 import asyncio
 import logging
+import re
 from datetime import datetime, UTC
-from sentence_transformers import SentenceTransformer
+from embedding.models import load_model, register_model
+from embedding.scheduler import FreshnessScheduler
 from shared.config import settings
 from sqlalchemy import create_engine
-import numpy as np
-import torch
 from sqlalchemy import text
 
 # Configure logging
@@ -18,11 +18,9 @@ logger = logging.getLogger(__name__)
 engine = create_engine(settings.database_url)
 
 # Initialize the embedding model
-# Using all-MiniLM-L6-v2 as it's a good balance of speed and quality
-model = SentenceTransformer(
-    "all-MiniLM-L6-v2", device="cuda" if torch.cuda.is_available() else "cpu"
-    # "nomic-ai/nomic-embed-text-v2-moe", trust_remote_code=True
-)
+# all-MiniLM-L6-v2 by default as it's a good balance of speed and quality. Each
+# model's embeddings are stored separately, see embedding.models.
+model = load_model(settings.embedding_model)
 
 
 def generate_embedding(text: str) -> list[float]:
@@ -36,27 +34,64 @@ def generate_embedding(text: str) -> list[float]:
         return None
 
 
+def feed_text(keywords: list[str]) -> str:
+    """The text we embed for a feed: its keywords without operators or negated terms"""
+    text = " ".join(keywords)
+    text = re.sub(r'!\s*(\([^)]*\)|"[^"]*"|[^\s&|!()"]+)', " ", text)
+    return " ".join(re.sub(r'[&|!()"]', " ", text).split())
+
+
+def embed_feeds(conn, model_id: int):
+    """Embed the keywords of feeds that don't have an embedding from this model yet"""
+    feeds = conn.execute(
+        text("""
+        SELECT f.id, array_agg(k.keyword ORDER BY k.id) AS keywords
+        FROM feeds f
+        JOIN user_keywords k ON k.feed_id = f.id
+        LEFT JOIN feed_embeddings fe ON fe.feed_id = f.id AND fe.model_id = :model_id
+        WHERE fe.feed_id IS NULL
+        GROUP BY f.id
+        LIMIT 100;
+        """),
+        {"model_id": model_id}
+    ).fetchall()
+
+    for feed in feeds:
+        embedding = generate_embedding(feed_text(feed.keywords))
+        if embedding:
+            conn.execute(
+                text("""
+                INSERT INTO feed_embeddings (feed_id, model_id, embedding, created_at)
+                VALUES (:feed_id, :model_id, :embedding, :created_at)
+                ON CONFLICT (feed_id, model_id) DO NOTHING;
+                """),
+                {"feed_id": feed.id, "model_id": model_id, "embedding": embedding, "created_at": datetime.now(UTC)}
+            )
+            logger.info(f"Generated embedding for feed {feed.id}")
+
+
 async def run_ingestion():
     """Main ingestion loop to process posts without embeddings"""
-    logger.info("Starting embedding ingestion process")
+    logger.info(f"Starting embedding ingestion process with {settings.embedding_model}")
     batch_size = settings.batch_size
 
+    # The posts before the model was first used here are left to a backfill
+    with engine.begin() as conn:
+        registered = register_model(conn, settings.embedding_model, model.get_sentence_embedding_dimension())
+    logger.info(f"Embedding posts from {registered.live_from} on as model {registered.id}")
+    scheduler = FreshnessScheduler(registered.id, registered.live_from)
+
     while True:
         try:
             with engine.begin() as conn:
-                # Get a batch of posts without embeddings, ordered by created_at
+                # Feeds first, there are few of them and hybrid ranking needs them
+                embed_feeds(conn, registered.id)
+
+                # Get a batch of posts without embeddings, the newest first
                 pull_time = datetime.now(UTC)
-                posts = conn.execute(
-                    text("""
-                    SELECT p.id, p.created_at, p.record_text 
-                    FROM posts p
-                    LEFT JOIN embeddings e ON p.id = e.post_id
-                    WHERE e.post_id IS NULL
-                    LIMIT :batch_size;
-                    """),
-                    {"batch_size": batch_size}
-                ).fetchall()
+                posts = scheduler.next_batch(conn, batch_size)
                 elapsed_pull = (datetime.now(UTC) - pull_time).total_seconds()
+                scheduler.report(conn)
 
                 if not posts:
                     logger.info("No posts found without embeddings, waiting...")
@@ -80,15 +115,16 @@ async def run_ingestion():
                         query_time = datetime.now(UTC)
                         result = conn.execute(
                             text("""
-                            INSERT INTO embeddings (id, post_id, post_created_at, embedding, created_at, updated_at)
-                            VALUES (0, :post_id, :post_created_at, :embedding, :created_at, :updated_at);
+                            INSERT INTO embeddings (model_id, post_id, post_created_at, embedding, created_at)
+                            VALUES (:model_id, CAST(:post_id AS uuid), :post_created_at, :embedding, :created_at)
+                            ON CONFLICT DO NOTHING;
                             """),
                             {
-                                "post_id": post.id,
+                                "model_id": registered.id,
+                                "post_id": str(post.id),
                                 "post_created_at": post.created_at,
                                 "embedding": embedding,
-                                "created_at": datetime.now(UTC),
-                                "updated_at": datetime.now(UTC)
+                                "created_at": datetime.now(UTC)
                             }
                         )
                         elapsed_query += (datetime.now(UTC) - query_time).total_seconds()
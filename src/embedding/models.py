@@ -0,0 +1,132 @@
+"""
+Embedding model versions.
+
+Every embedding is stored with the id of the model that produced it (see
+`embedding_models`), so embeddings of several models live side by side: the one
+readers use, and a new one being filled in by its own embedding worker and a
+backfill (embedding.backfill). Exactly one model is active, feed_service ranks
+with its embeddings and nothing else, and switching is one UPDATE, so readers
+see the old model or the new one and never a mix.
+"""
+
+import logging
+from datetime import datetime, UTC
+from typing import Optional
+
+from sqlalchemy import text
+
+from shared.config import settings
+
+logger = logging.getLogger(__name__)
+
+model_query = text(
+    """
+    SELECT id, name, dimensions, active, live_from, activated_at
+    FROM embedding_models
+    WHERE name = :name
+    """
+)
+
+active_model_query = text(
+    """
+    SELECT id, name, dimensions, active, live_from, activated_at
+    FROM embedding_models
+    WHERE active
+    """
+)
+
+# posts from now on are the live worker's, older ones need a backfill
+register_model_query = text(
+    """
+    INSERT INTO embedding_models (name, dimensions, live_from)
+    VALUES (:name, :dimensions, :live_from)
+    ON CONFLICT (name) DO NOTHING
+    """
+)
+
+# in one transaction, readers see either the old model or the new one active. Two
+# statements, the unique index on active is checked row by row.
+deactivate_query = text(
+    """
+    UPDATE embedding_models SET active = false WHERE active AND id <> :model_id
+    """
+)
+
+activate_query = text(
+    """
+    UPDATE embedding_models SET active = true, activated_at = now()
+    WHERE id = :model_id AND NOT active
+    """
+)
+
+
+dimensions_query = text("SELECT dimensions FROM embedding_models WHERE id = :model_id")
+
+
+def vector_index_name(model_id: int) -> str:
+    return f"idx_embeddings_model_{int(model_id)}_hnsw"
+
+
+def create_vector_index(conn, model_id: int, dimensions: int) -> None:
+    """
+    The model's HNSW index for nearest-neighbour search. The embedding column takes
+    vectors of any dimension and can't be indexed as it is, so every model gets a
+    partial index on its own embeddings cast to its dimension. feed_service's hybrid
+    query casts the same way to use it.
+    """
+    conn.execute(
+        text(
+            f"""
+            CREATE INDEX IF NOT EXISTS {vector_index_name(model_id)} ON embeddings
+            USING hnsw ((CAST(embedding AS vector({int(dimensions)}))) vector_cosine_ops)
+            WHERE model_id = {int(model_id)}
+            """
+        )
+    )
+
+
+def load_model(name: Optional[str] = None):
+    """The sentence-transformers model, on the GPU if there is one."""
+    # imported here so the backfill CLI's status and activate don't need torch
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    return SentenceTransformer(
+        name or settings.embedding_model,
+        device="cuda" if torch.cuda.is_available() else "cpu",
+        trust_remote_code=settings.embedding_trust_remote_code,
+    )
+
+
+def get_model(conn, name: str):
+    return conn.execute(model_query, {"name": name}).fetchone()
+
+
+def active_model(conn):
+    return conn.execute(active_model_query).fetchone()
+
+
+def register_model(conn, name: str, dimensions: int):
+    """The model's row, added the first time a worker embeds with it."""
+    conn.execute(
+        register_model_query,
+        {"name": name, "dimensions": dimensions, "live_from": datetime.now(UTC).replace(tzinfo=None)},
+    )
+    model = get_model(conn, name)
+    if model.dimensions != dimensions:
+        raise ValueError(
+            f"Model {name} is registered with {model.dimensions} dimensions, it now has {dimensions}"
+        )
+    # while the model has next to no embeddings, building it is quick
+    create_vector_index(conn, model.id, model.dimensions)
+    return model
+
+
+def activate(conn, model_id: int) -> None:
+    """Make the model the one readers use. Commit to switch."""
+    # registering it created the index, unless that was before there were indexes
+    dimensions = conn.execute(dimensions_query, {"model_id": model_id}).scalar()
+    create_vector_index(conn, model_id, dimensions)
+    conn.execute(deactivate_query, {"model_id": model_id})
+    conn.execute(activate_query, {"model_id": model_id})
+    logger.info(f"Activated embedding model {model_id}")
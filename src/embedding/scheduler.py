@@ -0,0 +1,142 @@
+"""
+Which posts the embedding worker embeds next.
+
+Feeds show fresh posts, so after a burst or a restart the worker must not work
+through its backlog oldest first (or in whatever order Postgres finds it) while new
+posts wait. Every batch is filled newest first from the fresh window (the last
+embedding_fresh_minutes), and whatever room is left goes to older posts, again
+newest first. Posts older than embedding_horizon_hours aren't embedded at all: by
+then they've dropped out of hybrid ranking's window, and the time is better spent
+on new ones.
+
+Finding older posts without embeddings means checking posts that have them, so the
+scheduler remembers how far down it has found nothing left to do (`settled`) and
+only looks above that, starting over from the horizon every
+embedding_rescan_seconds to pick up posts that arrived late with an older
+created_at.
+
+The backlog (posts waiting, and how old the oldest is) and the posts that went past
+the horizon without an embedding are logged every embedding_report_seconds.
+"""
+
+import logging
+import time
+from datetime import datetime, timedelta, UTC
+from typing import List, Optional
+
+from sqlalchemy import text
+
+from shared.config import settings
+
+logger = logging.getLogger(__name__)
+
+# newest first, near-duplicates and posts without text are never embedded
+pending_query = text(
+    """
+    SELECT p.id, p.created_at, p.record_text
+    FROM posts p
+    WHERE p.created_at >= :after AND p.created_at < :before
+        AND p.canonical_id IS NULL AND p.record_text <> ''
+        AND NOT EXISTS (
+            SELECT 1 FROM embeddings e
+            WHERE e.model_id = :model_id AND e.post_id = p.id AND e.post_created_at = p.created_at
+        )
+    ORDER BY p.created_at DESC
+    LIMIT :limit
+    """
+)
+
+backlog_query = text(
+    """
+    SELECT count(*) AS posts, min(created_at) AS oldest
+    FROM (
+        SELECT p.created_at
+        FROM posts p
+        WHERE p.created_at >= :after AND p.created_at < :before
+            AND p.canonical_id IS NULL AND p.record_text <> ''
+            AND NOT EXISTS (
+                SELECT 1 FROM embeddings e
+                WHERE e.model_id = :model_id AND e.post_id = p.id AND e.post_created_at = p.created_at
+            )
+        ORDER BY p.created_at
+        LIMIT :limit
+    ) pending
+    """
+)
+
+# posts dated a little in the future are fresh too
+FUTURE = timedelta(days=1)
+# the backlog is counted up to this many posts
+BACKLOG_COUNT_LIMIT = 100_000
+
+
+def utc_now() -> datetime:
+    """Now as posts.created_at stores it, UTC without a time zone."""
+    return datetime.now(UTC).replace(tzinfo=None)
+
+
+class FreshnessScheduler:
+    def __init__(self, model_id: int, live_from: datetime):
+        self.model_id = model_id
+        # the model's live worker doesn't embed posts from before it started
+        self.live_from = live_from
+        # no posts between the horizon and this are waiting, None when unknown
+        self.settled: Optional[datetime] = None
+        self.rescanned = time.monotonic()
+        self.reported = time.monotonic()
+        self.reported_horizon: Optional[datetime] = None
+
+    def horizon(self, now: datetime) -> datetime:
+        return max(self.live_from, now - timedelta(hours=settings.embedding_horizon_hours))
+
+    def _pending(self, conn, after: datetime, before: datetime, limit: int) -> List:
+        params = {"model_id": self.model_id, "after": after, "before": before, "limit": limit}
+        return conn.execute(pending_query, params).fetchall()
+
+    def next_batch(self, conn, batch_size: int) -> List:
+        """Up to batch_size posts to embed, fresh ones first."""
+        now = utc_now()
+        horizon = self.horizon(now)
+        fresh_start = max(horizon, now - timedelta(minutes=settings.embedding_fresh_minutes))
+        posts = self._pending(conn, fresh_start, now + FUTURE, batch_size)
+
+        if time.monotonic() - self.rescanned > settings.embedding_rescan_seconds:
+            self.settled = None
+            self.rescanned = time.monotonic()
+        leftover = batch_size - len(posts)
+        if leftover > 0 and fresh_start > horizon:
+            after = max(horizon, self.settled) if self.settled else horizon
+            older = self._pending(conn, after, fresh_start, leftover)
+            if len(older) < leftover:
+                # everything older than the fresh window is done (or past the horizon)
+                self.settled = fresh_start
+            posts.extend(older)
+        return posts
+
+    def report(self, conn) -> None:
+        """Log the backlog every embedding_report_seconds."""
+        if time.monotonic() - self.reported < settings.embedding_report_seconds:
+            return
+        self.reported = time.monotonic()
+        now = utc_now()
+        horizon = self.horizon(now)
+        params = {"model_id": self.model_id, "before": now + FUTURE, "limit": BACKLOG_COUNT_LIMIT}
+        after = max(horizon, self.settled) if self.settled else horizon
+        backlog = conn.execute(backlog_query, {**params, "after": after}).fetchone()
+        # the posts that went past the horizon since the last report without an embedding
+        shed = 0
+        if self.reported_horizon is not None and self.reported_horizon < horizon:
+            shed = conn.execute(
+                backlog_query, {**params, "after": self.reported_horizon, "before": horizon}
+            ).fetchone().posts
+        self.reported_horizon = horizon
+
+        if not backlog.posts:
+            logger.info(f"Embedding backlog is empty, {shed} posts dropped past the horizon")
+            return
+        age = (now - backlog.oldest).total_seconds()
+        more = "+" if backlog.posts >= BACKLOG_COUNT_LIMIT else ""
+        logger.info(
+            f"Embedding backlog: {backlog.posts}{more} posts, the oldest {age:.0f} seconds old, "
+            f"{shed} posts dropped past the {settings.embedding_horizon_hours} hour horizon"
+        )
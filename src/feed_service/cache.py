@@ -0,0 +1,91 @@
+"""
+A small in-process TTL + LRU cache.
+
+Each uvicorn worker has its own copy, so anything cached here must be invalidated
+across workers when it changes, see `feed_service.notify`.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+_MISSING = object()
+
+
+class TTLCache:
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # key -> (expires at, value), least recently used first
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not _MISSING:
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(
+        self, key: Hashable, value: Any, ttl: Optional[float] = None, invalidations: Optional[int] = None
+    ) -> None:
+        """
+        Store a value, `ttl` may shorten (but not extend) the cache's own TTL. With
+        `invalidations`, only if the cache hasn't been invalidated since that count was
+        read: the value may have been loaded before the change.
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        with self._lock:
+            if invalidations is not None and invalidations != self.invalidations:
+                return
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get_or_load(self, key: Hashable, load: Callable[[], Any]) -> Any:
+        """
+        Return the cached value, or load and cache it. `None` is never cached, nor is a
+        value whose load overlapped an invalidation.
+        """
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            invalidations = self.invalidations
+            value = load()
+            if value is not None:
+                self.set(key, value, invalidations=invalidations)
+        return value
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self.invalidations += 1
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.invalidations += 1
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else None,
+            "invalidations": self.invalidations,
+        }
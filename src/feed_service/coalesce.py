@@ -0,0 +1,74 @@
+"""
+Request coalescing ("singleflight") for feed pages.
+
+When a popular feed is polled by many clients at once, every request would run the
+same full-text query. Here the first request for a key runs the query, in a thread
+so the event loop keeps serving, and identical requests arriving while it runs
+await the same result instead of querying again.
+
+Optionally results are also kept for a very short time (`micro_cache_seconds`),
+which absorbs bursts of requests that arrive just after a query finished. Keep it
+to a second or two: cached pages miss posts ingested in the meantime.
+"""
+
+import asyncio
+from typing import Any, Callable, Dict, Hashable
+
+from feed_service.cache import TTLCache
+
+_MISSING = object()
+
+
+class Singleflight:
+    def __init__(self, name: str, micro_cache_seconds: float = 0, micro_cache_size: int = 10_000):
+        self.name = name
+        self.micro_cache = (
+            TTLCache(name, micro_cache_size, micro_cache_seconds) if micro_cache_seconds > 0 else None
+        )
+        # key -> task running the load, while it runs
+        self._flights: Dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.loads = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    async def do(self, key: Hashable, load: Callable[[], Any]) -> Any:
+        """Result of `load()`, shared with any identical call already in flight."""
+        self.calls += 1
+        if self.micro_cache is not None:
+            value = self.micro_cache.get(key, _MISSING)
+            if value is not _MISSING:
+                return value
+
+        task = self._flights.get(key)
+        if task is None:
+            self.loads += 1
+            task = asyncio.create_task(asyncio.to_thread(load))
+            self._flights[key] = task
+            task.add_done_callback(lambda t: self._landed(key, t))
+        else:
+            self.coalesced += 1
+        # shielded, so a client going away doesn't cancel the load for the others
+        return await asyncio.shield(task)
+
+    def _landed(self, key: Hashable, task: asyncio.Task) -> None:
+        self._flights.pop(key, None)
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            # not cached, the next request tries again
+            self.errors += 1
+        elif self.micro_cache is not None:
+            self.micro_cache.set(key, task.result())
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "loads": self.loads,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            # share of calls that didn't run a query, coalesced or from the micro-cache
+            "saved_ratio": 1 - self.loads / self.calls if self.calls else None,
+            "in_flight": len(self._flights),
+            "micro_cache": self.micro_cache.stats() if self.micro_cache is not None else None,
+        }
@@ -0,0 +1,107 @@
+"""
+Feed definitions: the keywords of a feed, the tsquery compiled from them and the
+languages it's limited to.
+
+Definitions are read on every feed request, so they're cached per worker and
+invalidated through NOTIFY whenever a feed is created or deleted.
+"""
+
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from feed_service.cache import TTLCache
+from feed_service.notify import notify
+from feed_service.query import compile_keywords
+from shared.config import settings
+from shared.database import engine, SessionLocal
+
+FEED_CHANNEL = "feed_definitions"
+
+
+@dataclass(frozen=True)
+class FeedDefinition:
+    feed_id: int
+    user_id: int
+    keywords: List[str]
+    tsquery: str
+    collapse_duplicates: bool = True
+    # primary language subtags of the posts included, empty for all
+    languages: Tuple[str, ...] = ()
+
+
+feed_definitions = TTLCache(
+    "feeds", settings.feed_cache_size, settings.feed_cache_ttl_seconds
+)
+
+
+def load_feed_definition(db: Session, feed_id: int) -> Optional[FeedDefinition]:
+    query = text(
+        """
+        SELECT f.user_id, f.tsquery, f.collapse_duplicates, f.languages, array_agg(k.keyword ORDER BY k.id) AS keywords
+        FROM feeds f
+        JOIN user_keywords k ON k.feed_id = f.id
+        WHERE f.id = :feed_id
+        GROUP BY f.id
+    """
+    )
+    feed = db.execute(query, {"feed_id": feed_id}).first()
+    if feed is None:
+        return None
+    # feeds created before keywords were compiled don't have a stored tsquery yet,
+    # this raises KeywordSyntaxError if their keywords aren't valid anymore
+    tsquery = feed.tsquery or compile_keywords(feed.keywords)
+    return FeedDefinition(
+        feed_id, feed.user_id, feed.keywords, tsquery, feed.collapse_duplicates, tuple(feed.languages)
+    )
+
+
+def get_feed_definition(db: Session, feed_id: int) -> Optional[FeedDefinition]:
+    def load() -> Optional[FeedDefinition]:
+        feed = load_feed_definition(db, feed_id)
+        if feed is None and db.get_bind() is not engine:
+            # read on a replica, which may not have replayed a feed that was just created
+            with SessionLocal() as primary:
+                feed = load_feed_definition(primary, feed_id)
+        return feed
+
+    return feed_definitions.get_or_load(feed_id, load)
+
+
+def feed_changed(db: Session, feed_id: int) -> None:
+    """Drop a feed from this worker's cache and tell the other workers on commit."""
+    feed_definitions.invalidate(feed_id)
+    notify(db, FEED_CHANNEL, str(feed_id))
+
+
+# The columns post_json needs, from `posts` aliased as `p` joined with POST_ACTORS_SQL.
+# Authors and reply targets are stored as actor ids, URIs are put back together here.
+POST_COLUMNS_SQL = """p.id, author.did, p.record_text, p.created_at, p.canonical_id,
+    'at://' || parent.did || '/app.bsky.feed.post/' || p.reply_parent_rkey AS reply_parent_uri,
+    'at://' || root.did || '/app.bsky.feed.post/' || p.reply_root_rkey AS reply_root_uri"""
+
+POST_ACTORS_SQL = """JOIN actors author ON author.id = p.actor_id
+    LEFT JOIN actors parent ON parent.id = p.reply_parent_actor_id
+    LEFT JOIN actors root ON root.id = p.reply_root_actor_id"""
+
+
+def post_json(post) -> dict:
+    """A `posts` row as returned by the API, see PostResponse."""
+    return {
+        "id": str(post.id),
+        "author": post.did,
+        "text": post.record_text,
+        "created_at": post.created_at.isoformat(),
+        "reply_to": post.reply_parent_uri,
+        "thread_root": post.reply_root_uri,
+        "duplicate_of": post.canonical_id and str(post.canonical_id),
+    }
+
+
+def on_feed_notification(payload: Optional[str]) -> None:
+    if payload is None:
+        feed_definitions.clear()
+    else:
+        feed_definitions.invalidate(int(payload))
@@ -1,12 +1,60 @@
-from fastapi import FastAPI, HTTPException, Depends, Security, APIRouter
+from fastapi import FastAPI, HTTPException, Depends, Security, APIRouter, Query
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from sqlalchemy import text
-from typing import List
+from typing import List, Literal
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta, UTC
 from pydantic import BaseModel, EmailStr
 from shared.config import settings
-from shared.database import get_db
+from shared.text_search import valid_language
+from shared.database import (
+    engine,
+    get_db,
+    get_read_db,
+    PreparedStatement,
+    read_session,
+    replicas,
+    SessionLocal,
+)
+from feed_service.cache import TTLCache
+from feed_service.coalesce import Singleflight
+from feed_service.feeds import (
+    FEED_CHANNEL,
+    feed_changed,
+    feed_definitions,
+    get_feed_definition,
+    on_feed_notification,
+    POST_ACTORS_SQL,
+    POST_COLUMNS_SQL,
+    post_json,
+)
+from feed_service.notify import PgListener
+from feed_service.profiling import QueryProfiler, explainable
+from feed_service.recent_index import RecentIndex
+from feed_service.query import (
+    compile_keywords,
+    DUPLICATES_SQL,
+    duplicates_sql,
+    FEED_QUERIES_SQL,
+    IN_LANGUAGES_SQL,
+    KeywordSyntaxError,
+    LANGUAGES_SQL,
+    languages_sql,
+    MATCH_SQL,
+    TSVECTOR_SQL,
+    tsquery_sql,
+)
+from feed_service.search import WindowedSearch
+from feed_service.skeleton import SkeletonCache, decode_cursor, encode_cursor
+from feed_service.stats import load_stats
+from feed_service.stream import POSTS_CHANNEL, FeedStreamHub
+from feed_service.threads import thread_context, thread_roots
+from feed_service.trending import TrendingCache
+import asyncio
+import functools
+import time
 import bcrypt
 import jwt
 from jwt.exceptions import InvalidTokenError
@@ -37,10 +85,93 @@ logging_config = {
 dictConfig(logging_config)
 logger = logging.getLogger(__name__)
 
+feed_search_windows = [timedelta(hours=h) for h in settings.feed_search_windows_hours]
+
+skeletons = SkeletonCache(
+    read_session,
+    WindowedSearch(feed_search_windows),
+    size=settings.skeleton_size,
+    refresh_seconds=settings.skeleton_refresh_seconds,
+    idle_seconds=settings.skeleton_idle_seconds,
+    backdate=timedelta(hours=settings.post_backdate_hours),
+)
+
+feed_pages = Singleflight(
+    "feed_pages",
+    micro_cache_seconds=settings.feed_micro_cache_seconds,
+    micro_cache_size=settings.feed_micro_cache_size,
+)
+
+# on the primary: streams query posts as soon as they're NOTIFYed, which a replica
+# may not have replayed yet
+streams = FeedStreamHub(
+    SessionLocal,
+    queue_size=settings.stream_queue_size,
+    keepalive_seconds=settings.stream_keepalive_seconds,
+    backdate=timedelta(hours=settings.post_backdate_hours),
+)
+
+# on the primary too, it loads the posts of every posts_inserted notification
+recent_index = (
+    RecentIndex(
+        SessionLocal,
+        window=timedelta(hours=settings.recent_index_hours),
+        segment=timedelta(minutes=settings.recent_index_segment_minutes),
+        refresh_seconds=settings.recent_index_refresh_seconds,
+        max_feeds=settings.feed_cache_size,
+    )
+    if settings.recent_index_enabled
+    else None
+)
+
+trending = TrendingCache(read_session, settings.trending_refresh_seconds)
+
+profiler = QueryProfiler(
+    size=settings.query_log_size,
+    slow_ms=settings.slow_query_ms,
+    explain_sample_rate=settings.explain_sample_rate,
+)
+if settings.query_profiling_enabled:
+    profiler.attach(engine)
+    for replica in replicas.replicas:
+        profiler.attach(replica.engine)
+
+# one LISTEN connection per worker, used to invalidate caches across workers
+listener = PgListener(settings.database_url)
+listener.subscribe(FEED_CHANNEL, on_feed_notification)
+listener.subscribe(
+    FEED_CHANNEL, lambda payload: skeletons.invalidate(payload and int(payload))
+)
+listener.subscribe(POSTS_CHANNEL, streams.on_posts_inserted)
+if recent_index is not None:
+    listener.subscribe(POSTS_CHANNEL, recent_index.on_posts_inserted)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await listener.start()
+    replicas.start()
+    skeletons.start()
+    streams.start()
+    if recent_index is not None:
+        recent_index.start()
+    trending.start()
+    yield
+    await trending.stop()
+    if recent_index is not None:
+        await recent_index.stop()
+    await streams.stop()
+    await skeletons.stop()
+    await replicas.stop()
+    await listener.stop()
+    profiler.shutdown()
+
+
 app = FastAPI(
     title="Bluesky Custom Feed API",
     description="API for creating and managing custom Bluesky feeds based on keywords",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # Security configuration
@@ -50,6 +181,9 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# access token -> user id, so authenticated requests don't look the user up every time
+user_cache = TTLCache("users", settings.user_cache_size, settings.user_cache_ttl_seconds)
+
 
 class Token(BaseModel):
     access_token: str
@@ -102,6 +236,8 @@ class PostResponse(BaseModel):
     created_at: str
     reply_to: str | None
     thread_root: str | None
+    score: float | None = None
+    duplicate_of: str | None = None
 
 
 class FeedListingResponse(BaseModel):
@@ -126,6 +262,83 @@ class FeedResponse(BaseModel):
 
     feed: List[PostResponse]
     keywords: List[str]
+    languages: List[str] = []
+    # with include=thread: the posts replied to and thread roots, by URI
+    threads: dict[str, PostResponse] = {}
+
+
+class SkeletonFeedPost(BaseModel):
+    post: str
+
+
+class FeedSkeletonResponse(BaseModel):
+    """
+    Response of app.bsky.feed.getFeedSkeleton: post AT-URIs, newest first.
+    """
+
+    cursor: str | None = None
+    feed: List[SkeletonFeedPost]
+
+
+class FeedPageResponse(FeedResponse):
+    feed_id: int
+
+
+class BatchFeedResponse(BaseModel):
+    """
+    One page per requested feed, in the order they were asked for.
+    """
+
+    feeds: List[FeedPageResponse]
+
+
+class TrendingTerm(BaseModel):
+    term: str
+    count: int
+
+
+class TrendingResponse(BaseModel):
+    """
+    Most used words and phrases over a window, as of `updated_at`.
+    """
+
+    window: str
+    updated_at: datetime | None
+    terms: List[TrendingTerm]
+
+
+class LanguageStats(BaseModel):
+    lang: str
+    posts: int
+
+
+class StatsBucket(BaseModel):
+    bucket: datetime
+    posts: int
+    lag_seconds_avg: float | None
+    lag_seconds_max: float | None
+    min_cursor: int | None
+    max_cursor: int | None
+
+
+class StatsResponse(BaseModel):
+    """
+    Ingestion over a window: volume, ingest lag (`ingest_time - created_at`), languages
+    and how far the cursor has got. `lang` is a post's first language, "" if it has none.
+    """
+
+    window: str
+    posts: int
+    posts_per_minute: float
+    lag_seconds_avg: float | None
+    lag_seconds_max: float | None
+    cursor: int | None
+    cursor_time: datetime | None
+    last_ingest_time: datetime | None
+    total_posts: int
+    total_size_bytes: int
+    languages: List[LanguageStats]
+    buckets: List[StatsBucket]
 
 
 class FeedCreate(BaseModel):
@@ -146,29 +359,40 @@ def create_access_token(data: dict):
 async def get_current_user(
     token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)
 ) -> int:
+    user_id = user_cache.get(token)
+    if user_id is not None:
+        return user_id
+
     credentials_exception = HTTPException(
         status_code=401,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        print(token)
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        print(payload)
-        user_id: int = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
-    except InvalidTokenError as e:
-        print(e)
+        user_id = int(payload.get("sub"))
+    except (InvalidTokenError, TypeError, ValueError) as e:
+        logger.debug(f"Rejected access token: {e}")
         raise credentials_exception
 
     user_query = text("SELECT id FROM users WHERE id = :user_id")
     user = db.execute(user_query, {"user_id": user_id}).first()
     if user is None:
         raise credentials_exception
+
+    # never keep a token around longer than it's valid, tokens without an expiry only
+    # for the cache's own user_cache_ttl_seconds
+    expires = payload.get("exp")
+    user_cache.set(token, user_id, ttl=None if expires is None else expires - time.time())
     return user_id
 
 
+async def get_admin_user(current_user_id: int = Depends(get_current_user)) -> int:
+    if current_user_id not in settings.admin_user_ids:
+        raise HTTPException(status_code=403, detail="Not allowed")
+    return current_user_id
+
+
 def hash_password(password: str) -> str:
     salt = bcrypt.gensalt()
     return bcrypt.hashpw(password.encode("utf-8"), salt).decode("utf-8")
@@ -238,7 +462,7 @@ async def create_user(user: UserCreate, db: Session = Depends(get_db)):
 
 @app.get("/api/feeds", response_model=FeedsResponse)
 async def list_feeds(
-    current_user_id: int = Depends(get_current_user), db: Session = Depends(get_db)
+    current_user_id: int = Depends(get_current_user), db: Session = Depends(get_read_db)
 ):
     """
     List all feeds for the current user.
@@ -252,7 +476,6 @@ async def list_feeds(
     )
     result = db.execute(query, {"user_id": current_user_id})
     feed_listings = result.fetchall()
-    print(feed_listings)
     return {
         "feeds": [
             FeedListingResponse(
@@ -266,83 +489,361 @@ async def list_feeds(
     }
 
 
+# Every feed runs one of two statements, only the compiled tsquery and languages
+# differ. Feeds that declared languages have their own, which always scans the
+# (lang, created_at) index: a shared one would end up with a generic plan that
+# can't use it for "no languages or one of them".
+def feed_posts_statement(name: str, languages: bool) -> PreparedStatement:
+    language_params = {"languages": "text[]"} if languages else {}
+    return explainable(PreparedStatement(
+        name,
+        f"""
+        SELECT {POST_COLUMNS_SQL}
+        FROM (
+            SELECT *
+            FROM posts
+            JOIN {FEED_QUERIES_SQL} USING (ts_config)
+            WHERE created_at >= :after AND created_at < :before
+                {f"AND {IN_LANGUAGES_SQL}" if languages else ""}
+                AND {MATCH_SQL} AND {DUPLICATES_SQL}
+            ORDER BY created_at DESC
+            LIMIT :limit
+        ) p
+        {POST_ACTORS_SQL}
+        ORDER BY p.created_at DESC
+        """,
+        after="timestamptz",
+        before="timestamptz",
+        tsquery="text",
+        **language_params,
+        collapse_duplicates="boolean",
+        limit="integer",
+    ))
+
+
+feed_posts_query = feed_posts_statement("feed_posts", languages=False)
+feed_posts_languages_query = feed_posts_statement("feed_posts_languages", languages=True)
+
+feed_search = WindowedSearch(feed_search_windows)
+
+# rank=hybrid: the newest keyword matches ranked by ts_rank_cd, and the posts nearest
+# to the feed's keyword embedding, fused with reciprocal rank fusion and decayed by
+# age. Both candidate lists are bounded, and it's all one round trip. Embeddings are
+# those of the active model (see embedding.models), so activating another one
+# switches every feed over at once.
+#
+# Embeddings of every model share a column of any dimension, and each model has a
+# partial HNSW index on its embeddings cast to its dimension (see
+# embedding.models.create_vector_index). The nearest neighbours are only found
+# through it if the query has the same cast and model id, as literals, so there is
+# a statement per model rather than one prepared for all.
+active_embedding_model_query = text("SELECT id, dimensions FROM embedding_models WHERE active")
+
+# HNSW returns at most ef_search neighbours, it has to be at least the candidates
+set_ef_search_query = text("SELECT set_config('hnsw.ef_search', :ef_search, true)")
+
+
+@functools.lru_cache(maxsize=8)
+def feed_hybrid_query(model_id: int, dimensions: int):
+    vector = f"vector({int(dimensions)})"
+    return explainable(text(
+        f"""
+        WITH lexical AS (
+            SELECT id, created_at,
+                row_number() OVER (ORDER BY ts_rank_cd(document, query) DESC, created_at DESC) AS rank
+            FROM (
+                SELECT id, created_at, {TSVECTOR_SQL} AS document, feed_queries.query
+                FROM posts
+                JOIN {FEED_QUERIES_SQL} USING (ts_config)
+                WHERE created_at >= :after AND created_at < :before AND {LANGUAGES_SQL}
+                    AND {MATCH_SQL} AND {DUPLICATES_SQL}
+                ORDER BY created_at DESC
+                LIMIT :candidates
+            ) newest_matches
+        ), semantic AS (
+            SELECT e.post_id AS id, e.post_created_at AS created_at,
+                row_number() OVER (ORDER BY e.distance) AS rank
+            FROM feed_embeddings fe
+            CROSS JOIN LATERAL (
+                SELECT post_id, post_created_at,
+                    CAST(embedding AS {vector}) <=> CAST(fe.embedding AS {vector}) AS distance
+                FROM embeddings
+                WHERE model_id = {int(model_id)}
+                    AND post_created_at >= :after AND post_created_at < :before
+                ORDER BY CAST(embedding AS {vector}) <=> CAST(fe.embedding AS {vector})
+                LIMIT :candidates
+            ) e
+            WHERE fe.feed_id = :feed_id AND fe.model_id = {int(model_id)}
+        ), fused AS (
+            SELECT id, min(created_at) AS created_at, sum(1.0 / (:rrf_k + rank)) AS score
+            FROM (SELECT * FROM lexical UNION ALL SELECT * FROM semantic) candidates
+            GROUP BY id
+        )
+        SELECT {POST_COLUMNS_SQL},
+            f.score * power(0.5, extract(epoch FROM CAST(:before AS timestamptz) - p.created_at) / :half_life) AS score
+        FROM fused f
+        JOIN posts p ON p.id = f.id AND p.created_at = f.created_at
+        {POST_ACTORS_SQL}
+        WHERE {duplicates_sql(canonical_id="p.canonical_id")} AND {languages_sql(lang="p.lang")}
+        ORDER BY score DESC, p.created_at DESC
+        LIMIT :limit
+        """
+    ))
+
+
+# the usual constant for reciprocal rank fusion, dampens the weight of the top ranks
+RRF_K = 60
+
+MAX_BATCH_FEEDS = 20
+MAX_FEED_LANGUAGES = 10
+
+# Several feeds over one scan of the candidate posts: each post is tokenized once
+# (OFFSET 0 stops Postgres from inlining the tsvector into the join) and tested
+# against every feed's query, then each feed keeps its newest `page_limit` matches.
+# Each feed's query is parsed once per text search configuration up front, and a
+# post is only tested against the queries for its own. Feed languages are passed
+# comma separated, arrays of arrays have to be the same length. If every feed has
+# languages, the scan is limited to all of them (:languages).
+feed_batch_query = explainable(PreparedStatement(
+    "feed_batch",
+    f"""
+    WITH feeds AS MATERIALIZED (
+        SELECT feed_id, c.ts_config, {tsquery_sql("tsquery", "c.ts_config")} AS query,
+            page_limit, collapse, string_to_array(feed_languages, ',') AS languages
+        FROM unnest(:feed_ids, :tsqueries, :limits, :collapses, :feed_languages)
+            AS f(feed_id, tsquery, page_limit, collapse, feed_languages)
+        CROSS JOIN (SELECT CAST(oid AS regconfig) AS ts_config FROM pg_ts_config) c
+    ), matches AS (
+        SELECT f.feed_id, f.page_limit, p.id, p.actor_id, p.record_text, p.created_at,
+            p.reply_parent_actor_id, p.reply_parent_rkey, p.reply_root_actor_id,
+            p.reply_root_rkey, p.canonical_id,
+            row_number() OVER (PARTITION BY f.feed_id ORDER BY p.created_at DESC) AS rank
+        FROM (
+            SELECT id, actor_id, record_text, created_at, reply_parent_actor_id,
+                reply_parent_rkey, reply_root_actor_id, reply_root_rkey, canonical_id,
+                lang, ts_config, {TSVECTOR_SQL} AS document
+            FROM posts
+            WHERE created_at >= :after AND created_at < :before AND {LANGUAGES_SQL}
+            OFFSET 0
+        ) p
+        CROSS JOIN LATERAL (
+            SELECT feed_id, page_limit FROM feeds
+            WHERE feeds.ts_config = p.ts_config AND p.document @@ feeds.query
+                AND {languages_sql("feeds.languages", "p.lang")}
+                AND {duplicates_sql("feeds.collapse", "p.canonical_id")}
+            OFFSET 0
+        ) f
+    )
+    SELECT p.feed_id, {POST_COLUMNS_SQL}
+    FROM matches p
+    {POST_ACTORS_SQL}
+    WHERE p.rank <= p.page_limit
+    ORDER BY p.feed_id, p.created_at DESC
+    """,
+    after="timestamptz",
+    before="timestamptz",
+    feed_ids="integer[]",
+    tsqueries="text[]",
+    limits="integer[]",
+    collapses="boolean[]",
+    feed_languages="text[]",
+    languages="text[]",
+))
+
+
+@app.get("/api/feeds/batch", response_model=BatchFeedResponse)
+async def get_feeds_batch(
+    feed_id: List[int] = Query(...),
+    limit: int = 50,
+    before: datetime = None,
+    current_user_id: int = Depends(get_current_user),
+    db: Session = Depends(get_read_db),
+):
+    """
+    Get several feeds at once, sharing a single scan of recent posts.
+
+    - **feed_id**: Feed to include, repeat for each feed (at most 20)
+    - **limit**: Maximum number of posts to return per feed (default: 50)
+    - **before**: Only return posts before this timestamp
+    """
+    feed_ids = list(dict.fromkeys(feed_id))
+    if len(feed_ids) > MAX_BATCH_FEEDS:
+        raise HTTPException(
+            status_code=422, detail=f"At most {MAX_BATCH_FEEDS} feeds per request"
+        )
+
+    feeds = {}
+    for fid in feed_ids:
+        try:
+            feed = get_feed_definition(db, fid)
+        except KeywordSyntaxError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        if feed is None or feed.user_id != current_user_id:
+            raise HTTPException(status_code=404, detail=f"Feed {fid} not found")
+        feeds[fid] = feed
+    languages = (
+        sorted({lang for feed in feeds.values() for lang in feed.languages})
+        if all(feed.languages for feed in feeds.values())
+        else []
+    )
+
+    def fetch(after: datetime, before: datetime, limits: dict):
+        params = {
+            "after": after,
+            "before": before,
+            "feed_ids": list(limits),
+            "tsqueries": [feeds[fid].tsquery for fid in limits],
+            "limits": list(limits.values()),
+            "collapses": [feeds[fid].collapse_duplicates for fid in limits],
+            "feed_languages": [",".join(feeds[fid].languages) for fid in limits],
+            "languages": languages,
+        }
+        pages = {fid: [] for fid in limits}
+        for post in db.execute(feed_batch_query.statement, params):
+            pages[post.feed_id].append(post)
+        return pages
+
+    before = before or datetime.now(UTC)
+    pages = feed_search.search_many(
+        {fid: limit * 2 for fid in feed_ids}, before, fetch
+    )
+
+    return {
+        "feeds": [
+            {
+                "feed_id": fid,
+                "feed": [post_json(post) for post in pages[fid]],
+                "keywords": feeds[fid].keywords,
+                "languages": list(feeds[fid].languages),
+            }
+            for fid in feed_ids
+        ]
+    }
+
+
 @app.get("/api/feeds/{feed_id}", response_model=FeedResponse)
 async def get_feed(
     feed_id: int,
     limit: int = 50,
     before: datetime = None,
+    rank: Literal["recent", "hybrid"] = "recent",
+    include: List[Literal["thread"]] = Query([]),
     current_user_id: int = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ):
     """
     Generate a custom feed for a user based on their keywords.
 
     - **limit**: Maximum number of posts to return (default: 50)
     - **before**: Only return posts before this timestamp
+    - **rank**: `recent` returns keyword matches newest first. `hybrid` also finds
+    posts that are semantically close to the keywords, and orders the posts from the
+    window before `before` by relevance with a boost for recent posts.
+    - **include**: `thread` also returns the posts the page's posts reply to and their
+    thread roots, in `threads` by URI, as many as fit in `THREAD_PAGE_BUDGET_MS`
     """
-    query = text(
-        """
-        SELECT keyword, updated_at 
-        FROM user_keywords 
-        WHERE user_id = :user_id and feed_id = :feed_id
+    try:
+        feed = get_feed_definition(db, feed_id)
+    except KeywordSyntaxError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if feed is None or feed.user_id != current_user_id:
+        raise HTTPException(status_code=404, detail="Feed not found")
+    tsquery = feed.tsquery
+
+    def load_page() -> dict:
+        deadline = time.monotonic() + settings.thread_page_budget_ms / 1000
+        # its own session: the page may outlive this request if others are awaiting it
+        with read_session() as db:
+
+            def fetch(after: datetime, before: datetime, limit: int):
+                params = {
+                    "after": after,
+                    "before": before,
+                    "tsquery": tsquery,
+                    "collapse_duplicates": feed.collapse_duplicates,
+                    "limit": limit,
+                }
+                if feed.languages:
+                    params["languages"] = list(feed.languages)
+                    return db.execute(feed_posts_languages_query.statement, params).fetchall()
+                return db.execute(feed_posts_query.statement, params).fetchall()
+
+            upper = before or datetime.now(UTC)
+            if rank == "hybrid":
+                params = {
+                    "after": upper - timedelta(hours=settings.hybrid_window_hours),
+                    "before": upper,
+                    "tsquery": tsquery,
+                    "languages": list(feed.languages),
+                    "collapse_duplicates": feed.collapse_duplicates,
+                    "feed_id": feed_id,
+                    "candidates": settings.hybrid_candidates,
+                    "rrf_k": RRF_K,
+                    "half_life": settings.hybrid_half_life_hours * 3600,
+                    "limit": limit * 2,
+                }
+                model = db.execute(active_embedding_model_query).fetchone()
+                if model is None:
+                    raise HTTPException(status_code=503, detail="No active embedding model")
+                # SET LOCAL, for this transaction
+                db.execute(set_ef_search_query, {"ef_search": str(settings.hybrid_candidates)})
+                posts = db.execute(feed_hybrid_query(model.id, model.dimensions), params).fetchall()
+                matching_posts = [{**post_json(post), "score": post.score} for post in posts]
+            elif recent_index is not None:
+                # the index answers for its window, SQL for whatever is older
+                posts = recent_index.search(
+                    db,
+                    feed,
+                    upper,
+                    limit * 2,
+                    lambda before, limit: feed_search.search(feed_id, before, limit, fetch),
+                )
+                matching_posts = [post_json(post) for post in posts]
+            else:
+                posts = feed_search.search(feed_id, upper, limit * 2, fetch)
+                matching_posts = [post_json(post) for post in posts]
+
+            page = {"feed": matching_posts, "keywords": feed.keywords, "languages": list(feed.languages)}
+            if "thread" in include:
+                page["threads"] = thread_context(db, matching_posts, deadline)
+        return page
+
+    # identical concurrent requests (same definition, page and size) share one query
+    key = (feed_id, tsquery, feed.languages, feed.collapse_duplicates, rank, before, limit, tuple(include))
+    return await feed_pages.do(key, load_page)
+
+
+@app.get("/api/feeds/{feed_id}/stream")
+async def stream_feed(
+    feed_id: int,
+    current_user_id: int = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
     """
-    )
-    result = db.execute(
-        query, {"user_id": current_user_id, "feed_id": feed_id}
-    )  # Replace with actual user ID
-    user_keywords = [row[0] for row in result]
+    Push new posts matching a feed as they're ingested, as server-sent events.
 
-    if len(user_keywords) == 0:
+    Each match is a `post` event whose data is a post as returned by the feed endpoint.
+    A `closed` event is sent if the feed is deleted.
+    """
+    try:
+        feed = get_feed_definition(db, feed_id)
+    except KeywordSyntaxError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if feed is None or feed.user_id != current_user_id:
         raise HTTPException(status_code=404, detail="Feed not found")
 
-    search_terms = []
-    for idx, keyword in enumerate(user_keywords):
-        if keyword.find(" ") != -1:
-            search_terms.append(
-                f"to_tsvector('english', record_text) @@ phraseto_tsquery('english', :keyword_{idx})"
-            )
-        else:
-            search_terms.append(
-                f"to_tsvector('english', record_text) @@ to_tsquery('english', :keyword_{idx})"
-            )
-
-    posts_query = text(
-        f"""
-        SELECT id, did, record_text, created_at, reply_parent_uri, reply_root_uri
-        FROM posts
-        WHERE (created_at < :before) AND
-        ({" AND ".join(search_terms)})
-        ORDER BY created_at DESC
-        LIMIT :limit
-        """
+    return StreamingResponse(
+        streams.events(feed_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
 
-    before = before or datetime.now(UTC)
-    params = {"before": before, "limit": limit * 2}
-    for idx, keyword in enumerate(user_keywords):
-        params[f"keyword_{idx}"] = keyword
-
-    posts = db.execute(posts_query, params)
-
-    matching_posts = []
-    for post in posts:
-        matching_posts.append(
-            {
-                "id": post.id,
-                "author": post.did,
-                "text": post.record_text,
-                "created_at": post.created_at.isoformat(),
-                "reply_to": post.reply_parent_uri,
-                "thread_root": post.reply_root_uri,
-            }
-        )
-
-    return {"feed": matching_posts, "keywords": user_keywords}
-
 
 @app.post("/api/feeds")
 async def create_feed(
     keywords: List[str],
+    collapse_duplicates: bool = True,
+    language: List[str] = Query([]),
     current_user_id: int = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
@@ -350,15 +851,35 @@ async def create_feed(
     Update the keywords used for filtering a user's feed.
 
     - **keywords**: List of new keywords to use for filtering. Keywords may be phrases,
+    and may be combined with `&`, `|`, `!` and parentheses. All keywords must match.
+    - **collapse_duplicates**: Hide near-duplicate posts, only showing the first of them.
+    If false they're returned with `duplicate_of` set to the post they copy (default: true)
+    - **language**: Only include posts in this language, as the primary subtag of the
+    post's first language (`pt` includes `pt-BR`). Repeat for several (default: all)
     """
+    try:
+        tsquery = compile_keywords(keywords)
+    except KeywordSyntaxError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    languages = sorted({lang.lower() for lang in language})
+    invalid = [lang for lang in languages if not valid_language(lang)]
+    if invalid:
+        raise HTTPException(
+            status_code=422, detail=f"Invalid languages {invalid}, expected codes like 'en' or 'pt'"
+        )
+    if len(languages) > MAX_FEED_LANGUAGES:
+        raise HTTPException(
+            status_code=422, detail=f"At most {MAX_FEED_LANGUAGES} languages per feed"
+        )
+
     logger.info(
         f"Creating new feed for user {current_user_id} with keywords: {keywords}"
     )
 
     insert_feed_query = text(
         """
-        INSERT INTO feeds (user_id, created_at, updated_at)
-        VALUES (:user_id, :created_at, :updated_at)
+        INSERT INTO feeds (user_id, tsquery, collapse_duplicates, languages, created_at, updated_at)
+        VALUES (:user_id, :tsquery, :collapse_duplicates, :languages, :created_at, :updated_at)
         RETURNING id
         """
     )
@@ -375,6 +896,9 @@ async def create_feed(
             insert_feed_query,
             {
                 "user_id": current_user_id,
+                "tsquery": tsquery,
+                "collapse_duplicates": collapse_duplicates,
+                "languages": languages,
                 "created_at": datetime.now(UTC),
                 "updated_at": datetime.now(UTC),
             },
@@ -392,6 +916,7 @@ async def create_feed(
                 },
             )
 
+        feed_changed(db, feed_id)
         db.commit()
     except Exception as e:
         db.rollback()
@@ -431,6 +956,7 @@ def delete_feed(
         if result.rowcount == 0:
             raise HTTPException(status_code=404, detail="Feed not found")
 
+        feed_changed(db, feed_id)
         db.commit()
     except Exception as e:
         db.rollback()
@@ -439,6 +965,132 @@ def delete_feed(
     return {"status": "success"}
 
 
+def xrpc_error(error: str, message: str) -> HTTPException:
+    return HTTPException(status_code=400, detail={"error": error, "message": message})
+
+
+@app.get(
+    "/xrpc/app.bsky.feed.getFeedSkeleton",
+    response_model=FeedSkeletonResponse,
+    response_model_exclude_none=True,
+)
+async def get_feed_skeleton(feed: str, limit: int = 50, cursor: str | None = None):
+    """
+    Bluesky feed generator endpoint, called by the AppView.
+
+    - **feed**: AT-URI of the feed generator record, its record key is our feed id
+    - **limit**: Maximum number of posts to return (1-100, default: 50)
+    - **cursor**: Cursor returned by the previous page
+    """
+    _, _, rkey = feed.rpartition("/app.bsky.feed.generator/")
+    if not rkey.isdigit():
+        raise xrpc_error("UnknownFeed", f"Unknown feed {feed}")
+    feed_id = int(rkey)
+    if not 1 <= limit <= 100:
+        raise xrpc_error("InvalidRequest", "limit must be between 1 and 100")
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise xrpc_error("InvalidRequest", "Malformed cursor")
+
+    skeleton = await skeletons.get(feed_id)
+    if skeleton is None:
+        raise xrpc_error("UnknownFeed", f"Unknown feed {feed}")
+
+    uris, last = skeleton.page(after, limit)
+    if len(uris) < limit and not skeleton.complete:
+        # the page runs past what we keep in memory
+        older, older_last = await asyncio.to_thread(
+            skeletons.fetch_older, feed_id, last or after, limit - len(uris)
+        )
+        uris.extend(older)
+        last = older_last or last
+
+    return {
+        "cursor": encode_cursor(last) if last and len(uris) == limit else None,
+        "feed": [{"post": uri} for uri in uris],
+    }
+
+
+@app.get("/api/trending", response_model=TrendingResponse)
+async def get_trending(window: Literal["hour", "day", "week"] = "hour", limit: int = 50):
+    """
+    Top keywords and phrases across all ingested posts.
+
+    - **window**: `hour`, `day` or `week` (default: hour)
+    - **limit**: Maximum number of terms to return (default: 50)
+    """
+    return {
+        "window": window,
+        "updated_at": trending.updated_at,
+        "terms": [
+            {"term": term, "count": count} for term, count in trending.top(window, limit)
+        ],
+    }
+
+
+@app.get("/api/stats", response_model=StatsResponse)
+async def get_stats(
+    window: Literal["hour", "day", "week"] = "hour",
+    languages: int = 20,
+    current_user_id: int = Depends(get_current_user),
+    db: Session = Depends(get_read_db),
+):
+    """
+    Ingestion stats, per minute for the last hour or per hour for a day or week.
+
+    - **window**: `hour`, `day` or `week` (default: hour)
+    - **languages**: Maximum number of languages to return (default: 20)
+    """
+    return load_stats(db, window, languages)
+
+
+@app.get("/api/cache/stats")
+async def cache_stats(current_user_id: int = Depends(get_current_user)):
+    """
+    Hit ratios of this worker's caches, and how many feed requests shared a query.
+    With `RECENT_INDEX_ENABLED`, also the size of the recent posts index.
+    """
+    stats = {cache.name: cache.stats() for cache in (user_cache, feed_definitions, thread_roots)}
+    stats[feed_pages.name] = feed_pages.stats()
+    if recent_index is not None:
+        stats["recent_index"] = recent_index.stats()
+    return stats
+
+
+@app.get("/debug/replicas")
+async def debug_replicas(admin_user_id: int = Depends(get_admin_user)):
+    """
+    Lag of every read replica and how many reads went to replicas or the primary.
+    Admins only, see `ADMIN_USER_IDS`.
+    """
+    return replicas.stats()
+
+
+@app.get("/debug/queries")
+async def debug_queries(
+    limit: int = 50,
+    fingerprint: str | None = None,
+    admin_user_id: int = Depends(get_admin_user),
+):
+    """
+    Statements recently run by this worker, for finding slow queries and plan regressions.
+    Admins only, see `ADMIN_USER_IDS`.
+
+    - **limit**: Maximum number of recent statements to return (default: 50)
+    - **fingerprint**: Only return statements with this fingerprint
+    """
+    return {
+        "enabled": settings.query_profiling_enabled,
+        "slow_query_ms": profiler.slow_ms,
+        "queries": [
+            q for q in profiler.summary() if fingerprint in (None, q["fingerprint"])
+        ],
+        "recent": profiler.recent(limit, fingerprint),
+        "plans": profiler.explained(fingerprint),
+    }
+
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -0,0 +1,108 @@
+"""
+Postgres LISTEN/NOTIFY for the feed service.
+
+Every uvicorn worker keeps one dedicated LISTEN connection, shared by everything in
+the process that wants notifications. The connection is driven by the event loop
+(`loop.add_reader`), so an idle listener costs nothing.
+
+Callbacks are called with the notification payload. When the connection drops,
+notifications sent while we were disconnected are lost, so after reconnecting every
+callback is called once with `None`, meaning "assume anything could have changed".
+"""
+
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Callable, Optional
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+Callback = Callable[[Optional[str]], None]
+
+
+def notify(db, channel: str, payload: str) -> None:
+    """Send a notification. It is delivered when the surrounding transaction commits."""
+    db.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": channel, "payload": payload})
+
+
+class PgListener:
+    def __init__(self, database_url: str, reconnect_seconds: float = 5):
+        self.database_url = database_url
+        self.reconnect_seconds = reconnect_seconds
+        self._callbacks: dict[str, list[Callback]] = defaultdict(list)
+        self._conn = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._reconnect: Optional[asyncio.Task] = None
+
+    def subscribe(self, channel: str, callback: Callback) -> None:
+        """Register a callback, call before `start`."""
+        self._callbacks[channel].append(callback)
+
+    def _connect(self) -> None:
+        conn = psycopg2.connect(self.database_url)
+        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cursor:
+            for channel in self._callbacks:
+                cursor.execute(f'LISTEN "{channel}"')
+        self._conn = conn
+        self._loop.add_reader(conn.fileno(), self._poll)
+        logger.info(f"Listening for notifications on {', '.join(self._callbacks)}")
+
+    def _disconnect(self) -> None:
+        if self._conn is None:
+            return
+        try:
+            self._loop.remove_reader(self._conn.fileno())
+            self._conn.close()
+        except Exception:
+            pass
+        self._conn = None
+
+    def _dispatch(self, channel: str, payload: Optional[str]) -> None:
+        for callback in self._callbacks.get(channel, []):
+            try:
+                callback(payload)
+            except Exception as e:
+                logger.error(f"Error handling notification on {channel}: {e}")
+
+    def _poll(self) -> None:
+        try:
+            self._conn.poll()
+        except psycopg2.Error as e:
+            logger.warning(f"Lost notification connection: {e}")
+            self._disconnect()
+            self._reconnect = self._loop.create_task(self._reconnect_loop())
+            return
+        while self._conn.notifies:
+            notification = self._conn.notifies.pop(0)
+            self._dispatch(notification.channel, notification.payload)
+
+    async def _reconnect_loop(self) -> None:
+        while self._conn is None:
+            await asyncio.sleep(self.reconnect_seconds)
+            try:
+                self._connect()
+            except psycopg2.Error as e:
+                logger.warning(f"Couldn't reconnect notification listener: {e}")
+                continue
+            for channel in self._callbacks:
+                self._dispatch(channel, None)
+
+    async def start(self) -> None:
+        if not self._callbacks:
+            return
+        self._loop = asyncio.get_running_loop()
+        try:
+            self._connect()
+        except psycopg2.Error as e:
+            logger.warning(f"Couldn't start notification listener: {e}")
+            self._reconnect = self._loop.create_task(self._reconnect_loop())
+
+    async def stop(self) -> None:
+        if self._reconnect is not None:
+            self._reconnect.cancel()
+        self._disconnect()
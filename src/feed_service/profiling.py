@@ -0,0 +1,194 @@
+"""
+Query profiling for /debug/queries.
+
+Engine event hooks time every statement and record it, with its row count and a
+normalized fingerprint, in a ring buffer. Statements that differ only in their
+parameters or literals share a fingerprint, so the many shapes of feed query can
+be told apart and compared over time.
+
+A sampled fraction of slow statements marked with `explainable()` is also run again
+with EXPLAIN (ANALYZE, BUFFERS) on a background thread, on its own pooled connection,
+so the request that was slow doesn't pay for it. Parameter values are only held until the EXPLAIN has run, they
+are never recorded.
+"""
+
+import hashlib
+import logging
+import random
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, UTC
+from typing import List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from shared.database import PreparedStatement
+
+logger = logging.getLogger(__name__)
+
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s|\$\d+")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w$])-?\d+(?:\.\d+)?\b")
+_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE = re.compile(r"\s+")
+# execution option of the statements that can safely be run a second time
+EXPLAINABLE = "explainable"
+
+
+def explainable(statement):
+    """
+    Mark a `text()` statement, or a PreparedStatement's, as one the profiler may
+    EXPLAIN ANALYZE, which runs it again: only reads without side effects. Anything
+    else, even a SELECT (set_config, pg_notify, a writable CTE), is never explained.
+    """
+    if isinstance(statement, PreparedStatement):
+        statement.statement = explainable(statement.statement)
+        return statement
+    return statement.execution_options(**{EXPLAINABLE: True})
+
+
+def normalize(statement: str) -> str:
+    """The statement with parameters and literals replaced by `?` and whitespace collapsed."""
+    statement = _PLACEHOLDER.sub("?", statement)
+    statement = _STRING.sub("?", statement)
+    statement = _NUMBER.sub("?", statement)
+    statement = _LIST.sub("(?, ...)", statement)
+    return _SPACE.sub(" ", statement).strip()
+
+
+def fingerprint(normalized: str) -> str:
+    return hashlib.md5(normalized.encode("utf-8")).hexdigest()[:16]
+
+
+@dataclass
+class QueryRecord:
+    fingerprint: str
+    statement: str
+    at: datetime
+    duration_ms: float
+    rows: int
+    executemany: bool
+
+
+@dataclass
+class QueryPlan:
+    fingerprint: str
+    statement: str
+    at: datetime
+    duration_ms: float
+    plan: List[str]
+
+
+class QueryProfiler:
+    def __init__(
+        self,
+        size: int = 1000,
+        slow_ms: float = 100,
+        explain_sample_rate: float = 0.1,
+        plans: int = 100,
+    ):
+        self.slow_ms = slow_ms
+        self.explain_sample_rate = explain_sample_rate
+        self.records: deque[QueryRecord] = deque(maxlen=size)
+        # fingerprint -> most recent plan, least recently explained first
+        self.plans: OrderedDict[str, QueryPlan] = OrderedDict()
+        self.max_plans = plans
+        self._lock = threading.Lock()
+        # one EXPLAIN at a time, slow queries arriving meanwhile aren't sampled
+        self._explainer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="explain")
+        self._explaining = threading.Event()
+
+    def attach(self, engine: Engine) -> None:
+        event.listen(engine, "before_cursor_execute", self._before_execute)
+        event.listen(engine, "after_cursor_execute", self._after_execute)
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info["query_start"] = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        duration_ms = (time.perf_counter() - conn.info["query_start"]) * 1000
+        normalized = normalize(statement)
+        record = QueryRecord(
+            fingerprint=fingerprint(normalized),
+            statement=normalized,
+            at=datetime.now(UTC),
+            duration_ms=duration_ms,
+            rows=cursor.rowcount,
+            executemany=executemany,
+        )
+        self.records.append(record)
+        if (
+            duration_ms >= self.slow_ms
+            and not executemany
+            and context is not None
+            and context.execution_options.get(EXPLAINABLE)
+            and not self._explaining.is_set()
+            and random.random() < self.explain_sample_rate
+        ):
+            self._explaining.set()
+            # on the engine it ran on, a replica's plan can differ from the primary's
+            self._explainer.submit(self._explain, conn.engine, record, statement, parameters)
+
+    def _explain(self, engine: Engine, record: QueryRecord, statement: str, parameters) -> None:
+        try:
+            conn = engine.raw_connection()
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {statement}", parameters)
+                    plan = [row[0] for row in cursor.fetchall()]
+                conn.rollback()
+            finally:
+                conn.close()
+            with self._lock:
+                self.plans.pop(record.fingerprint, None)
+                self.plans[record.fingerprint] = QueryPlan(
+                    record.fingerprint, record.statement, record.at, record.duration_ms, plan
+                )
+                while len(self.plans) > self.max_plans:
+                    self.plans.popitem(last=False)
+        except Exception as e:
+            logger.warning(f"Error explaining query {record.fingerprint}: {e}")
+        finally:
+            self._explaining.clear()
+
+    def summary(self) -> List[dict]:
+        """Statistics per fingerprint over the ring buffer, most total time first."""
+        by_fingerprint: dict[str, List[QueryRecord]] = {}
+        for record in list(self.records):
+            by_fingerprint.setdefault(record.fingerprint, []).append(record)
+        summary = []
+        for fp, records in by_fingerprint.items():
+            durations = sorted(r.duration_ms for r in records)
+            summary.append(
+                {
+                    "fingerprint": fp,
+                    "statement": records[-1].statement,
+                    "calls": len(records),
+                    "total_ms": sum(durations),
+                    "mean_ms": sum(durations) / len(durations),
+                    "p95_ms": durations[min(len(durations) - 1, int(0.95 * len(durations)))],
+                    "max_ms": durations[-1],
+                    "mean_rows": sum(r.rows for r in records) / len(records),
+                    "slow": sum(1 for d in durations if d >= self.slow_ms),
+                    "last_at": records[-1].at,
+                    "has_plan": fp in self.plans,
+                }
+            )
+        return sorted(summary, key=lambda s: s["total_ms"], reverse=True)
+
+    def recent(self, limit: int, fingerprint: Optional[str] = None) -> List[QueryRecord]:
+        records = [r for r in list(self.records) if fingerprint in (None, r.fingerprint)]
+        return records[-limit:][::-1]
+
+    def explained(self, fingerprint: Optional[str] = None) -> List[QueryPlan]:
+        with self._lock:
+            plans = list(self.plans.values())
+        return [p for p in reversed(plans) if fingerprint in (None, p.fingerprint)]
+
+    def shutdown(self) -> None:
+        self._explainer.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,320 @@
+"""
+Keyword query language for feeds.
+
+A feed is a list of keywords, and every keyword is a small boolean expression:
+
+    python                      a single word
+    trump administration        adjacent words are matched as a phrase
+    "trump administration"      quotes make the phrase explicit
+    python & programming        both must match
+    python | fastapi            either may match
+    python & !snake             negation
+    (python & django) | (fastapi & python)
+
+The keywords of a feed are combined with AND, validated when the feed is created
+and compiled into a single normalized tsquery string that is stored with the feed.
+User input never reaches `to_tsquery` unparsed: every word is emitted as a quoted
+lexeme, so the only operators Postgres sees are the ones we generated.
+
+The stored tsquery isn't tied to a language: it's parsed with the text search
+configuration of each post it's matched against (see shared.text_search), so a
+keyword is stemmed the same way as the posts it's looking for. Words in Chinese,
+Japanese or Korean are split into the character bigrams posts are indexed with.
+"""
+
+from dataclasses import dataclass
+from typing import List, Tuple
+
+from shared.text_search import has_cjk, segment_cjk
+
+# SQL fragments shared by every statement that matches posts against a compiled feed.
+# Keeping them in one place means every feed query has the same shape. Posts are
+# tokenized with the configuration ingestion picked for their language, CJK posts
+# from their bigram-segmented search_text.
+TSVECTOR_SQL = "to_tsvector(ts_config, coalesce(search_text, record_text))"
+
+
+def tsquery_sql(tsquery: str = ":tsquery", config: str = "ts_config") -> str:
+    """
+    SQL turning a compiled feed (a parameter by default, or any expression) into a
+    tsquery, normalized with the configuration of the post it's matched against.
+    """
+    return f"to_tsquery({config}, {tsquery})"
+
+
+# The feed's tsquery parsed once per text search configuration rather than once per
+# post: statements join posts to this on ts_config and match with MATCH_SQL.
+FEED_QUERIES_SQL = f"""(
+    SELECT CAST(oid AS regconfig) AS ts_config, {tsquery_sql(config="CAST(oid AS regconfig)")} AS query
+    FROM pg_ts_config
+) feed_queries"""
+
+MATCH_SQL = f"{TSVECTOR_SQL} @@ feed_queries.query"
+
+
+def languages_sql(languages: str = ":languages", lang: str = "lang") -> str:
+    """
+    SQL keeping posts in a feed's languages, all posts if it declared none. Backed
+    by the (lang, created_at) index on posts when the languages are known at
+    planning time.
+    """
+    languages = f"CAST({languages} AS text[])"
+    return f"(cardinality({languages}) = 0 OR {lang} = ANY({languages}))"
+
+
+LANGUAGES_SQL = languages_sql()
+
+# Only for feeds with languages. A prepared statement's generic plan can't use the
+# (lang, created_at) index for LANGUAGES_SQL's OR, so feeds with and without
+# languages are prepared as separate statements.
+IN_LANGUAGES_SQL = "lang = ANY(CAST(:languages AS text[]))"
+
+
+def duplicates_sql(collapse: str = ":collapse_duplicates", canonical_id: str = "canonical_id") -> str:
+    """SQL hiding near-duplicates (see ingestion.simhash) from feeds that collapse them."""
+    return f"({canonical_id} IS NULL OR NOT {collapse})"
+
+
+DUPLICATES_SQL = duplicates_sql()
+
+MAX_KEYWORD_LENGTH = 256
+MAX_TERMS = 32
+
+# characters that have a meaning in the keyword language and can't appear in a word
+_SPECIAL = set('&|!()"')
+
+
+class KeywordSyntaxError(ValueError):
+    """Raised when a keyword can't be parsed."""
+
+    def __init__(self, keyword: str, message: str, position: int | None = None):
+        self.keyword = keyword
+        self.position = position
+        if position is not None:
+            message = f"{message} at position {position}"
+        super().__init__(f"Invalid keyword {keyword!r}: {message}")
+
+
+@dataclass(frozen=True)
+class Term:
+    """One word, or several words matched as a phrase."""
+
+    words: Tuple[str, ...]
+
+
+@dataclass(frozen=True)
+class Not:
+    child: "Node"
+
+
+@dataclass(frozen=True)
+class And:
+    children: Tuple["Node", ...]
+
+
+@dataclass(frozen=True)
+class Or:
+    children: Tuple["Node", ...]
+
+
+Node = Term | Not | And | Or
+
+
+def _tokenize(keyword: str) -> List[Tuple[str, str, int]]:
+    """Split a keyword into (kind, value, position) tokens."""
+    tokens = []
+    i = 0
+    while i < len(keyword):
+        c = keyword[i]
+        if c.isspace():
+            i += 1
+        elif c == '"':
+            end = keyword.find('"', i + 1)
+            if end == -1:
+                raise KeywordSyntaxError(keyword, "unterminated quote", i)
+            tokens.append(("phrase", keyword[i + 1 : end], i))
+            i = end + 1
+        elif c in _SPECIAL:
+            tokens.append((c, c, i))
+            i += 1
+        else:
+            start = i
+            while i < len(keyword) and not keyword[i].isspace() and keyword[i] not in _SPECIAL:
+                i += 1
+            tokens.append(("word", keyword[start:i], start))
+    return tokens
+
+
+def _check_word(keyword: str, word: str, position: int) -> str:
+    if not any(c.isalnum() for c in word):
+        raise KeywordSyntaxError(keyword, f"{word!r} contains no searchable characters", position)
+    return word.lower()
+
+
+class _Parser:
+    """
+    Recursive descent parser, loosest binding first:
+
+        or      := and ('|' and)*
+        and     := unary ('&' unary)*
+        unary   := '!' unary | primary
+        primary := '(' or ')' | phrase | word+
+    """
+
+    def __init__(self, keyword: str):
+        self.keyword = keyword
+        self.tokens = _tokenize(keyword)
+        self.pos = 0
+
+    def _peek(self) -> str | None:
+        return self.tokens[self.pos][0] if self.pos < len(self.tokens) else None
+
+    def _error(self, message: str):
+        position = self.tokens[self.pos][2] if self.pos < len(self.tokens) else len(self.keyword)
+        raise KeywordSyntaxError(self.keyword, message, position)
+
+    def parse(self) -> Node:
+        if not self.tokens:
+            raise KeywordSyntaxError(self.keyword, "keyword is empty")
+        node = self._or()
+        if self._peek() is not None:
+            self._error(f"unexpected {self.tokens[self.pos][1]!r}")
+        return node
+
+    def _or(self) -> Node:
+        children = [self._and()]
+        while self._peek() == "|":
+            self.pos += 1
+            children.append(self._and())
+        return children[0] if len(children) == 1 else Or(tuple(children))
+
+    def _and(self) -> Node:
+        children = [self._unary()]
+        while self._peek() == "&":
+            self.pos += 1
+            children.append(self._unary())
+        return children[0] if len(children) == 1 else And(tuple(children))
+
+    def _unary(self) -> Node:
+        if self._peek() == "!":
+            self.pos += 1
+            return Not(self._unary())
+        return self._primary()
+
+    def _primary(self) -> Node:
+        kind = self._peek()
+        if kind == "(":
+            self.pos += 1
+            node = self._or()
+            if self._peek() != ")":
+                self._error("expected ')'")
+            self.pos += 1
+            return node
+        if kind == "phrase":
+            _, value, position = self.tokens[self.pos]
+            self.pos += 1
+            words = [_check_word(self.keyword, w, position) for w in value.split()]
+            if not words:
+                raise KeywordSyntaxError(self.keyword, "empty phrase", position)
+            return Term(tuple(words))
+        if kind == "word":
+            words = []
+            while self._peek() == "word":
+                _, value, position = self.tokens[self.pos]
+                words.append(_check_word(self.keyword, value, position))
+                self.pos += 1
+            return Term(tuple(words))
+        if kind is None:
+            self._error("unexpected end of keyword")
+        self._error(f"unexpected {self.tokens[self.pos][1]!r}")
+
+
+def _normalize(node: Node) -> Node:
+    """Flatten nested AND/OR, drop duplicate operands and double negation."""
+    if isinstance(node, Not):
+        child = _normalize(node.child)
+        return child.child if isinstance(child, Not) else Not(child)
+    if isinstance(node, (And, Or)):
+        children = []
+        for child in (_normalize(c) for c in node.children):
+            nested = child.children if type(child) is type(node) else (child,)
+            for c in nested:
+                if c not in children:
+                    children.append(c)
+        return children[0] if len(children) == 1 else type(node)(tuple(children))
+    return node
+
+
+def _count_terms(node: Node) -> int:
+    if isinstance(node, Term):
+        return len(node.words)
+    if isinstance(node, Not):
+        return _count_terms(node.child)
+    return sum(_count_terms(c) for c in node.children)
+
+
+def parse_keyword(keyword: str) -> Node:
+    """Parse and validate a single keyword expression."""
+    if len(keyword) > MAX_KEYWORD_LENGTH:
+        raise KeywordSyntaxError(keyword[:32] + "...", f"longer than {MAX_KEYWORD_LENGTH} characters")
+    return _normalize(_Parser(keyword).parse())
+
+
+def parse_keywords(keywords: List[str]) -> Node:
+    """Parse the keywords of a feed into one expression, combined with AND."""
+    if not keywords:
+        raise KeywordSyntaxError("", "a feed needs at least one keyword")
+    node = _normalize(And(tuple(parse_keyword(k) for k in keywords)))
+    if _count_terms(node) > MAX_TERMS:
+        raise KeywordSyntaxError(" & ".join(keywords), f"more than {MAX_TERMS} words")
+    return node
+
+
+# binding strength in tsquery: ! binds tightest, then <->, then &, then |
+_PRECEDENCE = {Or: 1, And: 2, Not: 4}
+
+
+def _precedence(node: Node) -> int:
+    if isinstance(node, Term):
+        return 3 if len(_lexemes(node)) > 1 else 5
+    return _PRECEDENCE[type(node)]
+
+
+def _lexeme(word: str) -> str:
+    return "'" + word.replace("\\", "\\\\").replace("'", "''") + "'"
+
+
+def _lexemes(term: Term) -> List[str]:
+    """The lexemes of a term, CJK words split into the bigrams posts are indexed with."""
+    lexemes = []
+    for word in term.words:
+        if not has_cjk(word):
+            lexemes.append(_lexeme(word))
+            continue
+        bigrams = segment_cjk(word).split()
+        # a single character is only ever indexed as the start of a bigram
+        if len(bigrams) == 1 and len(bigrams[0]) == 1:
+            lexemes.append(_lexeme(bigrams[0]) + ":*")
+        else:
+            lexemes.extend(_lexeme(b) for b in bigrams)
+    return lexemes
+
+
+def to_tsquery(node: Node) -> str:
+    """Render an expression as tsquery text, with only the parentheses it needs."""
+
+    def render(child: Node, parent: int) -> str:
+        s = to_tsquery(child)
+        return f"({s})" if _precedence(child) < parent else s
+
+    if isinstance(node, Term):
+        return " <-> ".join(_lexemes(node))
+    if isinstance(node, Not):
+        return "!" + render(node.child, 4)
+    op = " | " if isinstance(node, Or) else " & "
+    return op.join(render(c, _precedence(node)) for c in node.children)
+
+
+def compile_keywords(keywords: List[str]) -> str:
+    """Validate the keywords of a feed and compile them into one tsquery string."""
+    return to_tsquery(parse_keywords(keywords))
@@ -0,0 +1,682 @@
+"""
+In-memory inverted index of the newest posts.
+
+Most feed reads only look at the last hour or so, yet each one is a full-text
+search over the posts hypertable. With `recent_index_enabled`, every feed service
+worker also keeps the posts of the last `recent_index_hours` in an inverted index:
+lexeme -> the posts that contain it, with their positions. A page of a feed is then
+a few set intersections in memory plus one primary key lookup for the rows, and
+only the part of a page older than the index comes from SQL.
+
+The index has to agree with Postgres about what matches, so it doesn't tokenize
+anything itself. Posts are indexed with the lexemes and positions of the same
+`to_tsvector` feed queries use, and a feed's stored tsquery is normalized by
+`to_tsquery` once per text search configuration, exactly as the SQL does (see
+feed_service.query). Each post is matched against the query for its own
+configuration: `&`, `|`, `!`, phrases (`<->`, `<N>`) and prefixes (`:*`) are
+evaluated over the postings. A feed whose query can't be evaluated here is simply
+always served by SQL.
+
+Posts are split into time segments by created_at. A segment holds its posts' ids,
+times, languages and duplicate flags in flat arrays, and for each lexeme the posts
+(in the order they were added, so roughly by time) and positions as arrays. Once no
+more posts are expected for a segment its postings are packed into one blob, sorted
+by lexeme: the post numbers as gaps from the previous one and the positions, each in
+the narrowest integer type that holds them. That's mostly a byte per number, and
+without an array object per lexeme, postings take about a ninth of the memory.
+Decoding a lexeme's posts is `itertools.accumulate` over its gaps, and searches take
+about as long as before. Segments are searched newest first until the page is full,
+and dropped whole when they fall out of the window.
+
+The index is filled from the primary, like live streams: on start with the posts of
+the window, then with the posts of every `posts_inserted` notification, reading a
+little before the last cursor it has so posts that arrive out of order after a
+Jetstream failover aren't missed. The rows of the posts a search finds are read from
+the primary too, a replica may not have replayed the newest ones yet. Loads build
+segments of their own and only hold the lock searches take to merge them in.
+"""
+
+import asyncio
+import bisect
+import logging
+import re
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from itertools import accumulate
+from operator import sub
+from datetime import datetime, timedelta, UTC
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+from uuid import UUID
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from feed_service.feeds import POST_ACTORS_SQL, POST_COLUMNS_SQL, FeedDefinition
+from feed_service.query import TSVECTOR_SQL
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=UTC)
+
+# how far behind the newest cursor we have each load starts, cursors of different
+# Jetstream instances differ by a little
+CURSOR_OVERLAP_US = 60_000_000
+
+# the posts of the window, or of the cursors after the last load
+index_posts_query = text(
+    f"""
+    SELECT id, created_at, cursor, lang, CAST(ts_config AS text) AS ts_config,
+        canonical_id IS NOT NULL AS duplicate, CAST({TSVECTOR_SQL} AS text) AS document
+    FROM posts
+    WHERE created_at >= :after AND cursor > :after_cursor AND cursor <= :max_cursor
+    """
+)
+
+max_cursor_query = text("SELECT max(cursor) FROM posts WHERE created_at >= :after")
+
+# a feed's tsquery as Postgres normalizes it for each configuration
+normalize_query = text(
+    """
+    SELECT c AS ts_config, CAST(to_tsquery(CAST(c AS regconfig), :tsquery) AS text) AS query
+    FROM unnest(CAST(:configs AS text[])) AS c
+    """
+)
+
+# the rows of the posts the index found, newest first
+index_rows_query = text(
+    f"""
+    SELECT {POST_COLUMNS_SQL}
+    FROM (
+        SELECT * FROM posts
+        WHERE (id, created_at) IN (
+            SELECT * FROM unnest(CAST(:ids AS uuid[]), CAST(:created_ats AS timestamp[]))
+        )
+    ) p
+    {POST_ACTORS_SQL}
+    ORDER BY p.created_at DESC
+    """
+)
+
+
+def micros(value: datetime) -> int:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=UTC)
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def from_micros(value: int) -> datetime:
+    return EPOCH + timedelta(microseconds=value)
+
+
+def _unescape(lexeme: str) -> str:
+    return re.sub(r"\\(.)", r"\1", lexeme.replace("''", "'"))
+
+
+# 'lexeme':1,3B in the text of a tsvector
+_TSVECTOR_ENTRY = re.compile(r"'((?:[^'\\]|''|\\.)*)'(?::([0-9A-D,]+))?")
+
+
+def parse_tsvector(document: str) -> List[Tuple[str, List[int]]]:
+    """(lexeme, positions) of a tsvector's text."""
+    entries = []
+    for match in _TSVECTOR_ENTRY.finditer(document):
+        positions = [int(p.rstrip("ABCD")) for p in match.group(2).split(",")] if match.group(2) else []
+        entries.append((_unescape(match.group(1)), positions))
+    return entries
+
+
+class Unsupported(ValueError):
+    """A tsquery the index can't evaluate, the feed is served by SQL."""
+
+
+# A normalized tsquery: ("lexeme", text, prefix), ("not", node), ("and", left, right),
+# ("or", left, right) or ("phrase", left, right, distance)
+_TSQUERY_TOKEN = re.compile(r"\s*(?:'((?:[^'\\]|''|\\.)*)'(?::([*A-D]+))?|<(-|\d+)>|([&|!()]))")
+
+
+def parse_tsquery(query: str) -> Optional[tuple]:
+    """Parse a tsquery as Postgres prints it, None if it's empty (only stopwords)."""
+    tokens = []
+    position = 0
+    query = query.strip()
+    while position < len(query):
+        match = _TSQUERY_TOKEN.match(query, position)
+        if match is None:
+            raise Unsupported(f"Can't parse tsquery {query!r} at {position}")
+        position = match.end()
+        if match.group(1) is not None:
+            tokens.append(("lexeme", _unescape(match.group(1)), "*" in (match.group(2) or "")))
+        elif match.group(3) is not None:
+            tokens.append(("phrase", 1 if match.group(3) == "-" else int(match.group(3))))
+        else:
+            tokens.append((match.group(4),))
+        # trailing whitespace
+        while position < len(query) and query[position].isspace():
+            position += 1
+    if not tokens:
+        return None
+
+    # ! binds tightest, then phrases, then &, then |
+    def expect(kind: str):
+        nonlocal i
+        if i >= len(tokens) or tokens[i][0] != kind:
+            raise Unsupported(f"Can't parse tsquery {query!r}")
+        i += 1
+
+    def or_():
+        nonlocal i
+        node = and_()
+        while i < len(tokens) and tokens[i][0] == "|":
+            i += 1
+            node = ("or", node, and_())
+        return node
+
+    def and_():
+        nonlocal i
+        node = phrase()
+        while i < len(tokens) and tokens[i][0] == "&":
+            i += 1
+            node = ("and", node, phrase())
+        return node
+
+    def phrase():
+        nonlocal i
+        node = unary()
+        while i < len(tokens) and tokens[i][0] == "phrase":
+            distance = tokens[i][1]
+            i += 1
+            right = unary()
+            for operand in (node, right):
+                if operand[0] not in ("lexeme", "phrase"):
+                    # phrases of boolean expressions, never compiled from keywords
+                    raise Unsupported(f"Can't evaluate tsquery {query!r}")
+            node = ("phrase", node, right, distance)
+        return node
+
+    def unary():
+        nonlocal i
+        if i < len(tokens) and tokens[i][0] == "!":
+            i += 1
+            return ("not", unary())
+        if i < len(tokens) and tokens[i][0] == "(":
+            i += 1
+            node = or_()
+            expect(")")
+            return node
+        if i < len(tokens) and tokens[i][0] == "lexeme":
+            i += 1
+            return tokens[i - 1]
+        raise Unsupported(f"Can't parse tsquery {query!r}")
+
+    i = 0
+    node = or_()
+    if i != len(tokens):
+        raise Unsupported(f"Can't parse tsquery {query!r}")
+    return node
+
+
+# array type codes by item size
+_TYPECODES = {1: "B", 2: "H", 4: "I"}
+
+
+def _narrowest(values: array) -> array:
+    """The values in the smallest unsigned array type they fit."""
+    largest = max(values, default=0)
+    typecode = "B" if largest < 1 << 8 else "H" if largest < 1 << 16 else "I"
+    return values if values.typecode == typecode else array(typecode, values)
+
+
+class Segment:
+    """The posts created in [start, end), in microseconds."""
+
+    __slots__ = (
+        "start", "end", "ids", "created_at", "langs", "duplicate", "configs", "postings", "entries",
+        "packed", "lexemes", "starts", "counts", "widths", "blob",
+    )
+
+    def __init__(self, start: int, end: int):
+        self.start = start
+        self.end = end
+        self.ids = bytearray()
+        self.created_at = array("q")
+        self.langs: List[str] = []
+        self.duplicate = bytearray()
+        # text search configuration -> its posts
+        self.configs: Dict[str, Set[int]] = {}
+        # lexeme -> (posts, positions), a post once per position
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        self.entries = 0
+        # Packed segments aren't changed any more, see pack(). Their postings are in
+        # one blob instead: for the n-th of the sorted lexemes, its posts as gaps from
+        # the previous entry's post and then its positions, starting at starts[n],
+        # counts[n] of each, and widths[n] the item sizes of the two (4 bits each).
+        self.packed = False
+        self.lexemes: List[str] = []
+        self.starts = array("I")
+        self.counts = array("I")
+        self.widths = array("B")
+        self.blob = b""
+
+    def __len__(self) -> int:
+        return len(self.created_at)
+
+    def pack(self) -> "Segment":
+        """
+        A packed copy to replace this one with. It shares the per-post arrays, so this
+        one mustn't be changed any more.
+        """
+        segment = Segment(self.start, self.end)
+        segment.ids = self.ids
+        segment.created_at = self.created_at
+        segment.langs = self.langs
+        segment.duplicate = self.duplicate
+        segment.configs = self.configs
+        segment.entries = self.entries
+        segment.packed = True
+        segment.lexemes = sorted(self.postings)
+        blob = bytearray()
+        for lexeme in segment.lexemes:
+            docs, positions = self.postings[lexeme]
+            gaps = array("I", docs[:1])
+            gaps.extend(map(sub, docs[1:], docs))
+            gaps, positions = _narrowest(gaps), _narrowest(positions)
+            segment.starts.append(len(blob))
+            segment.counts.append(len(docs))
+            segment.widths.append(gaps.itemsize << 4 | positions.itemsize)
+            blob += gaps.tobytes()
+            blob += positions.tobytes()
+        segment.blob = bytes(blob)
+        return segment
+
+    def unpack(self) -> "Segment":
+        """An unpacked copy to add posts to, searches may still be reading this one."""
+        segment = Segment(self.start, self.end)
+        segment.ids = bytearray(self.ids)
+        segment.created_at = array("q", self.created_at)
+        segment.langs = list(self.langs)
+        segment.duplicate = bytearray(self.duplicate)
+        segment.configs = {config: set(docs) for config, docs in self.configs.items()}
+        for n, lexeme in enumerate(self.lexemes):
+            docs, positions = self._packed_posting(n)
+            segment.postings[lexeme] = (array("I", docs), array("H", positions))
+        segment.entries = self.entries
+        return segment
+
+    def lexeme_count(self) -> int:
+        return len(self.lexemes) if self.packed else len(self.postings)
+
+    def postings_bytes(self) -> int:
+        if self.packed:
+            return len(self.blob) + 9 * len(self.lexemes)
+        return sum(
+            len(docs) * docs.itemsize + len(positions) * positions.itemsize
+            for docs, positions in self.postings.values()
+        )
+
+    def add(self, post_id: bytes, created_at: int, lang: str, config: str, duplicate: bool, document: str) -> None:
+        doc = len(self.created_at)
+        self.ids += post_id
+        self.created_at.append(created_at)
+        self.langs.append(lang)
+        self.duplicate.append(duplicate)
+        self.configs.setdefault(config, set()).add(doc)
+        for lexeme, positions in parse_tsvector(document):
+            posting = self.postings.get(lexeme)
+            if posting is None:
+                posting = self.postings[lexeme] = (array("I"), array("H"))
+            for position in positions:
+                posting[0].append(doc)
+                posting[1].append(position)
+                self.entries += 1
+
+    def merge(self, other: "Segment") -> None:
+        """Append the posts of another segment over the same time span."""
+        offset = len(self.created_at)
+        self.ids += other.ids
+        self.created_at.extend(other.created_at)
+        self.langs.extend(other.langs)
+        self.duplicate += other.duplicate
+        for config, docs in other.configs.items():
+            self.configs.setdefault(config, set()).update(doc + offset for doc in docs)
+        for lexeme, (docs, positions) in other.postings.items():
+            posting = self.postings.get(lexeme)
+            if posting is None:
+                posting = self.postings[lexeme] = (array("I"), array("H"))
+            posting[0].extend(doc + offset for doc in docs)
+            posting[1].extend(positions)
+        self.entries += other.entries
+
+    def _packed_posting(self, n: int) -> Tuple[Iterable[int], array]:
+        start, count, width = self.starts[n], self.counts[n], self.widths[n]
+        blob = memoryview(self.blob)
+        gaps = array(_TYPECODES[width >> 4])
+        end = start + count * gaps.itemsize
+        gaps.frombytes(blob[start:end])
+        positions = array(_TYPECODES[width & 15])
+        positions.frombytes(blob[end : end + count * positions.itemsize])
+        return accumulate(gaps), positions
+
+    def _lexeme(self, node: tuple) -> List[Tuple[Iterable[int], array]]:
+        """(posts, positions) of the lexeme, or of every lexeme it's a prefix of."""
+        _, lexeme, prefix = node
+        if not self.packed:
+            if not prefix:
+                posting = self.postings.get(lexeme)
+                return [posting] if posting is not None else []
+            return [posting for key, posting in self.postings.items() if key.startswith(lexeme)]
+        n = bisect.bisect_left(self.lexemes, lexeme)
+        postings = []
+        while n < len(self.lexemes) and (
+            self.lexemes[n] == lexeme or prefix and self.lexemes[n].startswith(lexeme)
+        ):
+            postings.append(self._packed_posting(n))
+            n += 1
+        return postings
+
+    def _docs(self, node: tuple, universe: Set[int]) -> Set[int]:
+        kind = node[0]
+        if kind == "lexeme":
+            docs = set()
+            for posting, _ in self._lexeme(node):
+                docs.update(posting)
+            return docs
+        if kind == "not":
+            return universe - self._docs(node[1], universe)
+        if kind == "and":
+            left = self._docs(node[1], universe)
+            return left & self._docs(node[2], universe) if left else left
+        if kind == "or":
+            return self._docs(node[1], universe) | self._docs(node[2], universe)
+        return set(self._positions(node))
+
+    def _positions(self, node: tuple) -> Dict[int, Set[int]]:
+        """Post -> positions where the lexeme or phrase ends."""
+        if node[0] == "lexeme":
+            positions: Dict[int, Set[int]] = {}
+            for docs, offsets in self._lexeme(node):
+                for doc, position in zip(docs, offsets):
+                    positions.setdefault(doc, set()).add(position)
+            return positions
+        _, left, right, distance = node
+        left = self._positions(left)
+        if not left:
+            return {}
+        matches = {}
+        for doc, ends in self._positions(right).items():
+            starts = left.get(doc)
+            if starts is not None:
+                found = {end for end in ends if end - distance in starts}
+                if found:
+                    matches[doc] = found
+        return matches
+
+    def search(
+        self,
+        queries: Dict[str, Optional[tuple]],
+        languages: Tuple[str, ...],
+        collapse_duplicates: bool,
+        before: int,
+    ) -> List[Tuple[int, bytes]]:
+        """(created_at, id) of the posts matching a feed, each against its configuration's query."""
+        hits = []
+        for config, universe in self.configs.items():
+            query = queries.get(config)
+            if query is None:
+                # only stopwords, matches nothing
+                continue
+            for doc in self._docs(query, universe) & universe:
+                created_at = self.created_at[doc]
+                if created_at >= before:
+                    continue
+                if languages and self.langs[doc] not in languages:
+                    continue
+                if collapse_duplicates and self.duplicate[doc]:
+                    continue
+                hits.append((created_at, bytes(self.ids[16 * doc : 16 * doc + 16])))
+        return hits
+
+
+Fallback = Callable[[datetime, int], List]
+
+
+class RecentIndex:
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        window: timedelta,
+        segment: timedelta,
+        refresh_seconds: float,
+        max_feeds: int = 10_000,
+    ):
+        """
+        - **window**: how far back the index goes
+        - **segment**: the time span of a segment, the unit posts expire in
+        - **refresh_seconds**: load new posts at least this often, even without notifications
+        - **max_feeds**: how many feeds' normalized queries to keep
+        """
+        self.session_factory = session_factory
+        self.window_us = window // timedelta(microseconds=1)
+        self.segment_us = segment // timedelta(microseconds=1)
+        self.refresh_seconds = refresh_seconds
+        self.max_feeds = max_feeds
+        self._segments: Dict[int, Segment] = {}
+        # every post created from here on is in the index
+        self.covered_from: Optional[int] = None
+        self._cursor: Optional[int] = None
+        # ids of the posts in the cursor overlap, so they're not added twice
+        self._recent_ids: Dict[bytes, int] = {}
+        self._configs: Set[str] = set()
+        # tsquery -> configuration -> parsed query, None if the feed needs SQL
+        self._queries: OrderedDict[str, Optional[Dict[str, Optional[tuple]]]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._new_posts = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.searches = 0
+        self.fallbacks = 0
+        self.search_seconds = 0.0
+
+    @property
+    def ready(self) -> bool:
+        return self.covered_from is not None
+
+    def on_posts_inserted(self, payload: Optional[str]) -> None:
+        """Listener callback, runs on the event loop."""
+        self._new_posts.set()
+
+    def _add(self, rows, after: int) -> int:
+        """
+        Index the rows into segments of their own, then merge those in. Reading and
+        parsing the rows is the slow part, searches only wait for the merge.
+        """
+        segments: Dict[int, Segment] = {}
+        configs = set()
+        added = 0
+        for row in rows:
+            post_id = row.id.bytes if isinstance(row.id, UUID) else UUID(row.id).bytes
+            if post_id in self._recent_ids:
+                continue
+            created_at = micros(row.created_at)
+            if created_at < after:
+                continue
+            key = created_at // self.segment_us
+            segment = segments.get(key)
+            if segment is None:
+                segment = segments[key] = Segment(key * self.segment_us, (key + 1) * self.segment_us)
+            segment.add(post_id, created_at, row.lang or "", row.ts_config, row.duplicate, row.document)
+            configs.add(row.ts_config)
+            # only the loading thread uses these
+            self._recent_ids[post_id] = row.cursor
+            added += 1
+
+        # posts for a packed segment (created well before they were stored) go into a
+        # new copy of it, searches may be reading the old one
+        for key, segment in segments.items():
+            existing = self._segments.get(key)
+            if existing is not None and existing.packed:
+                replacement = existing.unpack()
+                replacement.merge(segment)
+                segments[key] = replacement.pack()
+
+        with self._lock:
+            for key, segment in segments.items():
+                existing = self._segments.get(key)
+                if existing is None or segment.packed:
+                    self._segments[key] = segment
+                else:
+                    existing.merge(segment)
+            self._configs |= configs
+        return added
+
+    def _load(self) -> int:
+        """Add the posts inserted since the last load, and drop expired segments."""
+        if self.ready:
+            after = self.covered_from
+            after_cursor = self._cursor - CURSOR_OVERLAP_US
+        else:
+            # everything in the window, the first segment complete
+            now = micros(datetime.now(UTC))
+            after = (now - self.window_us) // self.segment_us * self.segment_us
+            after_cursor = -1
+        with self.session_factory() as db:
+            # only posts in the window count, which keeps this to the newest chunks
+            after_at = from_micros(after).replace(tzinfo=None)
+            max_cursor = db.execute(max_cursor_query, {"after": after_at}).scalar()
+            if max_cursor is None:
+                return 0
+            params = {
+                "after": after_at,
+                "after_cursor": after_cursor,
+                "max_cursor": max_cursor,
+            }
+            rows = db.execute(index_posts_query, params, execution_options={"stream_results": True, "yield_per": 10_000})
+            added = self._add(rows, after)
+        self._cursor = max_cursor
+        # searched only once the whole window is in
+        self.covered_from = after
+        self._expire()
+        return added
+
+    def _expire(self) -> None:
+        """Drop segments that left the window, and pack those that are done."""
+        now = micros(datetime.now(UTC))
+        oldest = (now - self.window_us) // self.segment_us * self.segment_us
+        # a segment's posts have mostly arrived a segment after it ended
+        settled = now - self.segment_us
+        packed = {
+            key: segment.pack()
+            for key, segment in list(self._segments.items())
+            if not segment.packed and oldest < segment.end <= settled
+        }
+        with self._lock:
+            self._segments.update(packed)
+            for key in [key for key, segment in self._segments.items() if segment.end <= oldest]:
+                del self._segments[key]
+            self.covered_from = max(self.covered_from, oldest)
+        overlap = self._cursor - CURSOR_OVERLAP_US
+        self._recent_ids = {i: c for i, c in self._recent_ids.items() if c > overlap}
+
+    async def _load_loop(self) -> None:
+        while True:
+            try:
+                started = time.monotonic()
+                added = await asyncio.to_thread(self._load)
+                if added > 1000:
+                    logger.info(f"Indexed {added} posts in {time.monotonic() - started:.1f} seconds, {self.stats()}")
+            except Exception as e:
+                logger.error(f"Error loading posts into the recent index: {e}")
+            try:
+                await asyncio.wait_for(self._new_posts.wait(), self.refresh_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._new_posts.clear()
+
+    def _normalized(self, db: Session, tsquery: str) -> Optional[Dict[str, Optional[tuple]]]:
+        """The feed's query for every configuration in the index, None if it can't be evaluated here."""
+        with self._lock:
+            queries = self._queries.get(tsquery, {})
+            if tsquery in self._queries:
+                self._queries.move_to_end(tsquery)
+            missing = sorted(self._configs - queries.keys()) if queries is not None else []
+        if not missing:
+            return queries
+        rows = db.execute(normalize_query, {"tsquery": tsquery, "configs": missing}).fetchall()
+        try:
+            queries = {**queries, **{row.ts_config: parse_tsquery(row.query) for row in rows}}
+        except Unsupported as e:
+            logger.info(f"{e}, the feed is served by SQL")
+            queries = None
+        with self._lock:
+            self._queries[tsquery] = queries
+            while len(self._queries) > self.max_feeds:
+                self._queries.popitem(last=False)
+        return queries
+
+    def search(self, db: Session, feed: FeedDefinition, before: datetime, limit: int, fallback: Fallback) -> List:
+        """
+        The newest `limit` posts of the feed before `before`, like a feed query. Posts
+        in the window come from the index, older ones (and everything if the index
+        can't answer) from `fallback(before, limit)`.
+        """
+        before_us = micros(before)
+        if not self.ready or before_us <= self.covered_from:
+            return fallback(before, limit)
+        queries = self._normalized(db, feed.tsquery)
+        if queries is None:
+            self.fallbacks += 1
+            return fallback(before, limit)
+
+        started = time.perf_counter()
+        hits: List[Tuple[int, bytes]] = []
+        with self._lock:
+            covered_from = self.covered_from
+            for key in sorted(self._segments, reverse=True):
+                segment = self._segments[key]
+                if segment.start >= before_us:
+                    continue
+                hits.extend(segment.search(queries, feed.languages, feed.collapse_duplicates, before_us))
+                # older segments only have older posts
+                if len(hits) >= limit:
+                    break
+        hits.sort(reverse=True)
+        hits = hits[:limit]
+        self.searches += 1
+        self.search_seconds += time.perf_counter() - started
+
+        rows = []
+        if hits:
+            params = {
+                "ids": [str(UUID(bytes=post_id)) for _, post_id in hits],
+                "created_ats": [from_micros(created_at).replace(tzinfo=None) for created_at, _ in hits],
+            }
+            # from the primary the index was loaded from, a replica may not have them yet
+            with self.session_factory() as primary:
+                rows = primary.execute(index_rows_query, params).fetchall()
+        if len(hits) < limit:
+            rows.extend(fallback(from_micros(covered_from), limit - len(hits)))
+        return rows
+
+    def stats(self) -> dict:
+        with self._lock:
+            segments = list(self._segments.values())
+        return {
+            "ready": self.ready,
+            "covered_from": from_micros(self.covered_from).isoformat() if self.ready else None,
+            "segments": len(segments),
+            "posts": sum(len(segment) for segment in segments),
+            "lexemes": sum(segment.lexeme_count() for segment in segments),
+            "postings": sum(segment.entries for segment in segments),
+            "postings_bytes": sum(segment.postings_bytes() for segment in segments),
+            "packed_segments": sum(segment.packed for segment in segments),
+            "searches": self.searches,
+            "sql_feeds": self.fallbacks,
+            "search_ms_avg": self.search_seconds / self.searches * 1000 if self.searches else None,
+        }
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._load_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
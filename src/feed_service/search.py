@@ -0,0 +1,115 @@
+"""
+Progressive time-window search.
+
+Feed queries order by `created_at DESC LIMIT n`. Without a lower bound, a feed for a
+rare keyword makes Postgres walk every chunk in the retention window even when the
+last hour would have filled the page. The executor here asks for the newest slice
+of time first and only widens the search while the page is still short. Each slice
+only covers time the previous slices didn't, so a feed that ends up needing
+everything costs the same rows as one unbounded query.
+
+Per feed we remember which window usually fills the page, so popular feeds stay on
+the smallest window and rare feeds skip straight to the unbounded one.
+"""
+
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, UTC
+from typing import Callable, Dict, Hashable, List, Optional, Sequence
+
+# lower bound used for the final, unbounded window
+BEGINNING_OF_TIME = datetime.min.replace(tzinfo=UTC)
+
+# Fetches rows with after <= created_at < before, newest first, at most limit rows.
+Fetch = Callable[[datetime, datetime, int], List]
+# The same for several feeds in one go: takes {key: limit}, returns {key: rows}.
+FetchMany = Callable[[datetime, datetime, Dict[Hashable, int]], Dict[Hashable, List]]
+
+
+class WindowedSearch:
+    def __init__(
+        self,
+        windows: Sequence[Optional[timedelta]],
+        max_feeds: int = 10_000,
+        probe_after: int = 8,
+    ):
+        """
+        - **windows**: increasing window sizes, `None` meaning unbounded. An unbounded
+        window is appended if the last one isn't.
+        - **max_feeds**: how many per-feed hints to remember, least recently used go first
+        - **probe_after**: after this many requests filled by the first window we try
+        the next smaller one, in case the feed got busier
+        """
+        self.windows = list(windows)
+        if not self.windows or self.windows[-1] is not None:
+            self.windows.append(None)
+        self.max_feeds = max_feeds
+        self.probe_after = probe_after
+        # feed key -> [starting window index, consecutive first-window fills]
+        self._hints: OrderedDict[Hashable, list] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start_window(self, key: Hashable) -> int:
+        with self._lock:
+            hint = self._hints.get(key)
+            if hint is None:
+                return 0
+            self._hints.move_to_end(key)
+            return hint[0]
+
+    def _record(self, key: Hashable, start: int, used: int) -> None:
+        with self._lock:
+            hint = self._hints.get(key) or [start, 0]
+            if used != start:
+                hint[:] = [used, 0]
+            else:
+                hint[1] += 1
+                if hint[1] >= self.probe_after and start > 0:
+                    hint[:] = [start - 1, 0]
+            self._hints[key] = hint
+            self._hints.move_to_end(key)
+            while len(self._hints) > self.max_feeds:
+                self._hints.popitem(last=False)
+
+    def search(self, key: Hashable, before: datetime, limit: int, fetch: Fetch) -> List:
+        """Return up to `limit` rows older than `before`, widening the window as needed."""
+        start = self.start_window(key)
+        rows = []
+        upper = before
+        for idx in range(start, len(self.windows)):
+            window = self.windows[idx]
+            lower = before - window if window is not None else BEGINNING_OF_TIME
+            rows.extend(fetch(lower, upper, limit - len(rows)))
+            if len(rows) >= limit:
+                break
+            upper = lower
+        self._record(key, start, idx)
+        return rows
+
+    def search_many(
+        self, limits: Dict[Hashable, int], before: datetime, fetch: FetchMany
+    ) -> Dict[Hashable, List]:
+        """
+        `search` for several feeds sharing each slice. We start at the smallest window
+        any of them needs, and feeds drop out of later slices as their pages fill.
+        """
+        starts = {key: self.start_window(key) for key in limits}
+        results = {key: [] for key in limits}
+        pending = dict(limits)
+        upper = before
+        for idx in range(min(starts.values()), len(self.windows)):
+            window = self.windows[idx]
+            lower = before - window if window is not None else BEGINNING_OF_TIME
+            for key, rows in fetch(lower, upper, pending).items():
+                results[key].extend(rows)
+            for key in list(pending):
+                pending[key] = limits[key] - len(results[key])
+                if pending[key] <= 0:
+                    del pending[key]
+                    self._record(key, starts[key], idx)
+            if not pending:
+                break
+            upper = lower
+        for key in pending:
+            self._record(key, starts[key], idx)
+        return results
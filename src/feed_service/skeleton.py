@@ -0,0 +1,301 @@
+"""
+Precomputed feed skeletons for `app.bsky.feed.getFeedSkeleton`.
+
+The Bluesky AppView calls getFeedSkeleton every time someone opens or scrolls a
+feed, and only wants post AT-URIs back. For each feed that's been asked for
+recently we keep the newest `size` matching URIs in memory, and a background task
+tops them up with new posts every few seconds. Requests are answered by a binary
+search over that buffer without touching `posts`. Only pages older than the buffer
+fall through to SQL.
+
+Cursors are `<created_at in microseconds>::<rkey>`, so they stay valid while the
+buffer moves underneath them.
+
+createdAt is set by the client, so a post ingested now may be older than posts the
+buffer already has. Top-ups therefore look for posts by ingest cursor rather than by
+created_at: everything stored since the last refresh, bounded to `backdate` before
+that on created_at so only recent chunks are read.
+"""
+
+import asyncio
+import bisect
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, UTC
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from feed_service.feeds import FeedDefinition, get_feed_definition
+from feed_service.profiling import explainable
+from feed_service.query import DUPLICATES_SQL, FEED_QUERIES_SQL, LANGUAGES_SQL, MATCH_SQL
+from feed_service.search import WindowedSearch
+from shared.atproto import post_uri
+
+logger = logging.getLogger(__name__)
+
+# how far behind the newest cursor a buffer has each top-up starts
+CURSOR_OVERLAP_US = 60_000_000
+
+# sort key for a post in a skeleton: newest first, ties broken by rkey
+Key = Tuple[int, str]
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=UTC)
+
+
+def _micros(created_at: datetime) -> int:
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=UTC)
+    return (created_at - EPOCH) // timedelta(microseconds=1)
+
+
+def _from_micros(micros: int) -> datetime:
+    return EPOCH + timedelta(microseconds=micros)
+
+
+def encode_cursor(key: Key) -> str:
+    return f"{-key[0]}::{key[1]}"
+
+
+def decode_cursor(cursor: str) -> Key:
+    """Raises ValueError for a cursor we didn't hand out."""
+    micros, rkey = cursor.split("::", 1)
+    micros = int(micros)
+    try:
+        _from_micros(micros)
+    except OverflowError:
+        raise ValueError(f"Cursor time out of range: {micros}")
+    return (-micros, rkey)
+
+
+@dataclass(frozen=True)
+class Skeleton:
+    """An immutable snapshot of a feed's newest posts, replaced wholesale on refresh."""
+
+    keys: Tuple[Key, ...]
+    uris: Tuple[str, ...]
+    # True if the buffer holds every match, so there's nothing older to fetch
+    complete: bool
+    # the newest ingest cursor stored when the buffer was last topped up
+    cursor: Optional[int] = None
+
+    def page(self, cursor: Optional[Key], limit: int) -> Tuple[List[str], Optional[Key]]:
+        start = 0 if cursor is None else bisect.bisect_right(self.keys, cursor)
+        end = min(start + limit, len(self.keys))
+        last = self.keys[end - 1] if end > start else None
+        return list(self.uris[start:end]), last
+
+
+skeleton_posts_query = explainable(text(
+    f"""
+    SELECT author.did, p.commit_rkey, p.created_at
+    FROM (
+        SELECT actor_id, commit_rkey, created_at
+        FROM posts
+        JOIN {FEED_QUERIES_SQL} USING (ts_config)
+        WHERE created_at >= :after AND created_at <= :before
+            AND (created_at < :before OR commit_rkey > :before_rkey)
+            AND {LANGUAGES_SQL} AND {MATCH_SQL} AND {DUPLICATES_SQL}
+        ORDER BY created_at DESC, commit_rkey
+        LIMIT :limit
+    ) p
+    JOIN actors author ON author.id = p.actor_id
+    ORDER BY p.created_at DESC, p.commit_rkey
+    """
+))
+
+# matches stored after a cursor, for topping up a buffer
+skeleton_new_posts_query = explainable(text(
+    f"""
+    SELECT author.did, p.commit_rkey, p.created_at
+    FROM (
+        SELECT actor_id, commit_rkey, created_at
+        FROM posts
+        JOIN {FEED_QUERIES_SQL} USING (ts_config)
+        WHERE cursor > :after_cursor AND cursor <= :max_cursor AND created_at >= :since
+            AND {LANGUAGES_SQL} AND {MATCH_SQL} AND {DUPLICATES_SQL}
+        ORDER BY created_at DESC, commit_rkey
+        LIMIT :limit
+    ) p
+    JOIN actors author ON author.id = p.actor_id
+    ORDER BY p.created_at DESC, p.commit_rkey
+    """
+))
+
+max_cursor_query = text("SELECT max(cursor) FROM posts WHERE created_at >= :since")
+
+
+class SkeletonCache:
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        search: WindowedSearch,
+        size: int,
+        refresh_seconds: float,
+        idle_seconds: float,
+        backdate: timedelta,
+    ):
+        """
+        - **size**: how many posts to keep per feed
+        - **refresh_seconds**: how often buffers are topped up with new posts
+        - **idle_seconds**: feeds nobody asked for in this long are dropped
+        - **backdate**: how much older than their ingest cursor new posts may be
+        """
+        self.session_factory = session_factory
+        self.search = search
+        self.size = size
+        self.refresh_seconds = refresh_seconds
+        self.idle_seconds = idle_seconds
+        self.backdate = backdate
+        self._skeletons: dict[int, Skeleton] = {}
+        self._last_requested: dict[int, float] = {}
+        # bumped by invalidate(), so a build that was running meanwhile isn't stored
+        self._generation = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def _fetch(
+        self,
+        db: Session,
+        feed: FeedDefinition,
+        after: datetime,
+        before: datetime,
+        limit: int,
+        before_rkey: Optional[str] = None,
+    ):
+        """
+        Rows with after <= created_at < before, or at `before` itself with an rkey past
+        `before_rkey`, in Key order.
+        """
+        params = {
+            "after": after,
+            "before": before,
+            "before_rkey": before_rkey,
+            "tsquery": feed.tsquery,
+            "languages": list(feed.languages),
+            "collapse_duplicates": feed.collapse_duplicates,
+            "limit": limit,
+        }
+        return db.execute(skeleton_posts_query, params).fetchall()
+
+    def _fetch_new(self, db: Session, feed: FeedDefinition, after_cursor: int, max_cursor: int):
+        """The newest matches stored after `after_cursor`, in Key order."""
+        params = {
+            "after_cursor": after_cursor,
+            "max_cursor": max_cursor,
+            "since": _from_micros(after_cursor) - self.backdate,
+            "tsquery": feed.tsquery,
+            "languages": list(feed.languages),
+            "collapse_duplicates": feed.collapse_duplicates,
+            "limit": self.size,
+        }
+        return db.execute(skeleton_new_posts_query, params).fetchall()
+
+    def _build(self, feed_id: int) -> Optional[Skeleton]:
+        """Build a feed's buffer from scratch, or top up the one we have."""
+        generation = self._generation
+        with self.session_factory() as db:
+            feed = get_feed_definition(db, feed_id)
+            if feed is None:
+                return None
+            now = datetime.now(UTC)
+            current = self._skeletons.get(feed_id)
+            # read first, posts stored while we search are picked up by the next top-up
+            max_cursor = db.execute(max_cursor_query, {"since": now - self.backdate}).scalar()
+            if current is None or current.cursor is None:
+                rows = self.search.search(
+                    feed_id, now, self.size, lambda a, b, n: self._fetch(db, feed, a, b, n)
+                )
+                known = set()
+            elif max_cursor is None or max_cursor <= current.cursor:
+                return current
+            else:
+                # cursors of different Jetstream instances differ by a little, and
+                # batches may commit out of order
+                after_cursor = current.cursor - CURSOR_OVERLAP_US
+                rows = self._fetch_new(db, feed, after_cursor, max_cursor)
+                known = set(current.uris)
+
+        entries = [
+            ((-_micros(row.created_at), row.commit_rkey), post_uri(row.did, row.commit_rkey))
+            for row in rows
+        ]
+        entries = [e for e in entries if e[1] not in known]
+        complete = len(rows) < self.size
+        if current is not None:
+            entries.extend(zip(current.keys, current.uris))
+            complete = complete and current.complete
+        entries.sort()
+        if len(entries) > self.size:
+            entries = entries[: self.size]
+            complete = False
+        skeleton = Skeleton(
+            tuple(key for key, _ in entries),
+            tuple(uri for _, uri in entries),
+            complete,
+            max_cursor,
+        )
+        if generation == self._generation:
+            self._skeletons[feed_id] = skeleton
+        return skeleton
+
+    async def get(self, feed_id: int) -> Optional[Skeleton]:
+        """The feed's buffer, built on first use. None if the feed doesn't exist."""
+        self._last_requested[feed_id] = time.monotonic()
+        skeleton = self._skeletons.get(feed_id)
+        if skeleton is None:
+            skeleton = await asyncio.to_thread(self._build, feed_id)
+            if skeleton is None:
+                self._last_requested.pop(feed_id, None)
+        return skeleton
+
+    def fetch_older(self, feed_id: int, cursor: Key, limit: int) -> Tuple[List[str], Optional[Key]]:
+        """
+        Pages past the end of the buffer come straight from SQL. Posts created in the
+        same microsecond as the cursor's come after it if their rkey does, so the first
+        slice also takes those; later slices end where the previous one started.
+        """
+        before = _from_micros(-cursor[0])
+        with self.session_factory() as db:
+            feed = get_feed_definition(db, feed_id)
+            if feed is None:
+                return [], None
+            rows = self.search.search(
+                ("older", feed_id),
+                before,
+                limit,
+                lambda a, b, n: self._fetch(db, feed, a, b, n, cursor[1] if b == before else None),
+            )
+        keys = [(-_micros(row.created_at), row.commit_rkey) for row in rows]
+        uris = [post_uri(row.did, row.commit_rkey) for row in rows]
+        return uris, keys[-1] if keys else None
+
+    def invalidate(self, feed_id: Optional[int] = None) -> None:
+        self._generation += 1
+        if feed_id is None:
+            self._skeletons.clear()
+        else:
+            self._skeletons.pop(feed_id, None)
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_seconds)
+            idle_before = time.monotonic() - self.idle_seconds
+            for feed_id, requested in list(self._last_requested.items()):
+                if requested < idle_before:
+                    del self._last_requested[feed_id]
+                    self._skeletons.pop(feed_id, None)
+                    continue
+                try:
+                    await asyncio.to_thread(self._build, feed_id)
+                except Exception as e:
+                    logger.error(f"Error refreshing skeleton for feed {feed_id}: {e}")
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
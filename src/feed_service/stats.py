@@ -0,0 +1,104 @@
+"""
+Ingestion stats for /api/stats.
+
+Read from the `post_stats_minute` and `post_stats_hour` continuous aggregates (see
+the post_stats migration) rather than from posts, so the cost depends on the window
+asked for, not on how many posts are stored. Buckets newer than the last refresh
+are aggregated from posts on the fly by TimescaleDB, so the newest numbers are live.
+"""
+
+from datetime import datetime, timedelta, UTC
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+# window -> (aggregate it's read from, how far back it goes)
+WINDOWS = {
+    "hour": ("post_stats_minute", timedelta(hours=1)),
+    "day": ("post_stats_hour", timedelta(days=1)),
+    "week": ("post_stats_hour", timedelta(days=7)),
+}
+
+
+def buckets_query(view: str):
+    return text(
+        f"""
+        SELECT bucket,
+            CAST(sum(posts) AS bigint) AS posts,
+            sum(lag_seconds_sum) / sum(posts) AS lag_seconds_avg,
+            max(lag_seconds_max) AS lag_seconds_max,
+            min(min_cursor) AS min_cursor,
+            max(max_cursor) AS max_cursor,
+            max(last_ingest_time) AS last_ingest_time
+        FROM {view}
+        WHERE bucket >= :after AND bucket < :before
+        GROUP BY bucket
+        ORDER BY bucket
+        """
+    )
+
+
+def languages_query(view: str):
+    return text(
+        f"""
+        SELECT lang, CAST(sum(posts) AS bigint) AS posts
+        FROM {view}
+        WHERE bucket >= :after AND bucket < :before
+        GROUP BY lang
+        ORDER BY posts DESC
+        LIMIT :limit
+        """
+    )
+
+
+# both are estimates kept by Postgres and TimescaleDB, neither scans posts
+table_query = text(
+    "SELECT approximate_row_count('posts') AS posts, hypertable_size('posts') AS size_bytes"
+)
+
+
+def cursor_time(cursor: int | None) -> datetime | None:
+    """The time a Jetstream cursor (microseconds since the epoch) points at."""
+    return datetime.fromtimestamp(cursor / 1_000_000, UTC) if cursor else None
+
+
+def load_stats(db: Session, window: str, languages: int) -> dict:
+    view, span = WINDOWS[window]
+    now = datetime.now(UTC)
+    # created_at, and so the buckets, are UTC without a time zone
+    params = {"after": (now - span).replace(tzinfo=None), "before": now.replace(tzinfo=None)}
+
+    buckets = db.execute(buckets_query(view), params).fetchall()
+    langs = db.execute(languages_query(view), {**params, "limit": languages}).fetchall()
+    table = db.execute(table_query).first()
+
+    posts = sum(b.posts for b in buckets)
+    lag_sum = sum(b.lag_seconds_avg * b.posts for b in buckets if b.lag_seconds_avg is not None)
+    max_cursor = max((b.max_cursor for b in buckets if b.max_cursor), default=None)
+    last_ingest = max((b.last_ingest_time for b in buckets if b.last_ingest_time), default=None)
+    return {
+        "window": window,
+        "posts": posts,
+        "posts_per_minute": posts / (span.total_seconds() / 60),
+        "lag_seconds_avg": lag_sum / posts if posts else None,
+        "lag_seconds_max": max(
+            (b.lag_seconds_max for b in buckets if b.lag_seconds_max is not None), default=None
+        ),
+        "cursor": max_cursor,
+        "cursor_time": cursor_time(max_cursor),
+        "last_ingest_time": last_ingest,
+        "total_posts": table.posts,
+        "total_size_bytes": table.size_bytes,
+        "languages": [{"lang": row.lang, "posts": row.posts} for row in langs],
+        "buckets": [
+            {
+                "bucket": b.bucket,
+                "posts": b.posts,
+                "lag_seconds_avg": b.lag_seconds_avg,
+                "lag_seconds_max": b.lag_seconds_max,
+                "min_cursor": b.min_cursor,
+                "max_cursor": b.max_cursor,
+            }
+            for b in buckets
+        ],
+    }
@@ -0,0 +1,204 @@
+"""
+Live feed streams.
+
+The ingestion service sends a `posts_inserted` notification after every batch it
+stores. Each feed service worker listens once and, for every batch, matches the new
+posts against all the feeds that currently have someone connected in a single
+query: each post is tokenized once, each feed's tsquery parsed once per text search
+configuration, and posts only tested against the feeds in their language. Matches are
+then fanned out in-process to the connected clients' queues. New posts are found by
+ingest cursor, bounded on created_at to `backdate` before the first of them so only
+recent chunks are read.
+
+An idle client is a coroutine blocked on an `asyncio.Queue`, there's no timer or
+query per connection. Keepalives for every client come from one shared ticker.
+"""
+
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta, UTC
+from typing import Callable, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from feed_service.feeds import POST_ACTORS_SQL, POST_COLUMNS_SQL, get_feed_definition, post_json
+from feed_service.profiling import explainable
+from feed_service.query import TSVECTOR_SQL, duplicates_sql, languages_sql, tsquery_sql
+
+logger = logging.getLogger(__name__)
+
+POSTS_CHANNEL = "posts_inserted"
+
+# queue item telling a client to send a keepalive, and one telling it the feed is gone
+KEEPALIVE = object()
+CLOSED = object()
+
+EPOCH = datetime(1970, 1, 1, tzinfo=UTC)
+
+new_matches_query = explainable(text(
+    f"""
+    WITH new_posts AS MATERIALIZED (
+        SELECT *, {TSVECTOR_SQL} AS document
+        FROM posts
+        WHERE cursor > :after_cursor AND cursor <= :max_cursor AND created_at >= :since
+    ), feeds AS MATERIALIZED (
+        SELECT feed_id, c.ts_config, {tsquery_sql("tsquery", "c.ts_config")} AS query, collapse,
+            string_to_array(languages, ',') AS languages
+        FROM unnest(
+            CAST(:feed_ids AS integer[]), CAST(:tsqueries AS text[]), CAST(:collapses AS boolean[]),
+            CAST(:languages AS text[])
+        ) AS f(feed_id, tsquery, collapse, languages)
+        CROSS JOIN (SELECT CAST(oid AS regconfig) AS ts_config FROM pg_ts_config) c
+    )
+    SELECT feeds.feed_id, {POST_COLUMNS_SQL}
+    FROM new_posts p
+    JOIN feeds ON feeds.ts_config = p.ts_config AND p.document @@ feeds.query
+        AND {languages_sql("feeds.languages", "p.lang")}
+        AND {duplicates_sql("feeds.collapse", "p.canonical_id")}
+    {POST_ACTORS_SQL}
+    ORDER BY p.created_at
+    """
+))
+
+
+class FeedStreamHub:
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        queue_size: int = 100,
+        keepalive_seconds: float = 15,
+        backdate: timedelta = timedelta(hours=24),
+    ):
+        """
+        - **backdate**: how much older than their ingest cursor new posts may be, older
+        ones aren't streamed
+        """
+        self.session_factory = session_factory
+        self.queue_size = queue_size
+        self.keepalive_seconds = keepalive_seconds
+        self.backdate = backdate
+        self._subscribers: dict[int, set[asyncio.Queue]] = defaultdict(set)
+        # posts up to and including this cursor have been matched
+        self._matched_cursor: Optional[int] = None
+        self._latest_cursor: Optional[int] = None
+        self._new_posts = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+        self.dropped = 0
+
+    def subscribe(self, feed_id: int) -> asyncio.Queue:
+        queue = asyncio.Queue(self.queue_size)
+        self._subscribers[feed_id].add(queue)
+        return queue
+
+    def unsubscribe(self, feed_id: int, queue: asyncio.Queue) -> None:
+        queues = self._subscribers.get(feed_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[feed_id]
+
+    def on_posts_inserted(self, payload: Optional[str]) -> None:
+        """Listener callback, runs on the event loop."""
+        if payload is None:
+            # reconnected, the next notification covers whatever we missed
+            return
+        batch = json.loads(payload)
+        if self._matched_cursor is None:
+            self._matched_cursor = int(batch["min_cursor"]) - 1
+        self._latest_cursor = max(int(batch["max_cursor"]), self._latest_cursor or 0)
+        if not self._subscribers:
+            # nobody to tell, don't go back for these posts when someone connects
+            self._matched_cursor = self._latest_cursor
+            return
+        self._new_posts.set()
+
+    def _put(self, queue: asyncio.Queue, item) -> None:
+        """Slow clients lose their oldest posts rather than holding up everyone else."""
+        if queue.full():
+            queue.get_nowait()
+            self.dropped += 1
+        queue.put_nowait(item)
+
+    def _match(self, feed_ids: list[int], after_cursor: int, max_cursor: int):
+        with self.session_factory() as db:
+            feeds = {feed_id: get_feed_definition(db, feed_id) for feed_id in feed_ids}
+            live = {feed_id: feed for feed_id, feed in feeds.items() if feed is not None}
+            rows = []
+            if live:
+                params = {
+                    "after_cursor": after_cursor,
+                    "max_cursor": max_cursor,
+                    "since": EPOCH + timedelta(microseconds=after_cursor) - self.backdate,
+                    "feed_ids": list(live),
+                    "tsqueries": [feed.tsquery for feed in live.values()],
+                    "collapses": [feed.collapse_duplicates for feed in live.values()],
+                    # comma separated, arrays of arrays have to be the same length
+                    "languages": [",".join(feed.languages) for feed in live.values()],
+                }
+                rows = db.execute(new_matches_query, params).fetchall()
+        deleted = [feed_id for feed_id, feed in feeds.items() if feed is None]
+        return rows, deleted
+
+    async def _match_loop(self) -> None:
+        while True:
+            await self._new_posts.wait()
+            self._new_posts.clear()
+            after_cursor, max_cursor = self._matched_cursor, self._latest_cursor
+            if not self._subscribers or after_cursor >= max_cursor:
+                self._matched_cursor = max_cursor
+                continue
+            try:
+                rows, deleted = await asyncio.to_thread(
+                    self._match, list(self._subscribers), after_cursor, max_cursor
+                )
+            except Exception as e:
+                logger.error(f"Error matching new posts: {e}")
+                await asyncio.sleep(1)
+                self._new_posts.set()
+                continue
+            self._matched_cursor = max_cursor
+            for row in rows:
+                post = post_json(row)
+                for queue in self._subscribers.get(row.feed_id, ()):
+                    self._put(queue, post)
+            for feed_id in deleted:
+                for queue in self._subscribers.pop(feed_id, ()):
+                    self._put(queue, CLOSED)
+
+    async def _keepalive_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.keepalive_seconds)
+            for queues in list(self._subscribers.values()):
+                for queue in queues:
+                    if queue.empty():
+                        queue.put_nowait(KEEPALIVE)
+
+    async def events(self, feed_id: int):
+        """Server-sent events for one client, until it disconnects or the feed is deleted."""
+        queue = self.subscribe(feed_id)
+        try:
+            yield ": connected\n\n"
+            while True:
+                item = await queue.get()
+                if item is KEEPALIVE:
+                    yield ": keepalive\n\n"
+                elif item is CLOSED:
+                    yield "event: closed\ndata: {}\n\n"
+                    return
+                else:
+                    yield f"event: post\ndata: {json.dumps(item)}\n\n"
+        finally:
+            self.unsubscribe(feed_id, queue)
+
+    def start(self) -> None:
+        self._tasks = [
+            asyncio.create_task(self._match_loop()),
+            asyncio.create_task(self._keepalive_loop()),
+        ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
@@ -0,0 +1,129 @@
+"""
+Thread context for feed pages.
+
+A post in a feed only carries the URIs of the post it replies to and of its
+thread's root, and showing them would take clients a request per post. With
+`include=thread`, get_feed returns those posts too, looked up for the whole page in
+one statement. Reply targets are stored as the author's actor id and the record
+key, so the lookup splits the URIs back into (DID, rkey) and finds each post in the
+posts_unique_commit index on (actor_id, commit_rkey, created_at).
+
+Parents and roots are only looked for from `thread_lookup_hours` before the reply,
+so the lookup reads the posts chunks of those days, and a reply to a post that has
+expired doesn't probe every chunk.
+
+A popular thread has replies all over a page and on the next pages too, so roots
+are also kept in a small per-worker cache; posts don't change once written.
+
+Context is optional, the page isn't: the lookup gets whatever is left of
+`thread_page_budget_ms` after the page itself as its statement_timeout, and if that
+runs out the page is returned with the context found so far.
+"""
+
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from shared.atproto import parse_post_uri
+from shared.config import settings
+from shared.database import PreparedStatement
+from feed_service.cache import TTLCache
+from feed_service.profiling import explainable
+from feed_service.feeds import POST_ACTORS_SQL, POST_COLUMNS_SQL, post_json
+
+logger = logging.getLogger(__name__)
+
+# below this much time left the lookup isn't worth starting
+MIN_LOOKUP_MS = 5
+
+thread_roots = TTLCache(
+    "thread_roots",
+    maxsize=settings.thread_root_cache_size,
+    ttl=settings.thread_root_cache_ttl_seconds,
+)
+
+# the newest post with each author and record key created since the given time, one
+# index probe per URI and chunk
+thread_posts_query = explainable(PreparedStatement(
+    "thread_posts",
+    f"""
+    SELECT 'at://' || t.did || '/app.bsky.feed.post/' || t.rkey AS uri, {POST_COLUMNS_SQL}
+    FROM unnest(
+        CAST(:dids AS text[]), CAST(:rkeys AS text[]), CAST(:sinces AS timestamp[])
+    ) AS t(did, rkey, since)
+    JOIN actors a ON a.did = t.did
+    JOIN LATERAL (
+        SELECT *
+        FROM posts
+        WHERE actor_id = a.id AND commit_rkey = t.rkey AND created_at >= t.since
+        ORDER BY created_at DESC
+        LIMIT 1
+    ) p ON true
+    {POST_ACTORS_SQL}
+    """,
+    dids="text[]",
+    rkeys="text[]",
+    sinces="timestamp[]",
+))
+
+set_timeout_query = text("SELECT set_config('statement_timeout', :timeout, true)")
+
+
+def thread_context(db: Session, posts: Iterable[dict], deadline: float) -> Dict[str, dict]:
+    """
+    URI -> post for the parents and roots of the posts, those found before
+    `deadline` (in time.monotonic()).
+    """
+    posts = list(posts)
+    roots = {post["thread_root"] for post in posts if post["thread_root"]}
+    # URI -> when the oldest reply to it was created
+    wanted: Dict[str, datetime] = {}
+    for post in posts:
+        created_at = datetime.fromisoformat(post["created_at"])
+        for uri in (post["reply_to"], post["thread_root"]):
+            if uri:
+                wanted[uri] = min(wanted.get(uri, created_at), created_at)
+
+    context: Dict[str, dict] = {}
+    missing: List[str] = []
+    for uri in wanted:
+        cached = thread_roots.get(uri) if uri in roots else None
+        if cached is not None:
+            context[uri] = cached
+        elif parse_post_uri(uri) is not None:
+            missing.append(uri)
+    if not missing:
+        return context
+
+    remaining_ms = (deadline - time.monotonic()) * 1000
+    if remaining_ms < MIN_LOOKUP_MS:
+        logger.info(f"No time left to look up {len(missing)} thread posts")
+        return context
+
+    targets = [parse_post_uri(uri) for uri in missing]
+    lookback = timedelta(hours=settings.thread_lookup_hours)
+    params = {
+        "dids": [did for did, _ in targets],
+        "rkeys": [rkey for _, rkey in targets],
+        "sinces": [wanted[uri] - lookback for uri in missing],
+    }
+    try:
+        # SET LOCAL, only for the rest of this transaction
+        db.execute(set_timeout_query, {"timeout": f"{int(remaining_ms)}ms"})
+        rows = db.execute(thread_posts_query.statement, params).fetchall()
+    except OperationalError as e:
+        logger.info(f"Looking up {len(missing)} thread posts ran out of time: {e.orig}")
+        db.rollback()
+        return context
+
+    for row in rows:
+        post = post_json(row)
+        context[row.uri] = post
+        if row.uri in roots:
+            thread_roots.set(row.uri, post)
+    return context
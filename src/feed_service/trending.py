@@ -0,0 +1,77 @@
+"""
+Trending terms for /api/trending.
+
+The ingestion service counts terms and writes the top terms of every time bucket to
+`trending_terms` (see ingestion.trending). Here we periodically add those buckets
+up per window and keep the result in memory, so requests never hit the database.
+"""
+
+import asyncio
+import logging
+from datetime import datetime, UTC
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# window -> (bucket granularity it's built from, how far back it goes)
+WINDOWS = {
+    "hour": ("minute", "1 hour"),
+    "day": ("hour", "1 day"),
+    "week": ("day", "7 days"),
+}
+
+top_terms_query = text(
+    """
+    SELECT term, sum(count) AS count
+    FROM trending_terms
+    WHERE granularity = :granularity AND bucket_start >= now() - CAST(:span AS interval)
+    GROUP BY term
+    ORDER BY count DESC
+    LIMIT :limit
+    """
+)
+
+
+class TrendingCache:
+    def __init__(self, session_factory: Callable[[], Session], refresh_seconds: float, size: int = 500):
+        self.session_factory = session_factory
+        self.refresh_seconds = refresh_seconds
+        self.size = size
+        self.updated_at: Optional[datetime] = None
+        self._top: dict[str, List[Tuple[str, int]]] = {window: [] for window in WINDOWS}
+        self._task: Optional[asyncio.Task] = None
+
+    def top(self, window: str, limit: int) -> List[Tuple[str, int]]:
+        return self._top[window][:limit]
+
+    def _load(self) -> dict[str, List[Tuple[str, int]]]:
+        with self.session_factory() as db:
+            return {
+                window: [
+                    (row.term, row.count)
+                    for row in db.execute(
+                        top_terms_query,
+                        {"granularity": granularity, "span": span, "limit": self.size},
+                    )
+                ]
+                for window, (granularity, span) in WINDOWS.items()
+            }
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            try:
+                self._top = await asyncio.to_thread(self._load)
+                self.updated_at = datetime.now(UTC)
+            except Exception as e:
+                logger.error(f"Error loading trending terms: {e}")
+            await asyncio.sleep(self.refresh_seconds)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
@@ -0,0 +1,58 @@
+"""
+DID -> actor id for the compact posts layout.
+
+Posts refer to their author and the authors of the posts they reply to by the id of
+a row in `actors`. Ids are cached in-process, so only DIDs we haven't seen recently
+cost a round trip, and new DIDs are inserted in a single statement per batch.
+"""
+
+import logging
+from collections import OrderedDict
+from typing import Dict, Iterable
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+insert_actors = text(
+    """
+    INSERT INTO actors (did)
+    SELECT unnest(CAST(:dids AS text[]))
+    ON CONFLICT (did) DO NOTHING
+    """
+)
+
+select_actors = text("SELECT id, did FROM actors WHERE did = ANY(CAST(:dids AS text[]))")
+
+
+class ActorIds:
+    def __init__(self, size: int = 1_000_000):
+        self.size = size
+        self._ids: OrderedDict[str, int] = OrderedDict()
+
+    def resolve(self, engine: Engine, dids: Iterable[str]) -> Dict[str, int]:
+        """Actor ids of the DIDs, creating the actors we don't know yet."""
+        ids = {}
+        missing = []
+        for did in set(dids):
+            actor_id = self._ids.get(did)
+            if actor_id is None:
+                missing.append(did)
+            else:
+                self._ids.move_to_end(did)
+                ids[did] = actor_id
+
+        if missing:
+            # committed on their own, so a failed batch of posts never leaves us
+            # caching ids that were rolled back. Sorted, so concurrent writers
+            # take the unique index locks in the same order.
+            missing.sort()
+            with engine.begin() as conn:
+                conn.execute(insert_actors, {"dids": missing})
+                for actor_id, did in conn.execute(select_actors, {"dids": missing}):
+                    ids[did] = actor_id
+                    self._ids[did] = actor_id
+            while len(self._ids) > self.size:
+                self._ids.popitem(last=False)
+        return ids
@@ -0,0 +1,322 @@
+"""
+Ingest a past range of the firehose, in parallel.
+
+Live ingestion reads one stream in cursor order, so catching up on hours of history
+runs at the speed of one connection. A backfill splits a [start, end) range of
+cursors (Jetstream's time_us) into slices and reads every slice over its own
+Jetstream connection, through a JetstreamManager so endpoints are picked and failed
+over as usual, in several worker processes:
+
+    uv run python -m ingestion.backfill run --start 2026-10-18T00:00Z --end 2026-10-18T06:00Z --slices 12 --processes 4
+    uv run python -m ingestion.backfill status
+
+A slice reads from its start and stops at the first event at or past its end. The
+slices of a process share one PostBatch, written with ingestion's single-statement
+insert, and the cursor every slice has reached is checkpointed in
+`ingestion_backfill` in the same transaction. Running the same backfill again
+resumes each unfinished slice from its checkpoint. Events read twice, after a resume
+or where slices meet (connections rewind by jetstream_rewind_seconds), are dropped
+by the insert's ON CONFLICT.
+
+Posts go through the same process_commit as live ingestion. Near-duplicate
+suppression and trending terms are about what's being posted now and are left to
+live ingestion, and posts_inserted isn't notified: live streams only want new posts.
+
+loadtest.replay serves history as fast as it's read, so a backfill can be tried
+against it. With --dry-run posts are parsed but not written, to see how fast slices
+are read without a database:
+
+    uv run python -m loadtest.replay --port 6008 &
+    JETSTREAM_URIS='["ws://localhost:6008/subscribe"]' \\
+        uv run python -m ingestion.backfill run --start 2026-10-18T00:00Z --end 2026-10-18T01:00Z --slices 4 --dry-run
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import time
+from contextlib import aclosing
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+
+from ingestion.actors import ActorIds
+from ingestion.buffer import PostBatch, insert_posts, microseconds
+from ingestion.jetstream import JetstreamManager, now_us
+from ingestion.main import engine, jetstream_uris, process_commit
+from shared.config import settings
+
+logger = logging.getLogger(__name__)
+
+POST_COLLECTION = "app.bsky.feed.post"
+
+# the slices already planned over any part of the range, from an earlier run
+existing_slices_query = text(
+    """
+    SELECT slice_start, slice_end, cursor, finished_at
+    FROM ingestion_backfill
+    WHERE slice_start < :end AND slice_end > :start
+    ORDER BY slice_start
+    """
+)
+
+plan_slices_query = text(
+    """
+    INSERT INTO ingestion_backfill (slice_start, slice_end)
+    SELECT * FROM unnest(CAST(:starts AS bigint[]), CAST(:ends AS bigint[]))
+    ON CONFLICT (slice_start, slice_end) DO NOTHING
+    """
+)
+
+checkpoint_query = text(
+    """
+    UPDATE ingestion_backfill b
+    SET cursor = coalesce(c.cursor, b.cursor),
+        posts = b.posts + c.posts,
+        started_at = coalesce(b.started_at, now()),
+        updated_at = now(),
+        finished_at = CASE WHEN c.finished THEN now() END
+    FROM unnest(
+        CAST(:starts AS bigint[]), CAST(:ends AS bigint[]), CAST(:cursors AS bigint[]),
+        CAST(:posts AS bigint[]), CAST(:finished AS boolean[])
+    ) AS c(slice_start, slice_end, cursor, posts, finished)
+    WHERE b.slice_start = c.slice_start AND b.slice_end = c.slice_end
+    """
+)
+
+status_query = text(
+    """
+    SELECT slice_start, slice_end, cursor, posts, started_at, updated_at, finished_at
+    FROM ingestion_backfill
+    ORDER BY slice_start
+    """
+)
+
+
+@dataclass
+class Slice:
+    start: int
+    end: int
+    # the last event read, everything before it is in the batch or stored
+    cursor: Optional[int] = None
+    # posts read since the last checkpoint
+    posts: int = 0
+    done: bool = False
+    # whether the checkpoint says it's done
+    finished: bool = False
+
+    def progress(self) -> float:
+        if self.done:
+            return 1.0
+        return max(0, (self.cursor or self.start) - self.start) / (self.end - self.start)
+
+
+def from_us(cursor: int) -> datetime:
+    return datetime.fromtimestamp(cursor / 1_000_000, timezone.utc)
+
+
+class SliceWriter:
+    """The batch the slices of a process fill, written with their checkpoints."""
+
+    def __init__(self, slices: List[Slice], batch_size: int, dry_run: bool):
+        self.slices = slices
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.batch = PostBatch()
+        self.actor_ids = ActorIds()
+        self.posts = 0
+        self._lock = asyncio.Lock()
+
+    async def flush(self, force: bool = False) -> None:
+        async with self._lock:
+            # another slice may have flushed while this one waited
+            if not force and len(self.batch) < self.batch_size:
+                return
+            batch, self.batch = self.batch, PostBatch()
+            checkpoints = []
+            for s in self.slices:
+                if s.cursor is not None and not s.finished:
+                    checkpoints.append((s.start, s.end, s.cursor, s.posts, s.done))
+                    s.posts = 0
+                    s.finished = s.done
+            if not self.dry_run:
+                # a failed write leaves the checkpoints where they were, run again to resume
+                await asyncio.to_thread(self._store, batch, checkpoints)
+            self.posts += len(batch)
+
+    def _store(self, batch: PostBatch, checkpoints: List[Tuple]) -> None:
+        ids = self.actor_ids.resolve(engine, batch.dids()) if len(batch) else {}
+        with engine.begin() as conn:
+            if len(batch):
+                conn.execute(insert_posts, batch.parameters(ids))
+            if checkpoints:
+                starts, ends, cursors, posts, finished = map(list, zip(*checkpoints))
+                conn.execute(
+                    checkpoint_query,
+                    {"starts": starts, "ends": ends, "cursors": cursors, "posts": posts, "finished": finished},
+                )
+
+
+async def read_slice(s: Slice, writer: SliceWriter, uris: List[str]) -> None:
+    manager = JetstreamManager(
+        uris,
+        [POST_COLLECTION],
+        stall_seconds=settings.jetstream_stall_seconds,
+        rewind_seconds=settings.jetstream_rewind_seconds,
+        backoff_seconds=settings.jetstream_backoff_seconds,
+        backoff_max_seconds=settings.jetstream_backoff_max_seconds,
+        # a standby streams live events, no use for history
+        standby=False,
+    )
+    async with aclosing(manager.events(s.cursor or s.start)) as events:
+        async for event in events:
+            cursor = event.get("time_us")
+            if cursor is None:
+                continue
+            if cursor >= s.end:
+                break
+            commit = event.get("commit") or {}
+            if (
+                event.get("kind") == "commit"
+                and commit.get("operation") == "create"
+                and commit.get("collection") == POST_COLLECTION
+            ):
+                try:
+                    if await process_commit(event.get("did"), commit, str(cursor), writer.batch):
+                        s.posts += 1
+                except Exception as e:
+                    logger.error(f"Error processing message: {e}")
+            s.cursor = cursor
+            if len(writer.batch) >= writer.batch_size:
+                await writer.flush()
+    if s.cursor is None:
+        # nothing in the slice at all
+        s.cursor = s.start
+    s.done = True
+    logger.info(f"Slice {from_us(s.start)} to {from_us(s.end)} done, Jetstream {manager.stats()}")
+
+
+async def ingest_slices(slices: List[Slice], uris: List[str], dry_run: bool, index: int) -> int:
+    writer = SliceWriter(slices, settings.batch_size, dry_run)
+    readers = asyncio.gather(*(read_slice(s, writer, uris) for s in slices))
+    started = time.monotonic()
+    while not readers.done():
+        await asyncio.wait([readers], timeout=settings.flush_interval_seconds)
+        await writer.flush(force=True)
+        elapsed = time.monotonic() - started
+        logger.info(
+            f"Process {index}: {writer.posts} posts in {elapsed:.0f} seconds ({writer.posts / max(elapsed, 1):.0f}/s), "
+            f"slices at " + ", ".join(f"{s.progress():.0%}" for s in slices)
+        )
+    # raises if a slice failed, after what was read has been written
+    readers.result()
+    return writer.posts
+
+
+def run_process(slices: List[Tuple], uris: List[str], dry_run: bool, index: int) -> int:
+    """One worker process, reading its slices concurrently."""
+    slices = [Slice(start, end, cursor) for start, end, cursor in slices]
+    return asyncio.run(ingest_slices(slices, uris, dry_run, index))
+
+
+def split(start: int, end: int, count: int) -> List[Tuple[int, int]]:
+    bounds = [start + (end - start) * i // count for i in range(count + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def gaps(start: int, end: int, slices: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """The parts of [start, end) none of the slices (sorted by start) cover."""
+    uncovered = []
+    for slice_start, slice_end in slices:
+        if slice_start > start:
+            uncovered.append((start, min(slice_start, end)))
+        start = max(start, slice_end)
+    if start < end:
+        uncovered.append((start, end))
+    return uncovered
+
+
+def plan(start: int, end: int, count: int, dry_run: bool) -> List[Tuple]:
+    """
+    (start, end, cursor) of the unfinished slices of the range. Slices planned by an
+    earlier run are kept with their progress, and only the parts of the range they
+    don't cover are split into new slices, about as many as their share of `count`.
+    """
+    if dry_run:
+        return [(s, e, None) for s, e in split(start, end, count)]
+    with engine.begin() as conn:
+        existing = conn.execute(existing_slices_query, {"start": start, "end": end}).fetchall()
+        new = []
+        for gap_start, gap_end in gaps(start, end, [(row.slice_start, row.slice_end) for row in existing]):
+            new += split(gap_start, gap_end, max(1, round(count * (gap_end - gap_start) / (end - start))))
+        if new:
+            conn.execute(plan_slices_query, {"starts": [s for s, _ in new], "ends": [e for _, e in new]})
+    if existing:
+        logger.info(
+            f"Resuming {len(existing)} slices planned before"
+            + (f", and {len(new)} new ones for the rest of the range" if new else "")
+        )
+    todo = [(row.slice_start, row.slice_end, row.cursor) for row in existing if row.finished_at is None]
+    return sorted(todo + [(s, e, None) for s, e in new])
+
+
+def run(start: int, end: int, slices: int, processes: int, uris: List[str], dry_run: bool) -> None:
+    if end > now_us():
+        raise SystemExit("--end is in the future, live ingestion covers that")
+    todo = plan(start, end, slices, dry_run)
+    if not todo:
+        print("Every slice of the range is done")
+        return
+    processes = min(processes, len(todo))
+    logger.info(
+        f"Backfilling {len(todo)} slices from {from_us(start)} to {from_us(end)} "
+        f"with {processes} processes" + (", not writing anything" if dry_run else "")
+    )
+
+    started = time.monotonic()
+    with multiprocessing.get_context("spawn").Pool(processes) as pool:
+        posts = pool.starmap(run_process, [(todo[i::processes], uris, dry_run, i) for i in range(processes)])
+    elapsed = time.monotonic() - started
+    logger.info(f"Ingested {sum(posts)} posts in {elapsed:.1f} seconds, {sum(posts) / elapsed:.0f} posts/second")
+    if not dry_run:
+        status()
+
+
+def status() -> None:
+    with engine.connect() as conn:
+        rows = conn.execute(status_query).fetchall()
+    for row in rows:
+        s = Slice(row.slice_start, row.slice_end, row.cursor, done=row.finished_at is not None)
+        line = f"{from_us(row.slice_start)} to {from_us(row.slice_end)}: {s.progress():.0%}, {row.posts} posts"
+        if row.started_at and row.updated_at > row.started_at:
+            line += f", {row.posts / (row.updated_at - row.started_at).total_seconds():.0f} posts/second"
+        print(line)
+
+
+def _cursor(value: str) -> int:
+    """A time_us cursor, or an ISO time."""
+    if value.isdigit():
+        return int(value)
+    return microseconds(datetime.fromisoformat(value.replace("Z", "+00:00")))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["run", "status"])
+    parser.add_argument("--start", type=_cursor, help="cursor or ISO time")
+    parser.add_argument("--end", type=_cursor, help="cursor or ISO time, not included")
+    parser.add_argument("--slices", type=int, default=8, help="ranges read over their own connections")
+    parser.add_argument("--processes", type=int, default=4, help="processes the slices are spread over")
+    parser.add_argument("--uri", action="append", help="Jetstream endpoint, repeat for each (default JETSTREAM_URIS, or JETSTREAM_URI)")
+    parser.add_argument("--dry-run", action="store_true", help="read and parse, but don't write posts or checkpoints")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        if args.start is None or args.end is None or args.start >= args.end:
+            parser.error("run needs --start before --end")
+        run(args.start, args.end, args.slices, args.processes, args.uri or jetstream_uris, args.dry_run)
+    else:
+        status()
@@ -0,0 +1,228 @@
+"""
+Posts waiting to be flushed, stored by column.
+
+Between flushes ingestion holds up to a batch of posts. A dict per post, with its
+own uuid object, datetimes and boxed ints, costs far more than the data in it, and
+then has to be turned into statement parameters row by row. A PostBatch instead
+keeps one list or array per column: ids are 16 bytes each in one bytearray,
+timestamps and cursors are microseconds in int64 arrays, and the few distinct
+`langs` and languages are shared between posts. A flush hands every column to one
+INSERT ... SELECT FROM unnest(...) as an array parameter, a single statement
+however big the batch.
+
+`python -m loadtest.buffer` measures the memory this saves.
+"""
+
+import json
+import os
+from array import array
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from uuid import UUID
+
+from sqlalchemy import text
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = datetime.resolution
+
+# distinct `langs` are few, their JSON is shared between posts up to this many
+MAX_SHARED_VALUES = 4096
+
+insert_posts = text(
+    """
+    INSERT INTO posts (
+        id, actor_id, commit_rev, commit_rkey, commit_cid,
+        created_at, langs, lang, ts_config, search_text,
+        reply_parent_actor_id, reply_parent_rkey, reply_parent_cid,
+        reply_root_actor_id, reply_root_rkey, reply_root_cid,
+        record_text, ingest_time, cursor, simhash, canonical_id
+    )
+    SELECT
+        id, actor_id, commit_rev, commit_rkey, commit_cid,
+        -- created_at is UTC without a time zone
+        TIMESTAMP 'epoch' + created_at * INTERVAL '1 microsecond',
+        ARRAY(SELECT jsonb_array_elements_text(CAST(langs AS jsonb))), lang,
+        CAST(ts_config AS regconfig), search_text,
+        reply_parent_actor_id, reply_parent_rkey, reply_parent_cid,
+        reply_root_actor_id, reply_root_rkey, reply_root_cid,
+        record_text, TIMESTAMPTZ 'epoch' + ingest_time * INTERVAL '1 microsecond',
+        cursor, simhash, canonical_id
+    FROM unnest(
+        CAST(:id AS uuid[]), CAST(:actor_id AS integer[]), CAST(:commit_rev AS text[]),
+        CAST(:commit_rkey AS text[]), CAST(:commit_cid AS bytea[]),
+        CAST(:created_at AS bigint[]), CAST(:langs AS text[]), CAST(:lang AS text[]),
+        CAST(:ts_config AS text[]), CAST(:search_text AS text[]),
+        CAST(:reply_parent_actor_id AS integer[]), CAST(:reply_parent_rkey AS text[]),
+        CAST(:reply_parent_cid AS bytea[]),
+        CAST(:reply_root_actor_id AS integer[]), CAST(:reply_root_rkey AS text[]),
+        CAST(:reply_root_cid AS bytea[]),
+        CAST(:record_text AS text[]), CAST(:ingest_time AS bigint[]), CAST(:cursor AS bigint[]),
+        CAST(:simhash AS bigint[]), CAST(:canonical_id AS uuid[])
+    ) AS batch(
+        id, actor_id, commit_rev, commit_rkey, commit_cid,
+        created_at, langs, lang, ts_config, search_text,
+        reply_parent_actor_id, reply_parent_rkey, reply_parent_cid,
+        reply_root_actor_id, reply_root_rkey, reply_root_cid,
+        record_text, ingest_time, cursor, simhash, canonical_id
+    )
+    -- a post we've already stored, seen again after a reconnect
+    ON CONFLICT (actor_id, commit_rkey, created_at) DO NOTHING
+    """
+)
+
+
+def microseconds(value: datetime) -> int:
+    """Microseconds since the epoch, naive datetimes are UTC."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return (value - EPOCH) // _MICROSECOND
+
+
+def new_id() -> bytearray:
+    """A random (version 4) UUID's bytes, without making a UUID."""
+    value = bytearray(os.urandom(16))
+    value[6] = (value[6] & 0x0F) | 0x40
+    value[8] = (value[8] & 0x3F) | 0x80
+    return value
+
+
+class PostBatch:
+    """The columns of the posts buffered for the next flush."""
+
+    __slots__ = (
+        "_ids",
+        "did",
+        "commit_rev",
+        "commit_rkey",
+        "commit_cid",
+        "created_at",
+        "langs",
+        "lang",
+        "ts_config",
+        "search_text",
+        "reply_parent_did",
+        "reply_parent_rkey",
+        "reply_parent_cid",
+        "reply_root_did",
+        "reply_root_rkey",
+        "reply_root_cid",
+        "record_text",
+        "ingest_time",
+        "cursor",
+        "simhash",
+        "canonical_id",
+        "_shared",
+    )
+
+    # columns held in lists, the others are arrays
+    LISTS = (
+        "did", "commit_rev", "commit_rkey", "commit_cid", "langs", "lang", "ts_config",
+        "search_text", "reply_parent_did", "reply_parent_rkey", "reply_parent_cid",
+        "reply_root_did", "reply_root_rkey", "reply_root_cid", "record_text", "simhash",
+        "canonical_id",
+    )
+    ARRAYS = ("created_at", "ingest_time", "cursor")
+
+    def __init__(self):
+        self._ids = bytearray()
+        for column in self.LISTS:
+            setattr(self, column, [])
+        for column in self.ARRAYS:
+            setattr(self, column, array("q"))
+        self._shared: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self.cursor)
+
+    def _share(self, value: Optional[str]) -> Optional[str]:
+        if value is None:
+            return None
+        shared = self._shared.get(value)
+        if shared is None:
+            if len(self._shared) >= MAX_SHARED_VALUES:
+                return value
+            shared = self._shared[value] = value
+        return shared
+
+    def append(
+        self,
+        did: str,
+        commit_rev: Optional[str],
+        commit_rkey: Optional[str],
+        commit_cid: Optional[bytes],
+        created_at: datetime,
+        langs: List[str],
+        lang: str,
+        ts_config: str,
+        search_text: Optional[str],
+        reply_parent_did: Optional[str],
+        reply_parent_rkey: Optional[str],
+        reply_parent_cid: Optional[bytes],
+        reply_root_did: Optional[str],
+        reply_root_rkey: Optional[str],
+        reply_root_cid: Optional[bytes],
+        record_text: str,
+        ingest_time: datetime,
+        cursor: int,
+    ) -> None:
+        # everything that can fail first, so the columns stay the same length
+        created_at = microseconds(created_at)
+        ingest_time = microseconds(ingest_time)
+        langs = self._share(json.dumps(langs)) if langs else None
+        self.cursor.append(cursor)
+        self._ids += new_id()
+        self.did.append(did)
+        self.commit_rev.append(commit_rev)
+        self.commit_rkey.append(commit_rkey)
+        self.commit_cid.append(commit_cid)
+        self.created_at.append(created_at)
+        self.langs.append(langs)
+        self.lang.append(self._share(lang))
+        self.ts_config.append(ts_config)
+        self.search_text.append(search_text)
+        self.reply_parent_did.append(reply_parent_did)
+        self.reply_parent_rkey.append(reply_parent_rkey)
+        self.reply_parent_cid.append(reply_parent_cid)
+        self.reply_root_did.append(reply_root_did)
+        self.reply_root_rkey.append(reply_root_rkey)
+        self.reply_root_cid.append(reply_root_cid)
+        self.record_text.append(record_text)
+        self.ingest_time.append(ingest_time)
+        self.simhash.append(None)
+        # set if this is a near-duplicate of an earlier post
+        self.canonical_id.append(None)
+
+    def id(self, i: int) -> str:
+        return str(UUID(bytes=bytes(self._ids[16 * i : 16 * i + 16])))
+
+    def keep(self, rows: List[int]) -> None:
+        """Drop every row but these, in place."""
+        if len(rows) == len(self):
+            return
+        self._ids = bytearray(b"".join(self._ids[16 * i : 16 * i + 16] for i in rows))
+        for column in self.LISTS:
+            values = getattr(self, column)
+            setattr(self, column, [values[i] for i in rows])
+        for column in self.ARRAYS:
+            values = getattr(self, column)
+            setattr(self, column, array("q", (values[i] for i in rows)))
+
+    def dids(self) -> List[str]:
+        """Every DID the posts refer to, authors and the authors they reply to."""
+        return (
+            self.did
+            + [did for did in self.reply_parent_did if did]
+            + [did for did in self.reply_root_did if did]
+        )
+
+    def parameters(self, actor_ids: Dict[str, int]) -> dict:
+        """The columns as the array parameters of insert_posts."""
+        columns = {column: getattr(self, column) for column in self.LISTS}
+        for column in self.ARRAYS:
+            columns[column] = getattr(self, column).tolist()
+        del columns["did"], columns["reply_parent_did"], columns["reply_root_did"]
+        columns["id"] = [self.id(i) for i in range(len(self))]
+        columns["actor_id"] = [actor_ids[did] for did in self.did]
+        columns["reply_parent_actor_id"] = [actor_ids.get(did) for did in self.reply_parent_did]
+        columns["reply_root_actor_id"] = [actor_ids.get(did) for did in self.reply_root_did]
+        return columns
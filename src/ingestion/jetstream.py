@@ -0,0 +1,338 @@
+"""
+Jetstream connections across several endpoints.
+
+The public Jetstream instances all relay the same firehose, so when one drops or
+falls behind we can carry on from another. The manager here:
+
+- probes every endpoint for connect latency and how far behind its events are, and
+  streams from the best one
+- keeps a warm standby streaming from the next best, buffering its last
+  `stall_seconds + rewind_seconds` of events. When the active stream stalls (nothing
+  for `stall_seconds`) or closes, the standby takes over from its buffer with no gap
+- otherwise reconnects from the cursor rewound by `rewind_seconds`, trying endpoints
+  in order of their probe, with jittered exponential backoff per endpoint
+
+Every instance stamps events with its own `time_us`, so cursors only roughly carry
+over between endpoints. Rewinding a little makes sure nothing is missed, and events
+already delivered are recognised by their commit (did, rev, rkey) and skipped.
+"""
+
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import AsyncIterator, Deque, Hashable, List, Optional, Set
+
+import websockets
+
+logger = logging.getLogger(__name__)
+
+
+class StreamClosed(Exception):
+    pass
+
+
+def now_us() -> int:
+    return int(time.time() * 1_000_000)
+
+
+def event_key(event: dict) -> Optional[Hashable]:
+    """What identifies an event across endpoints, None for events we don't dedup."""
+    commit = event.get("commit")
+    if event.get("kind") != "commit" or not commit:
+        return None
+    return (event.get("did"), commit.get("rev"), commit.get("collection"), commit.get("rkey"))
+
+
+@dataclass
+class Endpoint:
+    uri: str
+    # seconds to open a connection, and how far its newest events were behind our clock
+    connect_seconds: Optional[float] = None
+    lag_seconds: Optional[float] = None
+    failures: int = 0
+    retry_at: float = 0
+
+    @property
+    def score(self) -> float:
+        """Lower is better, endpoints that didn't answer the probe go last."""
+        if self.connect_seconds is None or self.lag_seconds is None:
+            return float("inf")
+        return self.connect_seconds + max(self.lag_seconds, 0)
+
+    def url(self, collections: List[str], cursor: Optional[int] = None) -> str:
+        url = f"{self.uri}?" + "&".join(f"wantedCollections={c}" for c in collections)
+        return f"{url}&cursor={cursor}" if cursor else url
+
+
+class Stream:
+    """
+    One websocket to an endpoint, read into a buffer by a background task.
+
+    Active streams hold at most `max_buffer` events and stop reading while it's
+    full. Standby streams only keep the events of the last `keep_us`, so they can
+    take over from a little before where the active stream stopped.
+    """
+
+    def __init__(self, endpoint: Endpoint, max_buffer: int, keep_us: int):
+        self.endpoint = endpoint
+        self.max_buffer = max_buffer
+        self.keep_us = keep_us
+        self.active = False
+        self.closed = False
+        self.events: Deque[dict] = deque()
+        self.last_received = time.monotonic()
+        self._ws = None
+        self._task: Optional[asyncio.Task] = None
+        self._ready = asyncio.Event()
+        self._room = asyncio.Event()
+        self._room.set()
+
+    async def open(self, url: str, timeout: float) -> None:
+        self._ws = await websockets.connect(url, open_timeout=timeout, max_size=None)
+        self.last_received = time.monotonic()
+        self._task = asyncio.create_task(self._read())
+
+    async def _read(self) -> None:
+        try:
+            async for message in self._ws:
+                event = json.loads(message)
+                self.last_received = time.monotonic()
+                self.events.append(event)
+                self._ready.set()
+                if self.active:
+                    if len(self.events) >= self.max_buffer:
+                        self._room.clear()
+                        await self._room.wait()
+                else:
+                    oldest = (event.get("time_us") or 0) - self.keep_us
+                    while self.events and (
+                        len(self.events) > self.max_buffer
+                        or (self.events[0].get("time_us") or 0) < oldest
+                    ):
+                        self.events.popleft()
+        except Exception as e:
+            logger.warning(f"Stream from {self.endpoint.uri} ended: {e}")
+        finally:
+            self.closed = True
+            self._ready.set()
+
+    def stalled(self, stall_seconds: float) -> bool:
+        return self.closed or time.monotonic() - self.last_received > stall_seconds
+
+    def covers(self, cursor: int) -> bool:
+        """Whether the buffer reaches back to the cursor, so taking over leaves no gap."""
+        return bool(self.events) and (self.events[0].get("time_us") or 0) <= cursor
+
+    async def next(self, timeout: float) -> dict:
+        """The next event, TimeoutError if none arrives in time, StreamClosed at the end."""
+        while not self.events:
+            if self.closed:
+                raise StreamClosed(self.endpoint.uri)
+            self._ready.clear()
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        event = self.events.popleft()
+        self._room.set()
+        return event
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+        if self._ws is not None:
+            await self._ws.close()
+        self.closed = True
+
+
+class JetstreamManager:
+    def __init__(
+        self,
+        uris: List[str],
+        collections: List[str],
+        stall_seconds: float = 15,
+        rewind_seconds: float = 5,
+        backoff_seconds: float = 1,
+        backoff_max_seconds: float = 60,
+        probe_timeout: float = 5,
+        standby: bool = True,
+        max_buffer: int = 10_000,
+        dedup_size: int = 100_000,
+    ):
+        self.endpoints = [Endpoint(uri) for uri in uris]
+        self.collections = collections
+        self.stall_seconds = stall_seconds
+        self.rewind_us = int(rewind_seconds * 1_000_000)
+        self.backoff_seconds = backoff_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.probe_timeout = probe_timeout
+        self.standby_enabled = standby and len(uris) > 1
+        self.max_buffer = max_buffer
+        self.active: Optional[Stream] = None
+        self.standby: Optional[Stream] = None
+        # keys of recently delivered events, oldest first
+        self._seen: Set[Hashable] = set()
+        self._seen_order: Deque[Hashable] = deque()
+        self.dedup_size = dedup_size
+        self.failovers = 0
+        self.reconnects = 0
+        self.duplicates = 0
+
+    async def probe(self, endpoint: Endpoint) -> None:
+        """Time connecting to the endpoint and see how old its first live event is."""
+        started = time.monotonic()
+        try:
+            async with websockets.connect(
+                endpoint.url(self.collections), open_timeout=self.probe_timeout, max_size=None
+            ) as ws:
+                connected = time.monotonic()
+                event = json.loads(await asyncio.wait_for(ws.recv(), self.probe_timeout))
+            endpoint.connect_seconds = connected - started
+            endpoint.lag_seconds = (now_us() - event["time_us"]) / 1_000_000
+        except Exception as e:
+            logger.warning(f"Probe of {endpoint.uri} failed: {e}")
+            endpoint.connect_seconds = endpoint.lag_seconds = None
+
+    async def probe_all(self) -> List[Endpoint]:
+        """Endpoints best first."""
+        await asyncio.gather(*(self.probe(endpoint) for endpoint in self.endpoints))
+        ranked = sorted(self.endpoints, key=lambda e: e.score)
+        logger.info(
+            "Jetstream endpoints: "
+            + ", ".join(
+                f"{e.uri} ({e.connect_seconds:.3f}s connect, {e.lag_seconds:.3f}s behind)"
+                if e.score != float("inf")
+                else f"{e.uri} (unreachable)"
+                for e in ranked
+            )
+        )
+        return ranked
+
+    def _backoff(self, endpoint: Endpoint) -> None:
+        endpoint.failures += 1
+        # full jitter, so many clients of a failed endpoint don't come back in step
+        delay = random.uniform(0, min(self.backoff_max_seconds, self.backoff_seconds * 2**endpoint.failures))
+        endpoint.retry_at = time.monotonic() + delay
+
+    async def _open(self, endpoint: Endpoint, cursor: Optional[int]) -> Optional[Stream]:
+        # a standby must still have the events from before the active stream stalled
+        keep_us = int(self.stall_seconds * 1_000_000) + self.rewind_us
+        stream = Stream(endpoint, self.max_buffer, keep_us)
+        try:
+            await stream.open(endpoint.url(self.collections, cursor), self.probe_timeout)
+        except Exception as e:
+            logger.warning(f"Couldn't connect to {endpoint.uri}: {e}")
+            self._backoff(endpoint)
+            return None
+        endpoint.failures = 0
+        return stream
+
+    async def _connect(self, cursor: Optional[int], exclude: Optional[Endpoint] = None) -> Stream:
+        """A stream from the best endpoint that will have us, from the rewound cursor."""
+        rewound = cursor - self.rewind_us if cursor else None
+        while True:
+            ranked = await self.probe_all()
+            now = time.monotonic()
+            candidates = [e for e in ranked if e.retry_at <= now and e is not exclude]
+            for endpoint in candidates or [e for e in ranked if e.retry_at <= now]:
+                stream = await self._open(endpoint, rewound)
+                if stream is not None:
+                    logger.info(f"Streaming from {endpoint.uri}" + (f" at cursor {rewound}" if rewound else ""))
+                    return stream
+            wait = max(0.0, min(e.retry_at for e in self.endpoints) - time.monotonic())
+            logger.warning(f"No Jetstream endpoint available, retrying in {wait:.1f} seconds")
+            await asyncio.sleep(wait)
+
+    async def _ensure_standby(self) -> None:
+        """Start (or replace) the standby on the best endpoint other than the active one."""
+        if not self.standby_enabled:
+            return
+        if self.standby is not None and not self.standby.stalled(self.stall_seconds):
+            return
+        if self.standby is not None:
+            logger.warning(f"Standby stream from {self.standby.endpoint.uri} stalled, replacing it")
+            self._backoff(self.standby.endpoint)
+            await self.standby.close()
+            self.standby = None
+        now = time.monotonic()
+        for endpoint in sorted(self.endpoints, key=lambda e: e.score):
+            if endpoint is self.active.endpoint or endpoint.retry_at > now:
+                continue
+            self.standby = await self._open(endpoint, None)
+            if self.standby is not None:
+                logger.info(f"Standby streaming from {endpoint.uri}")
+                return
+
+    async def _fail_over(self, cursor: Optional[int]) -> None:
+        failed = self.active
+        await failed.close()
+        self._backoff(failed.endpoint)
+        standby, self.standby = self.standby, None
+        if standby is not None and not standby.stalled(self.stall_seconds) and cursor and standby.covers(cursor):
+            # the standby's buffer reaches back past where we were, continue from it
+            while standby.events and standby.events[0].get("time_us", 0) < cursor - self.rewind_us:
+                standby.events.popleft()
+            standby.active = True
+            self.active = standby
+            self.failovers += 1
+            logger.warning(f"Failed over from {failed.endpoint.uri} to standby {standby.endpoint.uri}")
+        else:
+            if standby is not None:
+                await standby.close()
+            self.active = await self._connect(cursor, exclude=failed.endpoint)
+            self.active.active = True
+            self.reconnects += 1
+        await self._ensure_standby()
+
+    def _remember(self, key: Hashable) -> bool:
+        """False if the event was already delivered."""
+        if key in self._seen:
+            return False
+        self._seen.add(key)
+        self._seen_order.append(key)
+        if len(self._seen_order) > self.dedup_size:
+            self._seen.discard(self._seen_order.popleft())
+        return True
+
+    async def events(self, cursor: Optional[int] = None) -> AsyncIterator[dict]:
+        """Events from `cursor` (or live) on, across endpoint failures, without repeats."""
+        self.active = await self._connect(cursor)
+        self.active.active = True
+        await self._ensure_standby()
+        checked = time.monotonic()
+        try:
+            while True:
+                try:
+                    event = await self.active.next(self.stall_seconds)
+                except (asyncio.TimeoutError, StreamClosed) as e:
+                    logger.warning(
+                        f"Stream from {self.active.endpoint.uri} "
+                        + ("closed" if isinstance(e, StreamClosed) else f"stalled for {self.stall_seconds} seconds")
+                    )
+                    await self._fail_over(cursor)
+                    continue
+
+                key = event_key(event)
+                if key is not None and not self._remember(key):
+                    self.duplicates += 1
+                    continue
+                cursor = event.get("time_us") or cursor
+                yield event
+
+                if time.monotonic() - checked > self.stall_seconds:
+                    checked = time.monotonic()
+                    await self._ensure_standby()
+        finally:
+            for stream in (self.active, self.standby):
+                if stream is not None:
+                    await stream.close()
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active.endpoint.uri if self.active else None,
+            "standby": self.standby.endpoint.uri if self.standby else None,
+            "failovers": self.failovers,
+            "reconnects": self.reconnects,
+            "duplicates": self.duplicates,
+        }
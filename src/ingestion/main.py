@@ -1,13 +1,18 @@
 import asyncio
 import json
 import logging
-from datetime import datetime, timezone
-import websockets
+from datetime import datetime, timedelta, timezone
 from sqlalchemy import create_engine, text
 from typing import Optional
 from dataclasses import dataclass, field
+from shared.atproto import cid_to_bytes, parse_post_uri
 from shared.config import settings
-from uuid import uuid4
+from shared.text_search import has_cjk, primary_language, segment_cjk, text_search_config
+from ingestion.actors import ActorIds
+from ingestion.buffer import PostBatch, insert_posts
+from ingestion.jetstream import JetstreamManager
+from ingestion.simhash import NearDuplicateIndex, features, simhash, to_signed
+from ingestion.trending import TrendingTerms, tokenize
 import os
 
 
@@ -23,7 +28,26 @@ engine = create_engine(settings.database_url)
 # load settings
 batch_size = settings.batch_size
 flush_interval = settings.flush_interval_seconds
-base_uri = settings.jetstream_uri
+jetstream_uris = settings.jetstream_uris or [settings.jetstream_uri]
+trending = (
+    TrendingTerms(
+        top_k=settings.trending_top_k,
+        width=settings.trending_sketch_width,
+        depth=settings.trending_sketch_depth,
+    )
+    if settings.trending_enabled
+    else None
+)
+near_duplicates = (
+    NearDuplicateIndex(
+        distance=settings.near_duplicate_distance,
+        window=timedelta(seconds=settings.near_duplicate_window_seconds),
+        max_entries=settings.near_duplicate_max_entries,
+    )
+    if settings.near_duplicates_enabled
+    else None
+)
+actor_ids = ActorIds()
 logger.info(f"CurDir: {os.getcwd()}")
 logger.info(settings.model_dump())
 
@@ -32,10 +56,8 @@ logger.info(settings.model_dump())
 class IngestionState:
     cursor: Optional[str] = None
     last_flush: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
-    buffer: list = None
-
-    def __post_init__(self):
-        self.buffer = []
+    last_trending_persist: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+    buffer: PostBatch = field(default_factory=PostBatch)
 
 
 async def get_last_cursor() -> Optional[str]:
@@ -51,15 +73,15 @@ async def get_last_cursor() -> Optional[str]:
     )
     with engine.connect() as conn:
         result = conn.execute(query).first()
-        return result[0] if result else None
+        return str(result[0]) if result else None
 
 
-async def process_commit(did: str, op, cursor: str):
-    """Extract post data from an operation"""
+async def process_commit(did: str, op, cursor: str, batch: PostBatch) -> bool:
+    """Extract post data from an operation into the batch, whether it was a post we keep"""
     record = op.get("record", {})
     if len(record.keys()) == 0:
         logger.info("empty record %s", op)
-        return
+        return False
     # Handle the case where createdAt might be None or empty
     # TODO: some of these dates are clearly BS, 1970-01-01 00:00:00 for example (obv unix 0 time)
     created_at_str = record.get("createdAt", "")
@@ -94,92 +116,75 @@ async def process_commit(did: str, op, cursor: str):
     # Seem to get a few of these, probably due to bad encoding from the client.
     if "\x00" in record_text:
         logger.info("DID %s record_text contains null byte %s", did, op)
-        return
+        return False
 
     if record_text == "":
         # logger.info("empty text %s", op)
-        return
+        return False
+
+    # Embeddings are generated out-of-band by the embedding service. Inline they ran
+    # terribly: 0.2127881232 seconds/250 records w/o embedding, 1.832572528 seconds/250
+    # records w/ embedding, about 10x slower, and the firehose frequently disconnected.
+
+    # reply targets are stored as (author, rkey), the author's actor id is looked up
+    # when the batch is stored
+    parent = record.get("reply", {}).get("parent", {})
+    root = record.get("reply", {}).get("root", {})
+    parent_did, parent_rkey = parse_post_uri(parent.get("uri")) or (None, None)
+    root_did, root_rkey = parse_post_uri(root.get("uri")) or (None, None)
+
+    # tokenized with the text search configuration of its language, CJK text as bigrams
+    langs = record.get("langs", [])
+    lang = primary_language(langs)
+    search_text = None
+    if settings.cjk_bigrams_enabled and has_cjk(record_text):
+        search_text = segment_cjk(record_text)
+
+    batch.append(
+        did=did,
+        commit_rev=op.get("rev"),
+        commit_rkey=op.get("rkey"),
+        commit_cid=cid_to_bytes(op.get("cid")),
+        created_at=created_at,
+        langs=langs,
+        lang=lang,
+        ts_config=text_search_config(lang),
+        search_text=search_text,
+        reply_parent_did=parent_did,
+        reply_parent_rkey=parent_rkey,
+        reply_parent_cid=cid_to_bytes(parent.get("cid")),
+        reply_root_did=root_did,
+        reply_root_rkey=root_rkey,
+        reply_root_cid=cid_to_bytes(root.get("cid")),
+        record_text=record_text,
+        ingest_time=datetime.now(timezone.utc),
+        cursor=int(cursor),  # Cursor tells us where we left off
+    )
+    return True
 
-    # This runs terrible, I think embedding needs to be taken out-of-band
-    # 0.2127881232 seconds/250 records w/o embedding
-    # 1.832572528 seconds/250 records w/ embedding, about 10x slower
-    # Also the firehose frequently disconnects with embeddings on I suspect a timeout
-    # Also, the database acts strangely, it seems like the app thinks it's committing rows
-    # but they don't show up in the database as an increasing row count.
-    embedding = None # generate_embedding(record_text)
-
-    return {
-        "id": uuid4(),
-        "did": did,
-        "commit_rev": op.get("rev"),
-        "commit_operation": op.get("operation"),
-        "commit_collection": op.get("collection"),
-        "commit_rkey": op.get("rkey"),
-        "commit_cid": op.get("cid"),
-        "created_at": created_at,
-        "langs": record.get("langs", []),
-        "reply_parent_cid": record.get("reply", {}).get("parent", {}).get("cid"),
-        "reply_parent_uri": record.get("reply", {}).get("parent", {}).get("uri"),
-        "reply_root_cid": record.get("reply", {}).get("root", {}).get("cid"),
-        "reply_root_uri": record.get("reply", {}).get("root", {}).get("uri"),
-        "record_text": record_text,
-        "ingest_time": datetime.now(timezone.utc),
-        "cursor": cursor,  # Cursor tells us where we left off
-        'embedding': embedding
-    }
-
-
-async def store_posts(posts, engine):
-    """Store multiple posts in the database"""
-    if not posts:
-        return
 
-    insert_stmt = text(
-        """
-        INSERT INTO posts (
-            id, did, commit_rev, commit_operation,
-            commit_collection, commit_rkey, commit_cid,
-            created_at, langs, reply_parent_cid,
-            reply_parent_uri, reply_root_cid, reply_root_uri,
-            record_text, ingest_time, cursor
-        )
-        VALUES (
-            :id, :did, :commit_rev, :commit_operation,
-            :commit_collection, :commit_rkey, :commit_cid,
-            :created_at, :langs, :reply_parent_cid,
-            :reply_parent_uri, :reply_root_cid, :reply_root_uri,
-            :record_text, :ingest_time, :cursor
-        )
-        ON CONFLICT (created_at, commit_rev, commit_operation, commit_collection, commit_rkey, commit_cid)
-        DO UPDATE SET
-            id = EXCLUDED.id,  -- Keep latest ID
-            did = EXCLUDED.did,
-            created_at = EXCLUDED.created_at,  -- Ensuring latest timestamp is kept
-            langs = EXCLUDED.langs,
-            reply_parent_cid = EXCLUDED.reply_parent_cid,
-            reply_parent_uri = EXCLUDED.reply_parent_uri,
-            reply_root_cid = EXCLUDED.reply_root_cid,
-            reply_root_uri = EXCLUDED.reply_root_uri,
-            record_text = EXCLUDED.record_text,
-            ingest_time = EXCLUDED.ingest_time,
-            cursor = EXCLUDED.cursor
-        WHERE posts.created_at < EXCLUDED.created_at;
-        """
-    )
+async def store_posts(posts: PostBatch, engine):
+    """Store a batch of posts in the database, in one statement"""
+    if not len(posts):
+        return
 
-    with engine.begin() as conn:
-        for post in posts:
-            try:
-                conn.execute(insert_stmt, post)
-            except Exception as e:
-                logger.error(f"Error inserting post {post['id']}: {e}")
+    ids = actor_ids.resolve(engine, posts.dids())
 
+    # tells feed_service which cursors to look at for live feed streams, sent on commit
+    notify_stmt = text("SELECT pg_notify('posts_inserted', :payload)")
+    payload = json.dumps({"min_cursor": min(posts.cursor), "max_cursor": max(posts.cursor)})
 
-async def process_message(message, state: IngestionState):
-    """Process a message from the firehose"""
     try:
-        data = json.loads(message)
+        with engine.begin() as conn:
+            conn.execute(insert_posts, posts.parameters(ids))
+            conn.execute(notify_stmt, {"payload": payload})
+    except Exception as e:
+        logger.error(f"Error inserting {len(posts)} posts: {e}")
+
 
+async def process_event(data: dict, state: IngestionState):
+    """Process a decoded event from the firehose"""
+    try:
         # Update cursor from message
         cursor = data.get("time_us")
         if cursor is None:
@@ -201,59 +206,106 @@ async def process_message(message, state: IngestionState):
         if data.get("commit", {}).get("operation", "") != "create":
             return
 
-        post_data = await process_commit(
-            data.get("did"), data.get("commit"), state.cursor
+        await process_commit(
+            data.get("did"), data.get("commit"), state.cursor, state.buffer
         )
-        if post_data:
-            state.buffer.append(post_data)
 
-    except json.JSONDecodeError:
-        logger.error("Failed to decode message")
     except Exception as e:
         logger.error(f"Error processing message: {e}")
 
 
+async def suppress_duplicates(state: IngestionState, now: datetime):
+    """Point near-duplicates at the post they copy, or drop them from the buffer"""
+    posts = state.buffer
+    kept = []
+    duplicates = 0
+    for i, record_text in enumerate(posts.record_text):
+        words = features(tokenize(record_text))
+        if len(words) >= settings.near_duplicate_min_words:
+            fingerprint = simhash(words)
+            posts.simhash[i] = to_signed(fingerprint)
+            posts.canonical_id[i] = near_duplicates.check(fingerprint, posts.id(i), now)
+        if posts.canonical_id[i] is not None:
+            duplicates += 1
+            if settings.near_duplicate_drop:
+                continue
+        kept.append(i)
+
+    if duplicates:
+        logger.info(
+            f"{duplicates} of {len(state.buffer)} posts are near-duplicates, "
+            f"{near_duplicates.suppression_rate:.1%} of {near_duplicates.checked} checked since start, "
+            f"{len(near_duplicates)} posts indexed"
+        )
+    posts.keep(kept)
+
+
+async def count_trending(state: IngestionState, now: datetime):
+    """Count the flushed posts into the trending terms, persisting them every so often"""
+    for record_text in state.buffer.record_text:
+        trending.add(record_text, now)
+
+    if (now - state.last_trending_persist).total_seconds() >= settings.trending_persist_seconds:
+        try:
+            rows = trending.persist(engine)
+            logger.info(f"Persisted {rows} trending terms from {trending.posts} posts")
+        except Exception as e:
+            logger.error(f"Error persisting trending terms: {e}")
+        state.last_trending_persist = now
+
+
 async def run_ingestion():
     """Main ingestion loop"""
     # Initialize state
     state = IngestionState()
     state.cursor = await get_last_cursor()
+    if trending is not None:
+        try:
+            rows = trending.restore(engine)
+            logger.info(f"Restored {rows} trending terms")
+        except Exception as e:
+            logger.error(f"Error restoring trending terms: {e}")
 
     logger.info(
         f"Initializing with batch size {batch_size} and flushing every {flush_interval} seconds"
     )
 
-    # Construct initial URI
-    uri = f"{base_uri}?wantedCollections=app.bsky.feed.post"
+    manager = JetstreamManager(
+        jetstream_uris,
+        ["app.bsky.feed.post"],
+        stall_seconds=settings.jetstream_stall_seconds,
+        rewind_seconds=settings.jetstream_rewind_seconds,
+        backoff_seconds=settings.jetstream_backoff_seconds,
+        backoff_max_seconds=settings.jetstream_backoff_max_seconds,
+        standby=settings.jetstream_standby,
+    )
     if state.cursor:
-        uri = f"{uri}&cursor={state.cursor}"
         logger.info(f"Resuming from cursor: {state.cursor}")
     else:
-        logger.info("Starting from beginning of stream")
+        logger.info("Starting from the live end of the stream")
 
     while True:
         try:
-            async with websockets.connect(uri) as websocket:
-                logger.info("Connected to Bluesky firehose")
-
-                while True:
-                    message = await websocket.recv()
-                    await process_message(message, state)
-
-                    # Flush buffer if it's big enough or enough time has passed
-                    now = datetime.now(timezone.utc)
-                    elapsed = (now - state.last_flush).total_seconds()
-                    if len(state.buffer) >= batch_size or elapsed >= flush_interval:
-                        logger.info(
-                            f"Flushing {len(state.buffer)} posts after {elapsed} seconds"
-                        )
-                        await store_posts(state.buffer, engine)
-                        state.buffer = []
-                        state.last_flush = now
-
-        except websockets.exceptions.ConnectionClosed:
-            logger.warning("Connection closed, attempting to reconnect...")
-            await asyncio.sleep(5)
+            # reconnects and fails over between endpoints by itself
+            async for event in manager.events(int(state.cursor) if state.cursor else None):
+                await process_event(event, state)
+
+                # Flush buffer if it's big enough or enough time has passed
+                now = datetime.now(timezone.utc)
+                elapsed = (now - state.last_flush).total_seconds()
+                if len(state.buffer) >= batch_size or elapsed >= flush_interval:
+                    logger.info(
+                        f"Flushing {len(state.buffer)} posts after {elapsed} seconds, "
+                        f"Jetstream {manager.stats()}"
+                    )
+                    if near_duplicates is not None:
+                        await suppress_duplicates(state, now)
+                    await store_posts(state.buffer, engine)
+                    if trending is not None:
+                        await count_trending(state, now)
+                    state.buffer = PostBatch()
+                    state.last_flush = now
+
         except Exception as e:
             logger.error(f"Error in ingestion loop: {e}")
             await asyncio.sleep(5)
@@ -0,0 +1,144 @@
+"""
+Near-duplicate detection for bot floods and copy-paste spam.
+
+Every post gets a 64-bit SimHash of its words: texts that share most of their words
+end up with fingerprints that differ in only a few bits. Posts within `distance` bits of a post seen in the last `window` are near-duplicates of it.
+
+To avoid comparing against every recent post, the fingerprint is split into
+`distance + 1` bands. Two fingerprints at most `distance` bits apart must agree on
+at least one whole band, so only posts sharing a band value are compared. Only
+canonical posts (the first of their kind) are indexed, and entries expire in the
+order they were added, so the index is a sliding window with O(1) expiry.
+"""
+
+import hashlib
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from ingestion.trending import STOPWORDS
+
+BITS = 64
+MASK = (1 << BITS) - 1
+
+
+def _feature_hash(feature: str) -> int:
+    # stable across processes, unlike hash(), since fingerprints are stored
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+# byte -> its 8 bits spread into 16-bit lanes, so one addition counts 8 bits at once
+_SPREAD = [sum(((b >> j) & 1) << (16 * j) for j in range(8)) for b in range(256)]
+
+
+def features(tokens: List[str]) -> Set[str]:
+    """
+    The distinct words that say something. Floods usually differ only in who they
+    mention, a number or a link (already gone after tokenizing), so those are left
+    out along with stopwords, which makes such copies identical rather than near.
+    """
+    return {
+        t for t in tokens if t not in STOPWORDS and not t.startswith("@") and not t.isdigit()
+    }
+
+
+def simhash(feature_set: Set[str]) -> int:
+    """64-bit SimHash, every feature weighing the same."""
+    # per byte of the hash, how many features have each of its 8 bits set
+    lanes = [0] * 8
+    for feature in feature_set:
+        h = _feature_hash(feature)
+        for i in range(8):
+            lanes[i] += _SPREAD[(h >> (8 * i)) & 0xFF]
+    threshold = len(feature_set) / 2
+    fingerprint = 0
+    for i, lane in enumerate(lanes):
+        for j in range(8):
+            if (lane >> (16 * j)) & 0xFFFF > threshold:
+                fingerprint |= 1 << (8 * i + j)
+    return fingerprint
+
+
+def to_signed(fingerprint: int) -> int:
+    """The fingerprint as a Postgres bigint."""
+    return fingerprint - (1 << BITS) if fingerprint >= 1 << (BITS - 1) else fingerprint
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class Entry:
+    __slots__ = ("fingerprint", "post_id", "seen")
+
+    def __init__(self, fingerprint: int, post_id: str, seen: datetime):
+        self.fingerprint = fingerprint
+        self.post_id = post_id
+        self.seen = seen
+
+
+class NearDuplicateIndex:
+    def __init__(self, distance: int = 3, window: timedelta = timedelta(hours=1), max_entries: int = 500_000):
+        self.distance = distance
+        self.window = window
+        self.max_entries = max_entries
+        # (shift, mask) of every band, the bands as even as 64 bits allow
+        bands = distance + 1
+        edges = [round(i * BITS / bands) for i in range(bands + 1)]
+        self._bands: List[Tuple[int, int]] = [
+            (lo, (1 << (hi - lo)) - 1) for lo, hi in zip(edges, edges[1:])
+        ]
+        # per band: band value -> entries with that value, oldest first
+        self._tables: List[Dict[int, Deque[Entry]]] = [{} for _ in self._bands]
+        self._entries: Deque[Entry] = deque()
+        self.checked = 0
+        self.duplicates = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _band_values(self, fingerprint: int) -> List[int]:
+        return [(fingerprint >> shift) & mask for shift, mask in self._bands]
+
+    def _expire(self, now: datetime) -> None:
+        oldest = now - self.window
+        while self._entries and (
+            self._entries[0].seen < oldest or len(self._entries) > self.max_entries
+        ):
+            entry = self._entries.popleft()
+            for table, value in zip(self._tables, self._band_values(entry.fingerprint)):
+                bucket = table[value]
+                bucket.popleft()
+                if not bucket:
+                    del table[value]
+
+    def find(self, fingerprint: int) -> Optional[Entry]:
+        """The newest indexed post within `distance` bits of the fingerprint."""
+        best = None
+        for table, value in zip(self._tables, self._band_values(fingerprint)):
+            for entry in table.get(value, ()):
+                if hamming(entry.fingerprint, fingerprint) <= self.distance:
+                    if best is None or entry.seen > best.seen:
+                        best = entry
+        return best
+
+    def add(self, fingerprint: int, post_id: str, seen: datetime) -> None:
+        entry = Entry(fingerprint, post_id, seen)
+        self._entries.append(entry)
+        for table, value in zip(self._tables, self._band_values(fingerprint)):
+            table.setdefault(value, deque()).append(entry)
+
+    def check(self, fingerprint: int, post_id: str, now: datetime) -> Optional[str]:
+        """The id of the canonical post this one duplicates, or None if it's new and now indexed."""
+        self._expire(now)
+        self.checked += 1
+        match = self.find(fingerprint)
+        if match is not None:
+            self.duplicates += 1
+            return match.post_id
+        self.add(fingerprint, post_id, now)
+        return None
+
+    @property
+    def suppression_rate(self) -> float:
+        return self.duplicates / self.checked if self.checked else 0.0
@@ -0,0 +1,274 @@
+"""
+Streaming "top keywords" monitor.
+
+Every stored post is tokenized, stopwords are dropped and its words, bigrams and
+trigrams ("elon musk", "bank of america") are counted. Counting uses a Count-Min
+Sketch, so memory doesn't grow with the vocabulary, plus a bounded set of heavy
+hitter candidates per time bucket.
+
+Buckets come in three sizes, one per window we report on:
+
+    minute buckets, 60 of them  -> last hour
+    hour buckets, 24 of them    -> last day
+    day buckets, 7 of them      -> last week
+
+Posts are only counted into the current minute. When a minute closes its sketch and
+candidates are merged into the current hour, and a closing hour is merged into the
+current day. Old buckets fall off the end of each ring, that's the expiry.
+
+The top terms of every bucket are periodically written to `trending_terms`, which
+feed_service reads to answer /api/trending. On start they're read back for the
+buckets still in their windows, so a restart carries on counting from those rather
+than overwriting them with what it has seen since.
+"""
+
+import heapq
+import logging
+import re
+from array import array
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# fmt: off
+STOPWORDS = frozenset("""
+a about above after again against all am an and any are aren't as at be because been
+before being below between both but by can can't cannot could couldn't did didn't do
+does doesn't doing don't down during each few for from further get got had hadn't has
+hasn't have haven't having he he'd he'll he's her here here's hers herself him himself
+his how how's i i'd i'll i'm i've if in into is isn't it it's its itself just let's
+like me more most mustn't my myself no nor not now of off on once one only or other
+ought our ours ourselves out over own same shan't she she'd she'll she's should
+shouldn't so some such than that that's the their theirs them themselves then there
+there's these they they'd they'll they're they've this those through to too under
+until up us very was wasn't we we'd we'll we're we've were weren't what what's when
+when's where where's which while who who's whom why why's will with won't would
+wouldn't you you'd you'll you're you've your yours yourself yourselves
+also really still even much many well way want know think going make see new
+http https www com amp via rt
+""".split())
+# fmt: on
+
+_URL = re.compile(r"https?://\S+|www\.\S+")
+_TOKEN = re.compile(r"[#@]?\w[\w'’-]*\w|\w")
+
+
+def tokenize(record_text: str) -> List[str]:
+    return [t.replace("’", "'") for t in _TOKEN.findall(_URL.sub(" ", record_text.lower()))]
+
+
+def extract_terms(record_text: str, max_n: int = 3) -> set:
+    """
+    Words and phrases of up to `max_n` words worth counting. Phrases may contain
+    stopwords but can't start or end with one, and each term counts once per post.
+    """
+    tokens = tokenize(record_text)
+    terms = set()
+    for i, token in enumerate(tokens):
+        if token in STOPWORDS or len(token) < 2 or token.isdigit():
+            continue
+        terms.add(token)
+        for n in range(2, max_n + 1):
+            if i + n > len(tokens):
+                break
+            last = tokens[i + n - 1]
+            if last not in STOPWORDS and not last.isdigit():
+                terms.add(" ".join(tokens[i : i + n]))
+    return terms
+
+
+class CountMinSketch:
+    """Approximate counts in a fixed `depth` x `width` table, never undercounting."""
+
+    def __init__(self, width: int, depth: int):
+        self.width = width
+        self.depth = depth
+        self.table = [array("I", bytes(4 * width)) for _ in range(depth)]
+
+    def _indexes(self, term: str) -> List[int]:
+        # double hashing, Python's str hash is stable for the life of the process
+        h = hash(term) & 0xFFFFFFFFFFFFFFFF
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, term: str, count: int = 1) -> int:
+        """Conservative update: only raise the counters that are at the minimum."""
+        indexes = self._indexes(term)
+        estimate = min(row[idx] for row, idx in zip(self.table, indexes)) + count
+        for row, idx in zip(self.table, indexes):
+            if row[idx] < estimate:
+                row[idx] = estimate
+        return estimate
+
+    def estimate(self, term: str) -> int:
+        return min(row[idx] for row, idx in zip(self.table, self._indexes(term)))
+
+    def merge(self, other: "CountMinSketch") -> None:
+        for row, other_row in zip(self.table, other.table):
+            for idx, value in enumerate(other_row):
+                if value:
+                    row[idx] += value
+
+
+@dataclass
+class Bucket:
+    start: datetime
+    sketch: CountMinSketch
+    # heavy hitter candidates and their estimated counts, at most 2 * top_k
+    candidates: Dict[str, int] = field(default_factory=dict)
+    dirty: bool = True
+
+    def offer(self, term: str, estimate: int, top_k: int) -> None:
+        self.candidates[term] = estimate
+        if len(self.candidates) > 2 * top_k:
+            self.candidates = dict(heapq.nlargest(top_k, self.candidates.items(), key=lambda kv: kv[1]))
+
+    def top(self, n: int) -> List[Tuple[str, int]]:
+        return heapq.nlargest(n, self.candidates.items(), key=lambda kv: kv[1])
+
+
+class Level:
+    """A ring of equally sized buckets, the newest last."""
+
+    def __init__(self, granularity: str, size: timedelta, count: int, width: int, depth: int):
+        self.granularity = granularity
+        self.size = size
+        self.width = width
+        self.depth = depth
+        self.buckets: deque[Bucket] = deque(maxlen=count)
+
+    def bucket_start(self, when: datetime) -> datetime:
+        epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+        return epoch + ((when - epoch) // self.size) * self.size
+
+    def bucket(self, when: datetime) -> Bucket:
+        """The bucket covering `when`, created if it's newer than the ones we have."""
+        start = self.bucket_start(when)
+        if not self.buckets or self.buckets[-1].start < start:
+            self.buckets.append(Bucket(start, CountMinSketch(self.width, self.depth)))
+        return self.buckets[-1]
+
+    def advance(self, when: datetime) -> Optional[Bucket]:
+        """Move on to the bucket covering `when`, returning the bucket that closed, if any."""
+        last = self.buckets[-1] if self.buckets else None
+        return last if self.bucket(when) is not last else None
+
+
+class TrendingTerms:
+    def __init__(self, top_k: int = 200, width: int = 4096, depth: int = 4):
+        self.top_k = top_k
+        self.levels = [
+            Level("minute", timedelta(minutes=1), 60, width, depth),
+            Level("hour", timedelta(hours=1), 24, width, depth),
+            Level("day", timedelta(days=1), 7, width, depth),
+        ]
+        self.posts = 0
+
+    def _roll(self, when: datetime) -> Bucket:
+        """Advance every level to `when`, merging closed buckets into the level above."""
+        closed = self.levels[0].advance(when)
+        for level in self.levels[1:]:
+            if closed is None:
+                break
+            bucket = level.bucket(closed.start)
+            bucket.sketch.merge(closed.sketch)
+            for term in closed.candidates:
+                bucket.offer(term, bucket.sketch.estimate(term), self.top_k)
+            bucket.dirty = True
+            closed = level.advance(when)
+        return self.levels[0].buckets[-1]
+
+    def add(self, record_text: str, when: Optional[datetime] = None) -> None:
+        bucket = self._roll(when or datetime.now(timezone.utc))
+        for term in extract_terms(record_text):
+            bucket.offer(term, bucket.sketch.add(term), self.top_k)
+        bucket.dirty = True
+        self.posts += 1
+
+    def top(self, granularity: str, n: int) -> List[Tuple[str, int]]:
+        """Top terms over a whole ring, summing each bucket's estimates."""
+        level = next(level for level in self.levels if level.granularity == granularity)
+        candidates = set()
+        for bucket in level.buckets:
+            candidates.update(bucket.candidates)
+        counts = {
+            term: sum(bucket.sketch.estimate(term) for bucket in level.buckets)
+            for term in candidates
+        }
+        return heapq.nlargest(n, counts.items(), key=lambda kv: kv[1])
+
+    def snapshot(self) -> Iterable[Tuple[str, Bucket, List[Tuple[str, int]]]]:
+        """Top terms of every bucket that changed since the last snapshot."""
+        for level in self.levels:
+            for bucket in level.buckets:
+                if bucket.dirty:
+                    bucket.dirty = False
+                    yield level.granularity, bucket, bucket.top(self.top_k)
+
+    def restore(self, engine) -> int:
+        """
+        Rebuild the buckets still in their windows from trending_terms. Only their top
+        terms were stored, so those are all they start with. Call before adding posts.
+        """
+        query = text(
+            """
+            SELECT granularity, bucket_start, term, count
+            FROM trending_terms
+            ORDER BY bucket_start
+            """
+        )
+        with engine.connect() as conn:
+            rows = conn.execute(query).fetchall()
+        now = datetime.now(timezone.utc)
+        restored = 0
+        for level in self.levels:
+            current = level.bucket_start(now)
+            oldest = current - (level.buckets.maxlen - 1) * level.size
+            for row in rows:
+                if row.granularity != level.granularity or not oldest <= row.bucket_start <= current:
+                    continue
+                if not level.buckets or level.buckets[-1].start != row.bucket_start:
+                    sketch = CountMinSketch(level.width, level.depth)
+                    level.buckets.append(Bucket(row.bucket_start, sketch, dirty=False))
+                bucket = level.buckets[-1]
+                bucket.offer(row.term, bucket.sketch.add(row.term, row.count), self.top_k)
+                restored += 1
+        return restored
+
+    def persist(self, engine) -> int:
+        """Replace changed buckets in trending_terms and expire the ones we no longer report on."""
+        clear = text(
+            """
+            DELETE FROM trending_terms
+            WHERE granularity = :granularity AND bucket_start = :bucket_start
+            """
+        )
+        insert = text(
+            """
+            INSERT INTO trending_terms (granularity, bucket_start, term, count)
+            VALUES (:granularity, :bucket_start, :term, :count)
+            """
+        )
+        expire = text(
+            """
+            DELETE FROM trending_terms
+            WHERE (granularity = 'minute' AND bucket_start < now() - INTERVAL '1 hour')
+               OR (granularity = 'hour' AND bucket_start < now() - INTERVAL '1 day')
+               OR (granularity = 'day' AND bucket_start < now() - INTERVAL '7 days')
+            """
+        )
+        written = 0
+        with engine.begin() as conn:
+            for granularity, bucket, top in self.snapshot():
+                key = {"granularity": granularity, "bucket_start": bucket.start}
+                conn.execute(clear, key)
+                if top:
+                    conn.execute(insert, [{**key, "term": t, "count": c} for t, c in top])
+                written += len(top)
+            conn.execute(expire)
+        return written
@@ -0,0 +1,134 @@
+"""
+Memory of the ingestion buffer, per post.
+
+Builds the buffer of a flush from synthetic firehose posts (see loadtest.replay)
+twice, as the dict per post ingestion used to keep and as an
+ingestion.buffer.PostBatch, and reports what tracemalloc sees for each: the memory
+and number of blocks still held per buffered post, and the peak while buffering
+and building the insert's parameters. Strings shared with the decoded events
+(DIDs, text) are held by both and counted by neither.
+
+    uv run python -m loadtest.buffer --sizes 100 1000 10000
+"""
+
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from uuid import uuid4
+
+from ingestion.buffer import PostBatch
+from loadtest.replay import Firehose
+from shared.atproto import cid_to_bytes
+from shared.text_search import primary_language, text_search_config
+
+
+def fields(event: dict) -> dict:
+    """What ingestion.main.process_commit takes from an event (the events are all posts)."""
+    op = event["commit"]
+    record = op["record"]
+    langs = record.get("langs", [])
+    lang = primary_language(langs)
+    return {
+        "did": event["did"],
+        "commit_rev": op.get("rev"),
+        "commit_rkey": op.get("rkey"),
+        "commit_cid": cid_to_bytes(op.get("cid")),
+        "created_at": datetime.fromisoformat(record["createdAt"].replace("Z", "+00:00")),
+        "langs": langs,
+        "lang": lang,
+        "ts_config": text_search_config(lang),
+        "search_text": None,
+        "reply_parent_did": None,
+        "reply_parent_rkey": None,
+        "reply_parent_cid": None,
+        "reply_root_did": None,
+        "reply_root_rkey": None,
+        "reply_root_cid": None,
+        "record_text": record["text"],
+        "ingest_time": datetime.now(timezone.utc),
+        "cursor": int(event["time_us"]),
+    }
+
+
+def dict_buffer(events):
+    """The buffer as it was: a dict per post, with the columns store_posts added."""
+    buffer = []
+    for event in events:
+        post = {"id": uuid4(), **fields(event), "simhash": None, "canonical_id": None, "embedding": None}
+        buffer.append(post)
+    return buffer
+
+
+def dict_parameters(buffer):
+    for post in buffer:
+        post["actor_id"] = 1
+        post["reply_parent_actor_id"] = None
+        post["reply_root_actor_id"] = None
+    return buffer
+
+
+def batch_buffer(events):
+    batch = PostBatch()
+    for event in events:
+        batch.append(**fields(event))
+    return batch
+
+
+def batch_parameters(batch):
+    return batch.parameters({did: 1 for did in batch.did})
+
+
+def measure(events, build, parameters) -> dict:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    baseline, _ = tracemalloc.get_traced_memory()
+    started = time.perf_counter()
+    buffer = build(events)
+    elapsed = time.perf_counter() - started
+    held, _ = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    flushed = parameters(buffer)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+    count = len(events)
+    del buffer, flushed
+    return {
+        "bytes": (held - baseline) / count,
+        "blocks": blocks / count,
+        "peak": (peak - baseline) / count,
+        "us": elapsed / count * 1e6,
+    }
+
+
+def main(args: argparse.Namespace) -> None:
+    firehose = Firehose(args.seed, rate=50, authors=100_000, vocabulary=args.vocabulary)
+    # decoded like Jetstream messages are, so nothing is shared with the generator
+    events = [json.loads(json.dumps(firehose.event(n, 0))) for n in range(max(args.sizes))]
+
+    print(f"{'posts':>7}  {'buffer':<6}  {'bytes/post':>10}  {'blocks/post':>11}  {'peak/post':>9}  {'us/post':>7}")
+    for size in args.sizes:
+        results = {
+            "dicts": measure(events[:size], dict_buffer, dict_parameters),
+            "batch": measure(events[:size], batch_buffer, batch_parameters),
+        }
+        for name, result in results.items():
+            print(
+                f"{size:>7}  {name:<6}  {result['bytes']:>10.0f}  {result['blocks']:>11.1f}  "
+                f"{result['peak']:>9.0f}  {result['us']:>7.1f}"
+            )
+        saved = 1 - results["batch"]["bytes"] / results["dicts"]["bytes"]
+        print(f"{'':>7}  {saved:.0%} less memory per buffered post")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10_000], help="posts per flush")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--vocabulary", type=int, default=5000, help="words per language")
+    main(parser.parse_args())
@@ -0,0 +1,246 @@
+"""
+Storage and scan-speed comparison of the compact posts layout against the old one.
+
+Copies the posts (the same rows) from the `posts_expanded` view into `posts_legacy`,
+a hypertable in the layout posts had before the compact migration, with the same
+chunking, unique key and compression. Both are compressed, then their sizes are
+reported along with the median time of a few representative scans over each:
+
+- a keyword match over the last day, what a feed page without an index does
+- the newest page of a feed, matches joined back to authors
+- the posts of an author, by DID
+
+Run it against a database filled by `loadtest.generate`:
+
+    uv run python -m loadtest.compare_schema --runs 5
+
+`posts_legacy` is dropped afterwards unless --keep is given.
+"""
+
+import argparse
+import logging
+import statistics
+import time
+
+import psycopg2
+
+from shared.config import settings
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+CREATE_LEGACY = """
+CREATE TABLE posts_legacy (
+    id text NOT NULL,
+    did text,
+    kind text,
+    commit_rev text,
+    commit_operation text,
+    commit_collection text,
+    commit_rkey text,
+    commit_cid text,
+    created_at timestamp NOT NULL,
+    langs text[],
+    reply_parent_cid text,
+    reply_parent_uri text,
+    reply_root_cid text,
+    reply_root_uri text,
+    record_text text,
+    ingest_time timestamptz,
+    cursor text,
+    simhash bigint,
+    canonical_id text,
+    PRIMARY KEY (id, created_at),
+    CONSTRAINT posts_legacy_unique_commit UNIQUE (
+        created_at, commit_rev, commit_operation, commit_collection, commit_rkey, commit_cid
+    )
+);
+CREATE INDEX idx_posts_legacy_cursor ON posts_legacy (cursor);
+SELECT create_hypertable('posts_legacy', 'created_at', chunk_time_interval => INTERVAL '1 day');
+ALTER TABLE posts_legacy SET (timescaledb.compress = true, timescaledb.compress_orderby = 'created_at DESC');
+"""
+
+SIZES = """
+SELECT
+    hypertable_size(%(table)s),
+    (SELECT sum(before_compression_total_bytes) FROM hypertable_compression_stats(%(table)s)),
+    (SELECT sum(after_compression_total_bytes) FROM hypertable_compression_stats(%(table)s)),
+    (SELECT count(*) FROM timescaledb_information.chunks WHERE hypertable_name = %(table)s)
+"""
+
+UNIQUE_INDEX_SIZE = """
+SELECT coalesce(sum(pg_relation_size(i.indexrelid)), 0)
+FROM timescaledb_information.chunks c
+JOIN pg_index i ON i.indrelid = format('%%I.%%I', c.chunk_schema, c.chunk_name)::regclass
+JOIN pg_class ic ON ic.oid = i.indexrelid
+WHERE c.hypertable_name = %s AND ic.relname LIKE %s
+"""
+
+# Both layouts are tokenized the same way, it's the storage that's being compared
+# (posts_legacy has no text search configuration per post)
+MATCH_SQL = "to_tsvector('english', record_text) @@ to_tsquery('english', %(tsquery)s)"
+
+# (name, compact SQL, legacy SQL); %(tsquery)s and %(did)s are filled in for both
+SCANS = [
+    (
+        "keyword match, last day",
+        f"""
+        SELECT count(*) FROM posts
+        WHERE created_at > now() - interval '1 day' AND {MATCH_SQL}
+        """,
+        f"""
+        SELECT count(*) FROM posts_legacy
+        WHERE created_at > now() - interval '1 day' AND {MATCH_SQL}
+        """,
+    ),
+    (
+        "feed page",
+        f"""
+        SELECT p.id, author.did, p.record_text, p.created_at FROM (
+            SELECT * FROM posts
+            WHERE created_at > now() - interval '7 days'
+            AND {MATCH_SQL}
+            ORDER BY created_at DESC LIMIT 50
+        ) p
+        JOIN actors author ON author.id = p.actor_id
+        ORDER BY p.created_at DESC
+        """,
+        f"""
+        SELECT id, did, record_text, created_at FROM posts_legacy
+        WHERE created_at > now() - interval '7 days'
+        AND {MATCH_SQL}
+        ORDER BY created_at DESC LIMIT 50
+        """,
+    ),
+    (
+        "posts of an author",
+        """
+        SELECT count(*) FROM posts
+        WHERE actor_id = (SELECT id FROM actors WHERE did = %(did)s)
+        """,
+        "SELECT count(*) FROM posts_legacy WHERE did = %(did)s",
+    ),
+]
+
+
+def megabytes(size) -> str:
+    return f"{(size or 0) / 1024 / 1024:,.1f} MB"
+
+
+def build_legacy(conn):
+    began = time.time()
+    with conn.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS posts_legacy")
+        cursor.execute(CREATE_LEGACY)
+        cursor.execute("INSERT INTO posts_legacy SELECT * FROM posts_expanded")
+        copied = cursor.rowcount
+    conn.commit()
+    logger.info(f"Copied {copied} posts into posts_legacy in {time.time() - began:.0f} seconds")
+
+
+def compress(conn, table: str):
+    began = time.time()
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT count(compress_chunk(c, true)) FROM show_chunks(%s) c", (table,))
+        chunks = cursor.fetchone()[0]
+        cursor.execute(f"ANALYZE {table}")
+    conn.commit()
+    logger.info(f"Compressed {chunks} chunks of {table} in {time.time() - began:.0f} seconds")
+
+
+def sizes(conn, table: str, unique_index: str) -> dict:
+    with conn.cursor() as cursor:
+        cursor.execute(SIZES, {"table": table})
+        total, before, after, chunks = cursor.fetchone()
+        cursor.execute(UNIQUE_INDEX_SIZE, (table, f"%{unique_index}%"))
+        unique = cursor.fetchone()[0]
+    return {
+        "total": total,
+        "before compression": before,
+        "after compression": after,
+        "unique key index": unique,
+        "chunks": chunks,
+    }
+
+
+def sample_params(conn) -> dict:
+    """A common word and the most prolific author, so every scan finds something."""
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT word FROM ts_stat($$
+                SELECT to_tsvector('english', record_text) FROM posts
+                WHERE created_at > now() - interval '1 hour'
+            $$)
+            ORDER BY ndoc DESC OFFSET 20 LIMIT 1
+            """
+        )
+        row = cursor.fetchone()
+        tsquery = row[0] if row else "hello"
+        cursor.execute(
+            """
+            SELECT a.did FROM posts p JOIN actors a ON a.id = p.actor_id
+            WHERE p.created_at > now() - interval '1 hour'
+            GROUP BY a.did ORDER BY count(*) DESC LIMIT 1
+            """
+        )
+        row = cursor.fetchone()
+        did = row[0] if row else ""
+    return {"tsquery": tsquery, "did": did}
+
+
+def time_scan(conn, sql: str, params: dict, runs: int) -> float:
+    """Median milliseconds of a scan, after one run to warm the cache."""
+    timings = []
+    with conn.cursor() as cursor:
+        for run in range(runs + 1):
+            began = time.perf_counter()
+            cursor.execute(sql, params)
+            cursor.fetchall()
+            if run:
+                timings.append((time.perf_counter() - began) * 1000)
+    conn.rollback()
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="timed runs of every scan")
+    parser.add_argument("--skip-copy", action="store_true", help="reuse posts_legacy from an earlier run")
+    parser.add_argument("--keep", action="store_true", help="don't drop posts_legacy at the end")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(settings.database_url)
+    if not args.skip_copy:
+        build_legacy(conn)
+        compress(conn, "posts")
+        compress(conn, "posts_legacy")
+
+    compact = sizes(conn, "posts", "posts_unique_commit")
+    legacy = sizes(conn, "posts_legacy", "posts_legacy_unique_commit")
+    print(f"{'':<22}{'legacy':>14}{'compact':>14}{'ratio':>8}")
+    for name in compact:
+        if name == "chunks":
+            print(f"{name:<22}{legacy[name]:>14}{compact[name]:>14}")
+            continue
+        ratio = f"{compact[name] / legacy[name]:.2f}" if legacy[name] else "-"
+        print(f"{name:<22}{megabytes(legacy[name]):>14}{megabytes(compact[name]):>14}{ratio:>8}")
+
+    params = sample_params(conn)
+    print(f"\nmedian of {args.runs} runs, {params}")
+    for name, compact_sql, legacy_sql in SCANS:
+        legacy_ms = time_scan(conn, legacy_sql, params, args.runs)
+        compact_ms = time_scan(conn, compact_sql, params, args.runs)
+        print(f"{name:<22}{legacy_ms:>11.1f} ms{compact_ms:>11.1f} ms{compact_ms / legacy_ms:>8.2f}")
+
+    if not args.keep:
+        with conn.cursor() as cursor:
+            cursor.execute("DROP TABLE posts_legacy")
+        conn.commit()
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+Load driver for the feed service.
+
+Logs in the users from a `loadtest.generate` manifest and replays a mixed workload
+against a running feed service: reading feeds and paging back through them, batch
+reads, listing feeds, the feed generator skeleton, hybrid ranking and trending terms.
+Every request is timed and p50/p95/p99 latencies are reported per endpoint.
+
+Pass `--max-p95` (and/or `--max-p99`, `--max-error-rate`) to use it as a regression
+gate: the exit status is 1 if any endpoint is over budget.
+
+`--hot-share` sends that share of feed reads to a single feed, like a traffic spike
+on a popular feed. The feed service's own count of feed page requests and the
+queries they ran (see feed_service.coalesce) is reported at the end; the counts are
+per worker, so run the service with a single worker to see them all.
+
+    uv run python -m loadtest.driver --manifest loadtest.json --duration 60 --concurrency 32
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+import httpx
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+# httpx logs every request at INFO
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+# endpoint -> share of requests
+WORKLOAD = {
+    "get_feed": 0.45,
+    "get_feed_page": 0.15,
+    "get_feeds_batch": 0.1,
+    "list_feeds": 0.05,
+    "get_feed_skeleton": 0.15,
+    "get_feed_hybrid": 0.03,
+    "get_trending": 0.07,
+}
+
+
+def percentile(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+class LoadDriver:
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        users: List[dict],
+        workload: Dict[str, float],
+        rng: random.Random,
+        hot_share: float = 0,
+    ):
+        self.client = client
+        self.users = users
+        self.workload = workload
+        self.rng = rng
+        self.hot_share = hot_share
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    async def login(self, password: str) -> None:
+        for user in self.users:
+            response = await self.client.post(
+                "/token", data={"username": user["email"], "password": password}
+            )
+            response.raise_for_status()
+            user["headers"] = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    async def _request(self, endpoint: str, url: str, **kwargs) -> httpx.Response | None:
+        started = time.perf_counter()
+        try:
+            response = await self.client.get(url, **kwargs)
+        except httpx.HTTPError as e:
+            logger.debug(f"{endpoint} failed: {e}")
+            self.errors[endpoint] += 1
+            return None
+        self.latencies[endpoint].append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            self.errors[endpoint] += 1
+            return None
+        return response
+
+    async def server_stats(self) -> dict | None:
+        """The feed service's feed page coalescing counters, from the worker that answers."""
+        try:
+            response = await self.client.get("/api/cache/stats", headers=self.users[0]["headers"])
+            response.raise_for_status()
+            return response.json().get("feed_pages")
+        except httpx.HTTPError as e:
+            logger.warning(f"Couldn't get the feed service's stats: {e}")
+            return None
+
+    async def step(self) -> None:
+        endpoint = self.rng.choices(list(self.workload), weights=list(self.workload.values()))[0]
+        if endpoint == "get_feed" and self.rng.random() < self.hot_share:
+            user = self.users[0]
+            feed_id = user["feeds"][0]["feed_id"]
+        else:
+            user = self.rng.choice(self.users)
+            feed_id = self.rng.choice(user["feeds"])["feed_id"]
+        headers = user["headers"]
+
+        if endpoint == "get_feed":
+            await self._request(endpoint, f"/api/feeds/{feed_id}", headers=headers)
+        elif endpoint == "get_feed_page":
+            # the first page, then a few pages further back, like someone scrolling
+            response = await self._request("get_feed", f"/api/feeds/{feed_id}", headers=headers)
+            for _ in range(self.rng.randint(1, 5)):
+                if response is None or not response.json()["feed"]:
+                    break
+                before = response.json()["feed"][-1]["created_at"]
+                response = await self._request(
+                    endpoint, f"/api/feeds/{feed_id}", params={"before": before}, headers=headers
+                )
+        elif endpoint == "get_feeds_batch":
+            feed_ids = [feed["feed_id"] for feed in user["feeds"]][:20]
+            await self._request(endpoint, "/api/feeds/batch", params={"feed_id": feed_ids}, headers=headers)
+        elif endpoint == "list_feeds":
+            await self._request(endpoint, "/api/feeds", headers=headers)
+        elif endpoint == "get_feed_skeleton":
+            params = {"feed": f"at://did:plc:loadtest/app.bsky.feed.generator/{feed_id}", "limit": 30}
+            response = await self._request(endpoint, "/xrpc/app.bsky.feed.getFeedSkeleton", params=params)
+            if response is not None and response.json().get("cursor") and self.rng.random() < 0.3:
+                params["cursor"] = response.json()["cursor"]
+                await self._request(endpoint, "/xrpc/app.bsky.feed.getFeedSkeleton", params=params)
+        elif endpoint == "get_feed_hybrid":
+            await self._request(endpoint, f"/api/feeds/{feed_id}", params={"rank": "hybrid"}, headers=headers)
+        elif endpoint == "get_trending":
+            window = self.rng.choice(["hour", "day", "week"])
+            await self._request(endpoint, "/api/trending", params={"window": window})
+
+    async def worker(self, deadline: float) -> None:
+        while time.monotonic() < deadline:
+            await self.step()
+
+    async def run(self, duration: float, concurrency: int) -> None:
+        deadline = time.monotonic() + duration
+        await asyncio.gather(*(self.worker(deadline) for _ in range(concurrency)))
+
+    def report(self, duration: float) -> Dict[str, dict]:
+        report = {}
+        for endpoint in sorted(set(self.latencies) | set(self.errors)):
+            latencies = self.latencies[endpoint]
+            count = len(latencies)
+            report[endpoint] = {
+                "requests": count,
+                "errors": self.errors[endpoint],
+                "error_rate": self.errors[endpoint] / max(count, 1),
+                "rps": count / duration,
+                "p50_ms": percentile(latencies, 50) * 1000 if latencies else None,
+                "p95_ms": percentile(latencies, 95) * 1000 if latencies else None,
+                "p99_ms": percentile(latencies, 99) * 1000 if latencies else None,
+            }
+        return report
+
+
+def print_report(report: Dict[str, dict]) -> None:
+    print(f"{'endpoint':<20} {'requests':>9} {'errors':>7} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for endpoint, r in report.items():
+        timings = " ".join(f"{r[p]:8.1f}" if r[p] is not None else f"{'-':>8}" for p in ("p50_ms", "p95_ms", "p99_ms"))
+        print(f"{endpoint:<20} {r['requests']:>9} {r['errors']:>7} {r['rps']:>8.1f} {timings}")
+
+
+def check_budgets(report: Dict[str, dict], args: argparse.Namespace) -> List[str]:
+    """Endpoints over the latency or error budget, as messages."""
+    failures = []
+    for endpoint, r in report.items():
+        for budget, key in ((args.max_p95, "p95_ms"), (args.max_p99, "p99_ms")):
+            if budget is not None and r[key] is not None and r[key] > budget:
+                failures.append(f"{endpoint} {key} {r[key]:.1f} > {budget}")
+        if args.max_error_rate is not None and r["error_rate"] > args.max_error_rate:
+            failures.append(f"{endpoint} error rate {r['error_rate']:.3f} > {args.max_error_rate}")
+    return failures
+
+
+async def main(args: argparse.Namespace) -> int:
+    with open(args.manifest) as f:
+        manifest = json.load(f)
+    users = [user for user in manifest["users"] if user["feeds"]][: args.users]
+    workload = dict(WORKLOAD)
+    for endpoint in args.skip:
+        workload.pop(endpoint)
+
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        driver = LoadDriver(client, users, workload, random.Random(args.seed), args.hot_share)
+        await driver.login(manifest["password"])
+        logger.info(f"Running {args.concurrency} workers as {len(users)} users for {args.duration} seconds")
+        if args.warmup:
+            await driver.run(args.warmup, args.concurrency)
+            driver.latencies.clear()
+            driver.errors.clear()
+        before = await driver.server_stats()
+        await driver.run(args.duration, args.concurrency)
+        after = await driver.server_stats()
+
+    report = driver.report(args.duration)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    print_report(report)
+    if before and after:
+        calls = after["calls"] - before["calls"]
+        loads = after["loads"] - before["loads"]
+        print(
+            f"\nfeed pages: {calls} requests ran {loads} queries, "
+            f"{after['coalesced'] - before['coalesced']} coalesced"
+            + (f", {1 - loads / calls:.1%} saved" if calls else "")
+        )
+
+    failures = check_budgets(report, args)
+    for failure in failures:
+        logger.error(f"Over budget: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--manifest", default="loadtest.json")
+    parser.add_argument("--duration", type=float, default=60, help="seconds to measure for")
+    parser.add_argument("--warmup", type=float, default=10, help="seconds to run before measuring")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--users", type=int, default=None, help="only use this many users")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--skip", nargs="*", default=[], choices=list(WORKLOAD), help="endpoints to leave out")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--hot-share", type=float, default=0, help="share of feed reads that go to one feed")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--max-p95", type=float, help="fail if any endpoint's p95 is over this many ms")
+    parser.add_argument("--max-p99", type=float, help="fail if any endpoint's p99 is over this many ms")
+    parser.add_argument("--max-error-rate", type=float, help="fail if any endpoint's error rate is over this")
+    sys.exit(asyncio.run(main(parser.parse_args())))
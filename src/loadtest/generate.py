@@ -0,0 +1,349 @@
+"""
+Synthetic dataset generator.
+
+Fills a local TimescaleDB with posts that look enough like the firehose to make
+query plans and timings meaningful, plus users and feeds to run the load driver
+against:
+
+- a Zipfian vocabulary per language, so a few words are everywhere and most are rare
+- a language mix dominated by English and Japanese (written without spaces)
+- a daily rhythm, with bursts where one topic takes over for a while
+- reply chains, a Zipfian distribution of authors, and realistic rkeys, CIDs and cursors
+- feeds mixing popular words, phrases, boolean keywords and rare words
+
+Posts are written with COPY by several worker processes, each generating its own
+slice of the time range. The users and feeds created are written to a manifest that
+`loadtest.driver` reads.
+
+    uv run python -m loadtest.generate --posts 50000000 --days 7 --workers 8
+"""
+
+import argparse
+import csv
+import io
+import itertools
+import json
+import logging
+import math
+import multiprocessing
+import random
+import string
+import time
+from bisect import bisect
+from datetime import datetime, timedelta, timezone
+from uuid import UUID
+
+import bcrypt
+import psycopg2
+
+from feed_service.query import compile_keywords
+from shared.config import settings
+from shared.text_search import has_cjk, segment_cjk, text_search_config
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# share of posts per language, "" is a post without langs
+LANGUAGES = {"en": 0.48, "ja": 0.2, "pt": 0.14, "es": 0.07, "de": 0.05, "": 0.06}
+
+SYLLABLES = {
+    "en": "ba be bi bo ca ce co da de di do el en er fa fe fi ga ge go ha he hi ho "
+    "in is it la le li lo ma me mi mo na ne no or pa pe pi po ra re ri ro sa se si "
+    "so st ta te ti th to un ve wa we wi",
+    "ja": "あ い う え お か き く け こ さ し す せ そ た ち つ て と な に の は ひ "
+    "ま み む め も や よ ら り る れ ろ わ を ん カ キ ク サ シ ス タ ト ナ ニ マ ラ",
+    "pt": "ba be bi ca ção co da de di do fa ga ia la le li lo ma me mo na nh no pa "
+    "pe po qu ra re ri ro sa se são ta te ti to va ve vi",
+    "es": "ba be ca ce ci co da de do el es fa ga la le li lo ll ma me mi mo na ne "
+    "ni ño pa pe po que ra re ri ro sa se si ta te ti to va ve",
+    "de": "ab an be ch da de di ei en er ge ha he ich ie in ke la le li ma me mi na "
+    "ne sch se st ta te un ver zu",
+}
+
+# words and phrases that bursts are about and feeds are built from
+TOPICS = [
+    "python", "rust", "election", "bitcoin", "football", "climate", "deepseek",
+    "venezuela", "elon musk", "taylor swift", "super bowl", "trump administration",
+    "earthquake", "playstation", "open source", "fastapi", "bluesky", "olympics",
+]
+
+STOP = {"en": ["the", "a", "to", "and", "of", "is", "in", "it", "for", "on", "this", "i"]}
+
+POST_COLUMNS = [
+    "id", "actor_id", "commit_rev", "commit_rkey", "commit_cid", "created_at", "langs",
+    "lang", "ts_config", "search_text", "reply_parent_actor_id", "reply_parent_rkey", "reply_parent_cid",
+    "reply_root_actor_id", "reply_root_rkey", "reply_root_cid",
+    "record_text", "ingest_time", "cursor",
+]
+
+B32 = "abcdefghijklmnopqrstuvwxyz234567"
+SORTABLE_B32 = "234567abcdefghijklmnopqrstuvwxyz"
+
+
+def zipf_cum_weights(n: int, s: float = 1.1) -> list:
+    return list(itertools.accumulate(1 / (rank**s) for rank in range(1, n + 1)))
+
+
+class Vocabulary:
+    """Pseudo-words for one language, drawn with Zipfian frequencies."""
+
+    def __init__(self, lang: str, size: int, rng: random.Random):
+        syllables = SYLLABLES[lang].split()
+        words = set(STOP.get(lang, []))
+        while len(words) < size:
+            words.add("".join(rng.choices(syllables, k=rng.choice((1, 2, 2, 3, 3, 4)))))
+        # stopwords first so they're the most frequent
+        stop = STOP.get(lang, [])
+        self.words = stop + sorted(words - set(stop), key=lambda w: rng.random())
+        self.cum_weights = zipf_cum_weights(len(self.words))
+        self.separator = "" if lang == "ja" else " "
+
+    def sample(self, rng: random.Random, k: int) -> list:
+        total = self.cum_weights[-1]
+        return [self.words[bisect(self.cum_weights, rng.random() * total)] for _ in range(k)]
+
+
+def tid(created_at: datetime, rng: random.Random) -> str:
+    """A record key shaped like an AT Protocol TID: sortable base32 of the timestamp."""
+    micros = int(created_at.timestamp() * 1_000_000)
+    value = (micros << 10) | rng.getrandbits(10)
+    return "".join(SORTABLE_B32[(value >> (5 * i)) & 31] for i in reversed(range(13)))
+
+
+def cid(rng: random.Random) -> str:
+    """A CIDv1 (dag-cbor, sha2-256) in COPY's bytea hex format."""
+    return "\\x01711220" + rng.randbytes(32).hex()
+
+
+def minute_weights(start: datetime, minutes: int, rng: random.Random, bursts_per_day: float):
+    """Relative post volume per minute, and the topic of any burst going on."""
+    weights = []
+    topics = [None] * minutes
+    for m in range(minutes):
+        when = start + timedelta(minutes=m)
+        hour = when.hour + when.minute / 60
+        weights.append(1 + 0.6 * math.sin(2 * math.pi * (hour - 9) / 24))
+    for _ in range(max(1, int(bursts_per_day * minutes / 1440))):
+        begin = rng.randrange(minutes)
+        length = rng.randint(20, 180)
+        boost = rng.uniform(1.5, 5)
+        topic = rng.choice(TOPICS)
+        for m in range(begin, min(minutes, begin + length)):
+            weights[m] *= boost
+            topics[m] = topic
+    return weights, topics
+
+
+def generate_slice(
+    args: argparse.Namespace,
+    worker: int,
+    first_minute: int,
+    last_minute: int,
+    counts: list,
+    topics: list,
+    actor_ids: list,
+):
+    """Generate and COPY the posts of minutes [first_minute, last_minute)."""
+    rng = random.Random(args.seed * 1000 + worker)
+    vocab_rng = random.Random(args.seed)
+    vocabularies = {lang: Vocabulary(lang, args.vocabulary, vocab_rng) for lang in SYLLABLES}
+    langs = [lang for lang in LANGUAGES]
+    lang_weights = list(itertools.accumulate(LANGUAGES.values()))
+    author_weights = zipf_cum_weights(args.authors, 0.9)
+    start = args.start
+
+    # recent posts that can be replied to: ((actor id, rkey, cid), root)
+    recent = []
+    conn = psycopg2.connect(settings.database_url)
+    written = 0
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    began = time.time()
+
+    def flush():
+        nonlocal buffer, writer
+        buffer.seek(0)
+        with conn.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY posts ({', '.join(POST_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer
+            )
+        conn.commit()
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+    for minute in range(first_minute, last_minute):
+        minute_start = start + timedelta(minutes=minute)
+        for _ in range(counts[minute]):
+            created_at = minute_start + timedelta(seconds=rng.random() * 60)
+            lang = langs[bisect(lang_weights, rng.random() * lang_weights[-1])]
+            vocabulary = vocabularies[lang or "en"]
+            words = vocabulary.sample(rng, max(1, int(rng.lognormvariate(2.4, 0.6))))
+            if topics[minute] and rng.random() < 0.3:
+                words.insert(rng.randrange(len(words) + 1), topics[minute])
+            elif rng.random() < 0.02:
+                words.insert(rng.randrange(len(words) + 1), rng.choice(TOPICS))
+            record_text = vocabulary.separator.join(words)
+
+            actor_id = actor_ids[bisect(author_weights, rng.random() * author_weights[-1])]
+            rkey = tid(created_at, rng)
+            post_cid = cid(rng)
+            parent = root = (None, None, None)
+            if recent and rng.random() < args.reply_ratio:
+                # replies mostly go to recent posts, which makes threads
+                parent, parent_root = recent[-1 - int(rng.expovariate(0.05)) % len(recent)]
+                root = parent_root or parent
+            recent.append(((actor_id, rkey, post_cid), root if parent[0] else None))
+            if len(recent) > 1000:
+                del recent[:500]
+
+            ingest_time = created_at + timedelta(seconds=rng.expovariate(1 / 2))
+            writer.writerow(
+                [
+                    UUID(int=rng.getrandbits(128), version=4),
+                    actor_id,
+                    "".join(rng.choices(SORTABLE_B32, k=13)),
+                    rkey,
+                    post_cid,
+                    created_at.replace(tzinfo=None).isoformat(),
+                    "{" + lang + "}" if lang else "{}",
+                    lang,
+                    text_search_config(lang),
+                    segment_cjk(record_text) if has_cjk(record_text) else None,
+                    *parent,
+                    *root,
+                    record_text,
+                    ingest_time.isoformat(),
+                    int(ingest_time.timestamp() * 1_000_000),
+                ]
+            )
+            written += 1
+            if written % args.batch == 0:
+                flush()
+    flush()
+    conn.close()
+    logger.info(f"Worker {worker} wrote {written} posts in {time.time() - began:.0f} seconds")
+    return written
+
+
+def create_actors(args: argparse.Namespace) -> list:
+    """Actor ids of the generated authors, most prolific first."""
+    dids = ["did:plc:" + "".join(random.Random(i).choices(B32, k=24)) for i in range(args.authors)]
+    conn = psycopg2.connect(settings.database_url)
+    with conn, conn.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO actors (did) SELECT unnest(%s) ON CONFLICT (did) DO NOTHING", (dids,)
+        )
+        cursor.execute("SELECT did, id FROM actors WHERE did = ANY(%s)", (dids,))
+        ids = dict(cursor.fetchall())
+    conn.close()
+    return [ids[did] for did in dids]
+
+
+def feed_keywords(rng: random.Random, vocabulary: Vocabulary) -> list:
+    """A keyword mix: popular words, phrases, boolean expressions and rare words."""
+    kind = rng.random()
+    topic = rng.choice(TOPICS)
+    if kind < 0.4:
+        return [topic]
+    if kind < 0.6:
+        # a topic and a common word, both have to match
+        return [topic, vocabulary.words[rng.randrange(len(STOP["en"]), 500)]]
+    if kind < 0.8:
+        return [f'"{topic}" | "{rng.choice(TOPICS)}"']
+    # a word from the long tail
+    return [vocabulary.words[rng.randrange(len(vocabulary.words) // 2, len(vocabulary.words))]]
+
+
+def create_users_and_feeds(args: argparse.Namespace) -> dict:
+    rng = random.Random(args.seed)
+    english = Vocabulary("en", args.vocabulary, random.Random(args.seed))
+    password = "loadtest-password"
+    password_hash = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+    manifest = {"password": password, "users": []}
+
+    conn = psycopg2.connect(settings.database_url)
+    with conn, conn.cursor() as cursor:
+        for u in range(args.users):
+            email = f"loadtest-{args.seed}-{u}@example.com"
+            cursor.execute(
+                """
+                INSERT INTO users (email, password_hash, created_at) VALUES (%s, %s, now())
+                ON CONFLICT (email) DO UPDATE SET password_hash = EXCLUDED.password_hash
+                RETURNING id
+                """,
+                (email, password_hash),
+            )
+            user_id = cursor.fetchone()[0]
+            feeds = []
+            for _ in range(args.feeds_per_user):
+                keywords = feed_keywords(rng, english)
+                cursor.execute(
+                    """
+                    INSERT INTO feeds (user_id, tsquery, created_at, updated_at)
+                    VALUES (%s, %s, now(), now()) RETURNING id
+                    """,
+                    (user_id, compile_keywords(keywords)),
+                )
+                feed_id = cursor.fetchone()[0]
+                for keyword in keywords:
+                    cursor.execute(
+                        """
+                        INSERT INTO user_keywords (user_id, keyword, feed_id, created_at)
+                        VALUES (%s, %s, %s, now())
+                        """,
+                        (user_id, keyword, feed_id),
+                    )
+                feeds.append({"feed_id": feed_id, "keywords": keywords})
+            manifest["users"].append({"email": email, "feeds": feeds})
+    conn.close()
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--posts", type=int, default=1_000_000, help="number of posts to generate")
+    parser.add_argument("--days", type=float, default=7, help="posts are spread over this many days up to now")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--feeds-per-user", type=int, default=10)
+    parser.add_argument("--authors", type=int, default=100_000)
+    parser.add_argument("--vocabulary", type=int, default=50_000, help="words per language")
+    parser.add_argument("--reply-ratio", type=float, default=0.3)
+    parser.add_argument("--bursts-per-day", type=float, default=4)
+    parser.add_argument("--batch", type=int, default=50_000, help="rows per COPY")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--manifest", default="loadtest.json", help="where to write users and feeds")
+    parser.add_argument("--skip-posts", action="store_true", help="only create users and feeds")
+    args = parser.parse_args()
+
+    if not args.skip_posts:
+        rng = random.Random(args.seed)
+        minutes = int(args.days * 1440)
+        args.start = (datetime.now(timezone.utc) - timedelta(minutes=minutes)).replace(second=0, microsecond=0)
+        weights, topics = minute_weights(args.start, minutes, rng, args.bursts_per_day)
+        total = sum(weights)
+        counts = [int(w / total * args.posts + rng.random()) for w in weights]
+
+        actor_ids = create_actors(args)
+        bounds = [round(minutes * w / args.workers) for w in range(args.workers + 1)]
+        logger.info(f"Generating {sum(counts)} posts from {args.start} with {args.workers} workers")
+        with multiprocessing.Pool(args.workers) as pool:
+            written = pool.starmap(
+                generate_slice,
+                [
+                    (args, w, bounds[w], bounds[w + 1], counts, topics, actor_ids)
+                    for w in range(args.workers)
+                ],
+            )
+        logger.info(f"Wrote {sum(written)} posts")
+
+    manifest = create_users_and_feeds(args)
+    with open(args.manifest, "w") as f:
+        json.dump(manifest, f, indent=2)
+    logger.info(f"Created {args.users} users with {args.feeds_per_user} feeds each, see {args.manifest}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Local Jetstream replay server.
+
+Serves a synthetic stream of `app.bsky.feed.post` commits over the Jetstream
+websocket protocol, so ingestion can be run and broken without the real firehose.
+Events are a pure function of the seed and their position in time: the event at
+`n * interval` is always the same post, so several servers started with the same
+seed relay the same firehose, like the public Jetstream instances do. Connecting
+with a cursor replays from there as fast as the client reads, then continues live.
+
+Each server can be made worse than the others, to exercise endpoint selection and
+failover in `ingestion.jetstream`:
+
+- `--latency-ms` delays every handshake
+- `--lag-seconds` serves events this far behind real time
+- `--clock-offset-ms` shifts the `time_us` it stamps events with, as different
+  Jetstream instances do
+- `--stall-after` stops sending (but keeps the connection open) after this many
+  seconds, `--close-after` drops the connection instead
+
+For example, three endpoints of which the best one stalls after a minute:
+
+    uv run python -m loadtest.replay --port 6008 --stall-after 60 &
+    uv run python -m loadtest.replay --port 6009 --latency-ms 30 --clock-offset-ms 200 &
+    uv run python -m loadtest.replay --port 6010 --lag-seconds 2 &
+    JETSTREAM_URIS='["ws://localhost:6008/subscribe", "ws://localhost:6009/subscribe", "ws://localhost:6010/subscribe"]' \\
+        uv run python -m ingestion.main
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import random
+import time
+from bisect import bisect
+from datetime import datetime, timezone
+from urllib.parse import parse_qs, urlparse
+
+from websockets.asyncio.server import serve
+
+from loadtest.generate import B32, LANGUAGES, SYLLABLES, TOPICS, Vocabulary, tid, zipf_cum_weights
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+POST_COLLECTION = "app.bsky.feed.post"
+
+
+class Firehose:
+    """The synthetic firehose: event `n` happens at `n * interval_us`."""
+
+    def __init__(self, seed: int, rate: float, authors: int, vocabulary: int):
+        self.seed = seed
+        self.interval_us = 1_000_000 / rate
+        vocab_rng = random.Random(seed)
+        self.vocabularies = {lang: Vocabulary(lang, vocabulary, vocab_rng) for lang in SYLLABLES}
+        self.langs = list(LANGUAGES)
+        self.lang_weights = list(itertools.accumulate(LANGUAGES.values()))
+        self.author_weights = zipf_cum_weights(authors, 0.9)
+
+    def did(self, author: int) -> str:
+        return "did:plc:" + "".join(random.Random(author).choices(B32, k=24))
+
+    def index(self, time_us: int) -> int:
+        """The first event at or after `time_us`."""
+        return -int(-time_us // self.interval_us)
+
+    def time_us(self, n: int) -> int:
+        return int(n * self.interval_us)
+
+    def event(self, n: int, clock_offset_us: int) -> dict:
+        rng = random.Random(f"{self.seed}:{n}")
+        time_us = self.time_us(n)
+        created_at = datetime.fromtimestamp(time_us / 1_000_000 - rng.expovariate(1), timezone.utc)
+        lang = self.langs[bisect(self.lang_weights, rng.random() * self.lang_weights[-1])]
+        vocabulary = self.vocabularies[lang or "en"]
+        words = vocabulary.sample(rng, max(1, int(rng.lognormvariate(2.4, 0.6))))
+        if rng.random() < 0.05:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(TOPICS))
+        author = bisect(self.author_weights, rng.random() * self.author_weights[-1])
+        record = {
+            "$type": POST_COLLECTION,
+            "createdAt": created_at.isoformat().replace("+00:00", "Z"),
+            "langs": [lang] if lang else [],
+            "text": vocabulary.separator.join(words),
+        }
+        return {
+            "did": self.did(author),
+            "time_us": time_us + clock_offset_us,
+            "kind": "commit",
+            "commit": {
+                "rev": tid(created_at, rng),
+                "operation": "create",
+                "collection": POST_COLLECTION,
+                "rkey": tid(created_at, rng),
+                "record": record,
+                "cid": "bafyrei" + "".join(rng.choices(B32, k=52)),
+            },
+        }
+
+
+async def subscribe(connection, firehose: Firehose, args: argparse.Namespace):
+    query = parse_qs(urlparse(connection.request.path).query)
+    collections = query.get("wantedCollections", [])
+    if collections and POST_COLLECTION not in collections:
+        # nothing we have is wanted, keep the connection open like Jetstream does
+        await connection.wait_closed()
+        return
+
+    clock_offset_us = int(args.clock_offset_ms * 1000)
+    lag_us = int(args.lag_seconds * 1_000_000)
+    now_us = int(time.time() * 1_000_000)
+    cursor = int(query["cursor"][0]) if query.get("cursor") else None
+    n = firehose.index(cursor - clock_offset_us if cursor else now_us - lag_us)
+    opened = time.monotonic()
+    logger.info(f"{connection.remote_address} subscribed" + (f" at cursor {cursor}" if cursor else ""))
+
+    sent = 0
+    while True:
+        connected_for = time.monotonic() - opened
+        if args.close_after and connected_for > args.close_after:
+            logger.info(f"Closing {connection.remote_address} after {sent} events")
+            await connection.close()
+            return
+        if args.stall_after and connected_for > args.stall_after:
+            logger.info(f"Stalling {connection.remote_address} after {sent} events")
+            await connection.wait_closed()
+            return
+        due = firehose.time_us(n) + lag_us
+        wait = due / 1_000_000 - time.time()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        await connection.send(json.dumps(firehose.event(n, clock_offset_us)))
+        n += 1
+        sent += 1
+
+
+async def main(args: argparse.Namespace):
+    firehose = Firehose(args.seed, args.rate, args.authors, args.vocabulary)
+
+    async def process_request(connection, request):
+        if args.latency_ms:
+            await asyncio.sleep(args.latency_ms / 1000)
+
+    async def handler(connection):
+        try:
+            await subscribe(connection, firehose, args)
+        except Exception as e:
+            logger.info(f"{connection.remote_address} went away: {e}")
+
+    async with serve(handler, args.host, args.port, process_request=process_request, max_size=None):
+        logger.info(f"Replaying {args.rate} posts per second on ws://{args.host}:{args.port}/subscribe")
+        await asyncio.Future()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=6008)
+    parser.add_argument("--rate", type=float, default=50, help="posts per second")
+    parser.add_argument("--seed", type=int, default=1, help="servers with the same seed serve the same posts")
+    parser.add_argument("--authors", type=int, default=100_000)
+    parser.add_argument("--vocabulary", type=int, default=20_000, help="words per language")
+    parser.add_argument("--latency-ms", type=float, default=0, help="delay every handshake by this much")
+    parser.add_argument("--lag-seconds", type=float, default=0, help="serve events this far behind real time")
+    parser.add_argument("--clock-offset-ms", type=float, default=0, help="shift event time_us by this much")
+    parser.add_argument("--stall-after", type=float, default=None, help="stop sending after this many seconds")
+    parser.add_argument("--close-after", type=float, default=None, help="close connections after this many seconds")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,24 @@
+"""add compiled tsquery to feeds
+
+Revision ID: 3b7e91c2d4a6
+Revises: 9604122f044f
+Create Date: 2026-10-18 09:12:41.204117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b7e91c2d4a6'
+down_revision = '9604122f044f'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    # The keywords of a feed compiled into a single normalized tsquery by
+    # feed_service.query. Existing feeds keep NULL and are compiled on read.
+    op.add_column('feeds', sa.Column('tsquery', sa.Text(), nullable=True))
+
+def downgrade() -> None:
+    op.drop_column('feeds', 'tsquery')
@@ -0,0 +1,31 @@
+"""create trending_terms table
+
+Revision ID: 5d0a8f3e61b2
+Revises: 3b7e91c2d4a6
+Create Date: 2026-10-18 13:47:05.861230
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d0a8f3e61b2'
+down_revision = '3b7e91c2d4a6'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    # Snapshots of the top terms per time bucket, written by ingestion.trending.
+    # granularity is 'minute', 'hour' or 'day'; rows expire as buckets leave their window.
+    op.create_table(
+        'trending_terms',
+        sa.Column('granularity', sa.Text(), nullable=False),
+        sa.Column('bucket_start', sa.TIMESTAMP(timezone=True), nullable=False),
+        sa.Column('term', sa.Text(), nullable=False),
+        sa.Column('count', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('granularity', 'bucket_start', 'term'),
+    )
+
+def downgrade() -> None:
+    op.drop_table('trending_terms')
@@ -0,0 +1,32 @@
+"""create feed_embeddings table
+
+Revision ID: 7c2f4e9a0b13
+Revises: 5d0a8f3e61b2
+Create Date: 2026-10-18 16:05:22.413908
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from shared.types import Vector
+
+
+# revision identifiers, used by Alembic.
+revision = '7c2f4e9a0b13'
+down_revision = '5d0a8f3e61b2'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    # Embedding of a feed's keywords, filled in by the embedding service and used
+    # to find semantic candidates for hybrid ranking.
+    op.create_table(
+        'feed_embeddings',
+        sa.Column('feed_id', sa.Integer(), nullable=False),
+        sa.Column('embedding', Vector(384), nullable=False),
+        sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.ForeignKeyConstraint(['feed_id'], ['feeds.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('feed_id'),
+    )
+
+def downgrade() -> None:
+    op.drop_table('feed_embeddings')
@@ -0,0 +1,32 @@
+"""add near-duplicate columns
+
+Revision ID: 9e4d2b7c1f60
+Revises: 7c2f4e9a0b13
+Create Date: 2026-10-18 17:42:09.518306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e4d2b7c1f60'
+down_revision = '7c2f4e9a0b13'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    # SimHash of the post's words, and the post it's a near-duplicate of, if any.
+    # Set by ingestion, see ingestion.simhash.
+    op.add_column('posts', sa.Column('simhash', sa.BigInteger(), nullable=True))
+    op.add_column('posts', sa.Column('canonical_id', sa.Text(), nullable=True))
+    # Whether a feed hides near-duplicates, or returns them marked with duplicate_of
+    op.add_column(
+        'feeds',
+        sa.Column('collapse_duplicates', sa.Boolean(), server_default=sa.text('true'), nullable=False),
+    )
+
+def downgrade() -> None:
+    op.drop_column('feeds', 'collapse_duplicates')
+    op.drop_column('posts', 'canonical_id')
+    op.drop_column('posts', 'simhash')
@@ -0,0 +1,36 @@
+"""create ingestion backfill
+
+Revision ID: a83d5f1c7e24
+Revises: f2a9d4e71c38
+Create Date: 2026-10-19 04:12:37.518260
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a83d5f1c7e24'
+down_revision = 'f2a9d4e71c38'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # The cursor slices of historical backfills (see ingestion.backfill), each with the
+    # cursor of the last event stored from it, so a backfill resumes where it stopped.
+    op.create_table(
+        'ingestion_backfill',
+        sa.Column('slice_start', sa.BigInteger(), nullable=False),
+        sa.Column('slice_end', sa.BigInteger(), nullable=False),
+        sa.Column('cursor', sa.BigInteger()),
+        sa.Column('posts', sa.BigInteger(), server_default=sa.text('0'), nullable=False),
+        sa.Column('started_at', sa.TIMESTAMP(timezone=True)),
+        sa.Column('updated_at', sa.TIMESTAMP(timezone=True)),
+        sa.Column('finished_at', sa.TIMESTAMP(timezone=True)),
+        sa.PrimaryKeyConstraint('slice_start', 'slice_end'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('ingestion_backfill')
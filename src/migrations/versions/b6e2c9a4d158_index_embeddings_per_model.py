@@ -0,0 +1,55 @@
+"""index embeddings per model
+
+Revision ID: b6e2c9a4d158
+Revises: a83d5f1c7e24
+Create Date: 2026-10-19 09:41:03.227914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6e2c9a4d158'
+down_revision = 'a83d5f1c7e24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # A partial HNSW index per model on its embeddings cast to its dimension, the
+    # column itself has none and can't be indexed. Models registered from now on get
+    # theirs from embedding.models.create_vector_index.
+    op.execute(
+        """
+        DO $$
+        DECLARE
+            model record;
+        BEGIN
+            FOR model IN SELECT id, dimensions FROM embedding_models LOOP
+                EXECUTE format(
+                    'CREATE INDEX IF NOT EXISTS idx_embeddings_model_%s_hnsw ON embeddings '
+                    'USING hnsw ((CAST(embedding AS vector(%s))) vector_cosine_ops) WHERE model_id = %s',
+                    model.id, model.dimensions, model.id
+                );
+            END LOOP;
+        END
+        $$
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        """
+        DO $$
+        DECLARE
+            model record;
+        BEGIN
+            FOR model IN SELECT id FROM embedding_models LOOP
+                EXECUTE format('DROP INDEX IF EXISTS idx_embeddings_model_%s_hnsw', model.id);
+            END LOOP;
+        END
+        $$
+        """
+    )
@@ -0,0 +1,254 @@
+"""compact posts layout
+
+Revision ID: b81f3c5e2a97
+Revises: 9e4d2b7c1f60
+Create Date: 2026-10-18 19:10:37.204415
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'b81f3c5e2a97'
+down_revision = '9e4d2b7c1f60'
+branch_labels = None
+depends_on = None
+
+# Base32 CID text <-> binary CID. Only used to convert existing rows and by the
+# posts_expanded view, the services convert in Python (see shared.atproto).
+CID_FUNCTIONS = """
+CREATE OR REPLACE FUNCTION cid_bytes(cid text) RETURNS bytea
+LANGUAGE plpgsql IMMUTABLE STRICT PARALLEL SAFE AS $$
+DECLARE
+    alphabet CONSTANT text := 'abcdefghijklmnopqrstuvwxyz234567';
+    result bytea := '';
+    buffer integer := 0;
+    bits integer := 0;
+    digit integer;
+BEGIN
+    IF left(cid, 1) <> 'b' THEN
+        RETURN NULL;
+    END IF;
+    FOR i IN 2..length(cid) LOOP
+        digit := strpos(alphabet, substr(cid, i, 1)) - 1;
+        IF digit < 0 THEN
+            RETURN NULL;
+        END IF;
+        buffer := (buffer << 5) | digit;
+        bits := bits + 5;
+        IF bits >= 8 THEN
+            bits := bits - 8;
+            result := result || set_byte('\\x00'::bytea, 0, (buffer >> bits) & 255);
+            buffer := buffer & ((1 << bits) - 1);
+        END IF;
+    END LOOP;
+    RETURN result;
+END $$;
+
+CREATE OR REPLACE FUNCTION cid_text(cid bytea) RETURNS text
+LANGUAGE plpgsql IMMUTABLE STRICT PARALLEL SAFE AS $$
+DECLARE
+    alphabet CONSTANT text := 'abcdefghijklmnopqrstuvwxyz234567';
+    result text := 'b';
+    buffer integer := 0;
+    bits integer := 0;
+BEGIN
+    FOR i IN 0..length(cid) - 1 LOOP
+        buffer := (buffer << 8) | get_byte(cid, i);
+        bits := bits + 8;
+        WHILE bits >= 5 LOOP
+            bits := bits - 5;
+            result := result || substr(alphabet, ((buffer >> bits) & 31) + 1, 1);
+        END LOOP;
+        buffer := buffer & ((1 << bits) - 1);
+    END LOOP;
+    IF bits > 0 THEN
+        result := result || substr(alphabet, ((buffer << (5 - bits)) & 31) + 1, 1);
+    END IF;
+    RETURN result;
+END $$;
+"""
+
+# The old column layout, for ad-hoc queries and the schema comparison in loadtest.
+POSTS_EXPANDED_VIEW = """
+CREATE VIEW posts_expanded AS
+SELECT p.id::text AS id, author.did, 'commit' AS kind, p.commit_rev,
+    'create' AS commit_operation, 'app.bsky.feed.post' AS commit_collection,
+    p.commit_rkey, cid_text(p.commit_cid) AS commit_cid, p.created_at, p.langs,
+    cid_text(p.reply_parent_cid) AS reply_parent_cid,
+    'at://' || parent.did || '/app.bsky.feed.post/' || p.reply_parent_rkey AS reply_parent_uri,
+    cid_text(p.reply_root_cid) AS reply_root_cid,
+    'at://' || root.did || '/app.bsky.feed.post/' || p.reply_root_rkey AS reply_root_uri,
+    p.record_text, p.ingest_time, p.cursor::text AS cursor, p.simhash,
+    p.canonical_id::text AS canonical_id
+FROM posts p
+JOIN actors author ON author.id = p.actor_id
+LEFT JOIN actors parent ON parent.id = p.reply_parent_actor_id
+LEFT JOIN actors root ON root.id = p.reply_root_actor_id
+"""
+
+
+def upgrade() -> None:
+    # Every DID once, posts refer to their author and reply targets by id
+    op.create_table(
+        'actors',
+        sa.Column('id', sa.Integer(), sa.Identity(), nullable=False),
+        sa.Column('did', sa.Text(), nullable=False),
+        sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('did'),
+    )
+    op.execute(CID_FUNCTIONS)
+
+    # posts is rebuilt rather than altered: column types can't be changed on
+    # compressed chunks, and copying lets every chunk be compressed in the new layout.
+    # kind, commit_operation and commit_collection were the same on every row
+    # ('commit', 'create', 'app.bsky.feed.post') and are gone.
+    op.execute("ALTER TABLE posts RENAME TO posts_old")
+    op.execute("ALTER TABLE posts_old RENAME CONSTRAINT posts_pkey TO posts_old_pkey")
+    op.execute("ALTER TABLE posts_old RENAME CONSTRAINT posts_unique_commit TO posts_old_unique_commit")
+    op.execute("ALTER INDEX idx_posts_cursor RENAME TO idx_posts_old_cursor")
+    op.execute("ALTER INDEX IF EXISTS posts_created_at_idx RENAME TO posts_old_created_at_idx")
+    op.create_table(
+        'posts',
+        sa.Column('id', postgresql.UUID(), nullable=False),
+        sa.Column('actor_id', sa.Integer(), nullable=False),
+        sa.Column('commit_rev', sa.Text()),
+        sa.Column('commit_rkey', sa.Text(), nullable=False),
+        sa.Column('commit_cid', postgresql.BYTEA()),
+        sa.Column('created_at', sa.TIMESTAMP(), nullable=False),
+        sa.Column('langs', sa.ARRAY(sa.Text())),
+        sa.Column('reply_parent_actor_id', sa.Integer()),
+        sa.Column('reply_parent_rkey', sa.Text()),
+        sa.Column('reply_parent_cid', postgresql.BYTEA()),
+        sa.Column('reply_root_actor_id', sa.Integer()),
+        sa.Column('reply_root_rkey', sa.Text()),
+        sa.Column('reply_root_cid', postgresql.BYTEA()),
+        sa.Column('record_text', sa.Text()),
+        sa.Column('ingest_time', sa.TIMESTAMP(timezone=True)),
+        sa.Column('cursor', sa.BigInteger()),
+        sa.Column('simhash', sa.BigInteger()),
+        sa.Column('canonical_id', postgresql.UUID()),
+        sa.PrimaryKeyConstraint('id', 'created_at'),
+        # a post is identified by its author and record key
+        sa.UniqueConstraint('actor_id', 'commit_rkey', 'created_at', name='posts_unique_commit'),
+    )
+    op.create_index('idx_posts_cursor', 'posts', ['cursor'], unique=False)
+    op.execute(
+        """
+        SELECT create_hypertable('posts', 'created_at',
+        if_not_exists => TRUE,
+        chunk_time_interval => INTERVAL '1 day'
+        );
+        """
+    )
+    op.execute(
+        """
+        ALTER TABLE posts SET (
+            timescaledb.compress = true,
+            timescaledb.compress_orderby = 'created_at DESC'
+        );
+        """
+    )
+
+    op.execute(
+        """
+        INSERT INTO actors (did)
+        SELECT did FROM posts_old WHERE did IS NOT NULL
+        UNION
+        SELECT split_part(reply_parent_uri, '/', 3) FROM posts_old
+        WHERE reply_parent_uri LIKE 'at://%/app.bsky.feed.post/%'
+        UNION
+        SELECT split_part(reply_root_uri, '/', 3) FROM posts_old
+        WHERE reply_root_uri LIKE 'at://%/app.bsky.feed.post/%'
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO posts
+        SELECT o.id::uuid, author.id, o.commit_rev, o.commit_rkey, cid_bytes(o.commit_cid),
+            o.created_at, o.langs,
+            parent.id, split_part(o.reply_parent_uri, '/', 5), cid_bytes(o.reply_parent_cid),
+            root.id, split_part(o.reply_root_uri, '/', 5), cid_bytes(o.reply_root_cid),
+            o.record_text, o.ingest_time, o.cursor::bigint, o.simhash, o.canonical_id::uuid
+        FROM posts_old o
+        JOIN actors author ON author.did = o.did
+        LEFT JOIN actors parent ON parent.did = split_part(o.reply_parent_uri, '/', 3)
+            AND o.reply_parent_uri LIKE 'at://%/app.bsky.feed.post/%'
+        LEFT JOIN actors root ON root.did = split_part(o.reply_root_uri, '/', 3)
+            AND o.reply_root_uri LIKE 'at://%/app.bsky.feed.post/%'
+        WHERE o.commit_rkey IS NOT NULL AND o.created_at IS NOT NULL
+        ON CONFLICT DO NOTHING
+        """
+    )
+    op.drop_table('posts_old')
+    op.execute(POSTS_EXPANDED_VIEW)
+
+    op.execute(
+        "SELECT add_retention_policy('posts', INTERVAL '7 days', if_not_exists => TRUE);"
+    )
+    op.execute(
+        "SELECT add_compression_policy('posts', INTERVAL '1 day', if_not_exists => TRUE);"
+    )
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE posts RENAME TO posts_compact")
+    op.execute("ALTER TABLE posts_compact RENAME CONSTRAINT posts_pkey TO posts_compact_pkey")
+    op.execute("ALTER TABLE posts_compact RENAME CONSTRAINT posts_unique_commit TO posts_compact_unique_commit")
+    op.execute("ALTER INDEX idx_posts_cursor RENAME TO idx_posts_compact_cursor")
+    op.execute("ALTER INDEX IF EXISTS posts_created_at_idx RENAME TO posts_compact_created_at_idx")
+    op.create_table(
+        'posts',
+        sa.Column('id', sa.Text(), nullable=False),
+        sa.Column('did', sa.Text()),
+        sa.Column('kind', sa.Text()),
+        sa.Column('commit_rev', sa.Text()),
+        sa.Column('commit_operation', sa.Text()),
+        sa.Column('commit_collection', sa.Text()),
+        sa.Column('commit_rkey', sa.Text()),
+        sa.Column('commit_cid', sa.Text()),
+        sa.Column('created_at', sa.TIMESTAMP()),
+        sa.Column('langs', sa.ARRAY(sa.Text())),
+        sa.Column('reply_parent_cid', sa.Text()),
+        sa.Column('reply_parent_uri', sa.Text()),
+        sa.Column('reply_root_cid', sa.Text()),
+        sa.Column('reply_root_uri', sa.Text()),
+        sa.Column('record_text', sa.Text()),
+        sa.Column('ingest_time', sa.TIMESTAMP(timezone=True)),
+        sa.Column('cursor', sa.Text()),
+        sa.Column('simhash', sa.BigInteger()),
+        sa.Column('canonical_id', sa.Text()),
+        sa.PrimaryKeyConstraint('id', 'created_at'),
+    )
+    op.create_unique_constraint(
+        "posts_unique_commit",
+        "posts",
+        ["created_at", "commit_rev", "commit_operation", "commit_collection", "commit_rkey", "commit_cid"],
+    )
+    op.create_index('idx_posts_cursor', 'posts', ['cursor'], unique=False)
+    op.create_index('idx_posts_created_at', 'posts', ['created_at'], unique=False)
+    op.execute(
+        """
+        SELECT create_hypertable('posts', 'created_at',
+        if_not_exists => TRUE,
+        chunk_time_interval => INTERVAL '1 day'
+        );
+        """
+    )
+    op.execute("ALTER TABLE posts SET (timescaledb.compress = true);")
+    # the view follows the rename, so it reads the compact table in the old layout
+    op.execute("INSERT INTO posts SELECT * FROM posts_expanded")
+    op.execute("DROP VIEW posts_expanded")
+    op.drop_table('posts_compact')
+    op.execute("DROP FUNCTION cid_text(bytea)")
+    op.execute("DROP FUNCTION cid_bytes(text)")
+    op.drop_table('actors')
+    op.execute(
+        "SELECT add_retention_policy('posts', INTERVAL '7 days', if_not_exists => TRUE);"
+    )
+    op.execute(
+        "SELECT add_compression_policy('posts', INTERVAL '1 day', if_not_exists => TRUE);"
+    )
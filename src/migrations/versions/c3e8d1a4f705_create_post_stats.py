@@ -0,0 +1,115 @@
+"""create post_stats continuous aggregates
+
+Revision ID: c3e8d1a4f705
+Revises: b81f3c5e2a97
+Create Date: 2026-10-18 23:52:11.618204
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3e8d1a4f705'
+down_revision = 'b81f3c5e2a97'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Ingestion stats per minute and per hour, for /api/stats, instead of counting
+    # the whole posts hypertable. Posts are grouped by their first language (set
+    # returning functions like unnest aren't allowed in continuous aggregates), the
+    # totals are the sums over languages. Lag is kept as a sum so averages can be
+    # rolled up. created_at is UTC without a time zone, hence the AT TIME ZONE.
+    #
+    # Created WITH NO DATA because they can't be filled inside the migration's
+    # transaction, the refresh policies below fill them.
+    op.execute(
+        """
+        CREATE MATERIALIZED VIEW post_stats_minute
+        WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+        SELECT
+            time_bucket(INTERVAL '1 minute', created_at) AS bucket,
+            coalesce(langs[1], '') AS lang,
+            count(*) AS posts,
+            sum(CAST(extract(epoch FROM ingest_time - (created_at AT TIME ZONE 'UTC')) AS float8)) AS lag_seconds_sum,
+            max(CAST(extract(epoch FROM ingest_time - (created_at AT TIME ZONE 'UTC')) AS float8)) AS lag_seconds_max,
+            min(cursor) AS min_cursor,
+            max(cursor) AS max_cursor,
+            max(ingest_time) AS last_ingest_time
+        FROM posts
+        GROUP BY bucket, lang
+        WITH NO DATA
+        """
+    )
+    # rolled up from the minutes rather than from posts, so refreshing it never
+    # touches compressed post chunks
+    op.execute(
+        """
+        CREATE MATERIALIZED VIEW post_stats_hour
+        WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+        SELECT
+            time_bucket(INTERVAL '1 hour', bucket) AS bucket,
+            lang,
+            CAST(sum(posts) AS bigint) AS posts,
+            sum(lag_seconds_sum) AS lag_seconds_sum,
+            max(lag_seconds_max) AS lag_seconds_max,
+            min(min_cursor) AS min_cursor,
+            max(max_cursor) AS max_cursor,
+            max(last_ingest_time) AS last_ingest_time
+        FROM post_stats_minute
+        GROUP BY time_bucket(INTERVAL '1 hour', bucket), lang
+        WITH NO DATA
+        """
+    )
+
+    # Posts are compressed after a day, the minutes are refreshed over the last
+    # 3 hours so they only ever read uncompressed chunks. Anything newer than the
+    # last refresh is aggregated on the fly (materialized_only = false).
+    op.execute(
+        """
+        SELECT add_continuous_aggregate_policy('post_stats_minute',
+            start_offset => INTERVAL '3 hours',
+            end_offset => INTERVAL '1 minute',
+            schedule_interval => INTERVAL '1 minute');
+        """
+    )
+    op.execute(
+        """
+        SELECT add_continuous_aggregate_policy('post_stats_hour',
+            start_offset => INTERVAL '1 day',
+            end_offset => INTERVAL '1 hour',
+            schedule_interval => INTERVAL '15 minutes');
+        """
+    )
+
+    # /api/stats reads a range of buckets across all languages, so the rows aren't
+    # segmented by language (that would only make small batches), they're ordered
+    # by bucket so a range skips whole batches, then by language so the values
+    # next to each other repeat and compress well.
+    for view, compress_after in (('post_stats_minute', '2 days'), ('post_stats_hour', '30 days')):
+        op.execute(
+            f"""
+            ALTER MATERIALIZED VIEW {view} SET (
+                timescaledb.compress = true,
+                timescaledb.compress_segmentby = '',
+                timescaledb.compress_orderby = 'bucket DESC, lang'
+            );
+            """
+        )
+        op.execute(
+            f"SELECT add_compression_policy('{view}', compress_after => INTERVAL '{compress_after}');"
+        )
+
+    # minutes are only shown for the last hour, hours are kept after posts expire
+    op.execute(
+        "SELECT add_retention_policy('post_stats_minute', INTERVAL '14 days');"
+    )
+    op.execute(
+        "SELECT add_retention_policy('post_stats_hour', INTERVAL '1 year');"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP MATERIALIZED VIEW post_stats_hour")
+    op.execute("DROP MATERIALIZED VIEW post_stats_minute")
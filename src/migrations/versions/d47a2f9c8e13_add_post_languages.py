@@ -0,0 +1,46 @@
+"""add post languages and text search configurations
+
+Revision ID: d47a2f9c8e13
+Revises: c3e8d1a4f705
+Create Date: 2026-10-18 23:58:40.271936
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'd47a2f9c8e13'
+down_revision = 'c3e8d1a4f705'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Set by ingestion, see shared.text_search: the post's primary language ('' if it
+    # has none), the text search configuration for that language, and for text in
+    # CJK scripts the text split into character bigrams, which is what's tokenized.
+    # Posts stored before this keep matching as English, like they always did, until
+    # they expire; rewriting compressed chunks for that isn't worth it.
+    op.add_column('posts', sa.Column('lang', sa.Text(), server_default='', nullable=True))
+    op.add_column(
+        'posts',
+        sa.Column('ts_config', postgresql.REGCONFIG(), server_default=sa.text("'english'::regconfig"), nullable=True),
+    )
+    op.add_column('posts', sa.Column('search_text', sa.Text(), nullable=True))
+    # feeds in a few languages scan just those posts
+    op.create_index('idx_posts_lang_created_at', 'posts', ['lang', sa.text('created_at DESC')], unique=False)
+    # The languages a feed is limited to, empty for all of them
+    op.add_column(
+        'feeds',
+        sa.Column('languages', sa.ARRAY(sa.Text()), server_default=sa.text("'{}'"), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('feeds', 'languages')
+    op.drop_index('idx_posts_lang_created_at', table_name='posts')
+    op.drop_column('posts', 'search_text')
+    op.drop_column('posts', 'ts_config')
+    op.drop_column('posts', 'lang')
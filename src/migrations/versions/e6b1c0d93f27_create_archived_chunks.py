@@ -0,0 +1,37 @@
+"""create archived_chunks
+
+Revision ID: e6b1c0d93f27
+Revises: d47a2f9c8e13
+Create Date: 2026-10-19 00:41:18.530442
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6b1c0d93f27'
+down_revision = 'd47a2f9c8e13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Chunks of posts and embeddings written to the Parquet cold tier, see archive.main.
+    # Kept after retention drops the chunk, it's the index of what's in the archive.
+    op.create_table(
+        'archived_chunks',
+        sa.Column('hypertable', sa.Text(), nullable=False),
+        sa.Column('chunk', sa.Text(), nullable=False),
+        sa.Column('range_start', sa.TIMESTAMP(timezone=True), nullable=False),
+        sa.Column('range_end', sa.TIMESTAMP(timezone=True), nullable=False),
+        sa.Column('rows', sa.BigInteger(), nullable=False),
+        sa.Column('files', sa.Integer(), nullable=False),
+        sa.Column('bytes', sa.BigInteger(), nullable=False),
+        sa.Column('archived_at', sa.TIMESTAMP(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint('hypertable', 'chunk'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('archived_chunks')
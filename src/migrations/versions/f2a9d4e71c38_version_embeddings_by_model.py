@@ -0,0 +1,183 @@
+"""version embeddings by model
+
+Revision ID: f2a9d4e71c38
+Revises: e6b1c0d93f27
+Create Date: 2026-10-19 01:26:52.804117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from shared.types import Vector
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2a9d4e71c38'
+down_revision = 'e6b1c0d93f27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # The models posts are embedded with. Readers use the one active model, switching
+    # is a single UPDATE (see embedding.models). Posts created from live_from on are
+    # embedded by the model's embedding worker, older ones by a backfill.
+    op.create_table(
+        'embedding_models',
+        sa.Column('id', sa.SmallInteger(), sa.Identity(), nullable=False),
+        sa.Column('name', sa.Text(), nullable=False),
+        sa.Column('dimensions', sa.Integer(), nullable=False),
+        sa.Column('active', sa.Boolean(), server_default=sa.text('false'), nullable=False),
+        sa.Column('live_from', sa.TIMESTAMP(), nullable=False),
+        sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.Column('activated_at', sa.TIMESTAMP(timezone=True)),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name'),
+    )
+    op.create_index(
+        'embedding_models_one_active', 'embedding_models', ['active'], unique=True,
+        postgresql_where=sa.text('active'),
+    )
+    op.execute(
+        """
+        INSERT INTO embedding_models (name, dimensions, active, live_from, activated_at)
+        VALUES ('all-MiniLM-L6-v2', 384, true, '-infinity', now())
+        """
+    )
+
+    # embeddings is rebuilt like posts was: keyed by model and post, vectors of any
+    # dimension, and partitioned by the post's created_at rather than when it was
+    # embedded, so a chunk of embeddings covers the same posts as a chunk of posts
+    # (backfills work chunk by chunk) and expires with them. post_id is a uuid like
+    # posts.id. The ivfflat index goes: it was built on an empty table, and needs a
+    # fixed dimension. Hybrid ranking searches a window of a day of one model's
+    # embeddings, which the (model_id, post_created_at) index and chunk exclusion
+    # narrow down.
+    op.execute("ALTER TABLE embeddings RENAME TO embeddings_old")
+    op.execute("ALTER TABLE embeddings_old RENAME CONSTRAINT embeddings_pkey TO embeddings_old_pkey")
+    op.drop_index('post_embedding_idx', table_name='embeddings_old')
+    op.create_table(
+        'embeddings',
+        sa.Column('model_id', sa.SmallInteger(), nullable=False),
+        sa.Column('post_id', postgresql.UUID(), nullable=False),
+        sa.Column('post_created_at', sa.TIMESTAMP(), nullable=False),
+        sa.Column('embedding', Vector(), nullable=False),
+        sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('model_id', 'post_id', 'post_created_at'),
+    )
+    op.create_index(
+        'idx_embeddings_model_post_created_at', 'embeddings',
+        ['model_id', sa.text('post_created_at DESC')], unique=False,
+    )
+    op.execute(
+        """
+        SELECT create_hypertable('embeddings', 'post_created_at',
+        if_not_exists => TRUE,
+        chunk_time_interval => INTERVAL '1 day'
+        );
+        """
+    )
+    op.execute(
+        """
+        ALTER TABLE embeddings SET (
+            timescaledb.compress = true,
+            timescaledb.compress_segmentby = 'model_id',
+            timescaledb.compress_orderby = 'post_created_at DESC'
+        );
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO embeddings (model_id, post_id, post_created_at, embedding, created_at)
+        SELECT m.id, CAST(o.post_id AS uuid), o.post_created_at, o.embedding, o.created_at
+        FROM embeddings_old o
+        JOIN embedding_models m ON m.name = 'all-MiniLM-L6-v2'
+        WHERE o.post_created_at IS NOT NULL
+        ON CONFLICT DO NOTHING
+        """
+    )
+    op.drop_table('embeddings_old')
+    op.execute(
+        "SELECT add_retention_policy('embeddings', INTERVAL '7 days', if_not_exists => TRUE);"
+    )
+    op.execute(
+        "SELECT add_compression_policy('embeddings', INTERVAL '1 day', if_not_exists => TRUE);"
+    )
+
+    # A feed's keywords embedded with every model
+    op.add_column('feed_embeddings', sa.Column('model_id', sa.SmallInteger(), nullable=True))
+    op.execute("UPDATE feed_embeddings SET model_id = (SELECT id FROM embedding_models WHERE active)")
+    op.alter_column('feed_embeddings', 'model_id', nullable=False)
+    op.alter_column('feed_embeddings', 'embedding', type_=Vector())
+    op.drop_constraint('feed_embeddings_pkey', 'feed_embeddings', type_='primary')
+    op.create_primary_key('feed_embeddings_pkey', 'feed_embeddings', ['feed_id', 'model_id'])
+
+    # Progress of re-embedding backfills, one row per model and posts chunk ("shard").
+    # A worker leases a shard until claimed_until and records how far it got after
+    # every batch, so a crashed or stopped backfill resumes where it was.
+    op.create_table(
+        'embedding_backfill',
+        sa.Column('model_id', sa.SmallInteger(), nullable=False),
+        sa.Column('shard_start', sa.TIMESTAMP(), nullable=False),
+        sa.Column('shard_end', sa.TIMESTAMP(), nullable=False),
+        sa.Column('last_created_at', sa.TIMESTAMP()),
+        sa.Column('last_post_id', postgresql.UUID()),
+        sa.Column('embedded', sa.BigInteger(), server_default=sa.text('0'), nullable=False),
+        sa.Column('claimed_by', sa.Text()),
+        sa.Column('claimed_until', sa.TIMESTAMP(timezone=True)),
+        sa.Column('finished_at', sa.TIMESTAMP(timezone=True)),
+        sa.ForeignKeyConstraint(['model_id'], ['embedding_models.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('model_id', 'shard_start'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('embedding_backfill')
+    op.execute(
+        "DELETE FROM feed_embeddings WHERE model_id <> (SELECT id FROM embedding_models WHERE name = 'all-MiniLM-L6-v2')"
+    )
+    op.drop_constraint('feed_embeddings_pkey', 'feed_embeddings', type_='primary')
+    op.create_primary_key('feed_embeddings_pkey', 'feed_embeddings', ['feed_id'])
+    op.alter_column('feed_embeddings', 'embedding', type_=Vector(384))
+    op.drop_column('feed_embeddings', 'model_id')
+
+    op.execute("ALTER TABLE embeddings RENAME TO embeddings_models")
+    op.execute("ALTER TABLE embeddings_models RENAME CONSTRAINT embeddings_pkey TO embeddings_models_pkey")
+    op.create_table(
+        "embeddings",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("post_id", sa.Text(), nullable=False),
+        sa.Column('post_created_at', sa.TIMESTAMP()),
+        sa.Column("embedding", Vector(384), nullable=False),
+        sa.Column("created_at", sa.TIMESTAMP(timezone=True), nullable=False),
+        sa.Column("updated_at", sa.TIMESTAMP(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("id", "created_at"),
+    )
+    op.execute(
+        "CREATE INDEX post_embedding_idx ON embeddings USING ivfflat (embedding vector_cosine_ops) WITH (lists = 100)"
+    )
+    op.execute(
+        """
+        SELECT create_hypertable('embeddings', 'created_at',
+        if_not_exists => TRUE,
+        chunk_time_interval => INTERVAL '1 hour'
+        );
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO embeddings (id, post_id, post_created_at, embedding, created_at, updated_at)
+        SELECT 0, CAST(e.post_id AS text), e.post_created_at, e.embedding, e.created_at, e.created_at
+        FROM embeddings_models e
+        JOIN embedding_models m ON m.id = e.model_id AND m.name = 'all-MiniLM-L6-v2'
+        """
+    )
+    op.drop_table('embeddings_models')
+    op.execute("ALTER TABLE embeddings SET (timescaledb.compress = true);")
+    op.execute(
+        "SELECT add_retention_policy('embeddings', INTERVAL '7 days', if_not_exists => TRUE);"
+    )
+    op.execute(
+        "SELECT add_compression_policy('embeddings', INTERVAL '1 day', if_not_exists => TRUE);"
+    )
+    op.drop_table('embedding_models')
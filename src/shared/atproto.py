@@ -0,0 +1,43 @@
+# shared/atproto.py
+"""
+Compact storage of AT Protocol identifiers.
+
+Posts store CIDs as the raw bytes of the CID rather than its base32 text, and post
+URIs as the author's actor id plus the record key. These convert between the two.
+"""
+
+import base64
+from typing import Optional, Tuple
+
+POST_COLLECTION = "app.bsky.feed.post"
+
+
+def cid_to_bytes(cid: Optional[str]) -> Optional[bytes]:
+    """The binary CID of a base32 ('b' multibase prefix) CID string, None if it isn't one."""
+    if not cid or cid[0] != "b":
+        return None
+    body = cid[1:].upper()
+    try:
+        return base64.b32decode(body + "=" * (-len(body) % 8))
+    except ValueError:
+        return None
+
+
+def cid_from_bytes(cid: Optional[bytes]) -> Optional[str]:
+    if cid is None:
+        return None
+    return "b" + base64.b32encode(bytes(cid)).decode("ascii").rstrip("=").lower()
+
+
+def post_uri(did: str, rkey: str) -> str:
+    return f"at://{did}/{POST_COLLECTION}/{rkey}"
+
+
+def parse_post_uri(uri: Optional[str]) -> Optional[Tuple[str, str]]:
+    """(did, rkey) of an at:// post URI, None for anything else."""
+    if not uri or not uri.startswith("at://"):
+        return None
+    parts = uri[len("at://") :].split("/")
+    if len(parts) != 3 or parts[1] != POST_COLLECTION or not parts[0] or not parts[2]:
+        return None
+    return parts[0], parts[2]
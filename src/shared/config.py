@@ -10,6 +10,118 @@ class Settings(BaseSettings):
     batch_size: int = 100
     flush_interval_seconds: int = 10
     jetstream_uri: str = "wss://jetstream2.us-east.bsky.network/subscribe"
+    # Jetstream endpoints ingestion picks from and fails over between, see
+    # ingestion.jetstream. Empty means just jetstream_uri.
+    jetstream_uris: list[str] = []
+    # seconds without an event before switching endpoints, how far to rewind the
+    # cursor when reconnecting, and the backoff for endpoints that fail
+    jetstream_stall_seconds: float = 15
+    jetstream_rewind_seconds: float = 5
+    jetstream_backoff_seconds: float = 1
+    jetstream_backoff_max_seconds: float = 60
+    # keep a second connection open to take over without a gap
+    jetstream_standby: bool = True
+    # "top keywords" counted by ingestion, see ingestion.trending
+    trending_enabled: bool = True
+    trending_top_k: int = 200
+    trending_sketch_width: int = 4096
+    trending_sketch_depth: int = 4
+    trending_persist_seconds: float = 60
+    # near-duplicate detection at ingest, see ingestion.simhash: posts within this many
+    # bits of a post seen in the window are stored pointing at it, or dropped entirely
+    near_duplicates_enabled: bool = True
+    near_duplicate_distance: int = 3
+    near_duplicate_window_seconds: float = 3600
+    near_duplicate_max_entries: int = 500_000
+    # posts with fewer distinct words than this are never duplicates ("gm", "lol")
+    near_duplicate_min_words: int = 5
+    near_duplicate_drop: bool = False
+    # store text in Chinese, Japanese and Korean scripts split into character bigrams,
+    # so keywords match inside it, see shared.text_search
+    cjk_bigrams_enabled: bool = True
+    # feed queries search these windows (in hours) newest first, then everything
+    feed_search_windows_hours: list[float] = [1, 6, 24]
+    # per-worker caches in feed_service
+    user_cache_size: int = 10_000
+    user_cache_ttl_seconds: float = 60
+    feed_cache_size: int = 10_000
+    feed_cache_ttl_seconds: float = 300
+    # identical concurrent feed requests share one query, and with micro_cache_seconds
+    # > 0 their result is reused for that long (keep it to a second or two)
+    feed_micro_cache_seconds: float = 0
+    feed_micro_cache_size: int = 10_000
+    # createdAt is set by the client. Queries for newly stored posts go by ingest cursor
+    # and only read posts created at most this long before it, so they stay on recent
+    # chunks. Posts backdated further only show up in pages read from SQL.
+    post_backdate_hours: float = 24
+    # getFeedSkeleton keeps this many posts in memory per recently requested feed
+    skeleton_size: int = 1000
+    skeleton_refresh_seconds: float = 10
+    skeleton_idle_seconds: float = 900
+    # live feed streams: posts buffered per slow client, and seconds between keepalives
+    stream_queue_size: int = 100
+    stream_keepalive_seconds: float = 15
+    # an in-memory inverted index of the last recent_index_hours of posts in each
+    # feed_service worker, in segments of recent_index_segment_minutes, that answers
+    # rank=recent feeds before SQL does. See feed_service.recent_index.
+    recent_index_enabled: bool = False
+    recent_index_hours: float = 1
+    recent_index_segment_minutes: float = 5
+    recent_index_refresh_seconds: float = 5
+    # include=thread on feed pages, see feed_service.threads: the page and its thread
+    # context should take no longer than this, parents and roots are looked for up to
+    # thread_lookup_hours before the reply, and roots of busy threads are cached
+    thread_page_budget_ms: float = 250
+    thread_lookup_hours: float = 72
+    thread_root_cache_size: int = 10_000
+    thread_root_cache_ttl_seconds: float = 600
+    # rank=hybrid feeds: candidates taken from each of the keyword and vector searches,
+    # how far back they go, and the half-life of the recency boost
+    hybrid_candidates: int = 200
+    hybrid_window_hours: float = 24
+    hybrid_half_life_hours: float = 6
+    # the sentence-transformers model embedding.main embeds with, registered in
+    # embedding_models when it first starts. Feeds rank with whichever is active.
+    embedding_model: str = "all-MiniLM-L6-v2"
+    embedding_trust_remote_code: bool = False
+    # the embedding worker embeds posts from the last embedding_fresh_minutes first,
+    # then older ones newest first, and none older than embedding_horizon_hours. See
+    # embedding.scheduler.
+    embedding_fresh_minutes: float = 10
+    embedding_horizon_hours: float = 24
+    embedding_rescan_seconds: float = 3600
+    embedding_report_seconds: float = 60
+    # re-embedding backfills, see embedding.backfill: posts per batch, a cap on posts
+    # per second across its workers, and how long a worker holds a shard without
+    # checkpointing before another may take it over. Backfills pause while more than
+    # backfill_max_live_backlog recent posts are waiting for the live worker.
+    backfill_batch_size: int = 256
+    backfill_posts_per_second: float = 200
+    backfill_lease_seconds: float = 300
+    backfill_max_live_backlog: int = 1000
+    # seconds between reloads of the trending terms served by feed_service
+    trending_refresh_seconds: float = 60
+    # feed_service query profiling for /debug/queries: statements kept, what counts as
+    # slow, the fraction of slow feed queries that get an EXPLAIN ANALYZE, and who may
+    # look
+    query_profiling_enabled: bool = True
+    query_log_size: int = 1000
+    slow_query_ms: float = 100
+    explain_sample_rate: float = 0.1
+    admin_user_ids: list[int] = []
+    # streaming replicas feed_service reads from, as a JSON list of URLs. A replica
+    # further behind than replica_max_lag_seconds is skipped until it catches up.
+    database_replica_urls: list[str] = []
+    replica_max_lag_seconds: float = 5
+    replica_check_seconds: float = 2
+
+    # cold tier, see archive.main: chunks of posts and embeddings are written to Parquet
+    # under archive_dir this long after they end, which has to be well before the
+    # retention policies (7 days) drop them
+    archive_dir: str = "archive"
+    archive_after_hours: float = 24
+    archive_check_seconds: float = 600
+    archive_row_group_size: int = 100_000
 
     model_config = SettingsConfigDict(
         env_file=".env",
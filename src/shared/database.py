@@ -1,9 +1,17 @@
-from typing import Generator
-from sqlalchemy import create_engine
+import asyncio
+import itertools
+import logging
+import re
+import time
+from typing import Generator, List, Optional
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 from shared.config import settings
 
+logger = logging.getLogger(__name__)
+
 engine = create_engine(settings.database_url)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
@@ -13,4 +21,168 @@ def get_db() -> Generator[Session]:
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+class PreparedStatement:
+    """
+    A statement that is PREPAREd once on every pooled connection and then run with
+    EXECUTE, so Postgres plans it once per connection instead of once per request.
+
+    `sql` uses the same `:name` parameters as `text()`; `param_types` gives the SQL
+    type of each parameter, in the order they should be numbered.
+    """
+
+    registry: dict[str, "PreparedStatement"] = {}
+
+    def __init__(self, name: str, sql: str, **param_types: str):
+        self.name = name
+        positions = {param: idx + 1 for idx, param in enumerate(param_types)}
+        body = re.sub(r"(?<!:):(\w+)", lambda m: f"${positions[m.group(1)]}", sql)
+        self.prepare_sql = f"PREPARE {name} ({', '.join(param_types.values())}) AS {body}"
+        self.statement = text(f"EXECUTE {name}({', '.join(f':{p}' for p in param_types)})")
+        PreparedStatement.registry[name] = self
+
+
+@event.listens_for(engine, "connect")
+def prepare_statements(dbapi_connection, connection_record):
+    """Create every registered prepared statement on a new connection."""
+    with dbapi_connection.cursor() as cursor:
+        for prepared in PreparedStatement.registry.values():
+            cursor.execute(prepared.prepare_sql)
+    dbapi_connection.commit()
+
+
+# Seconds the replica is behind the primary: 0 if it's streaming and has replayed
+# everything it received, otherwise the age of the last transaction it replayed
+# (NULL if it hasn't replayed anything yet). A server that isn't a standby is never
+# behind.
+replica_lag_query = text(
+    """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN EXISTS (SELECT FROM pg_stat_wal_receiver WHERE status = 'streaming')
+            AND pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp())
+    END
+    """
+)
+
+
+class Replica:
+    def __init__(self, url: str):
+        self.engine = create_engine(url, pool_pre_ping=True, connect_args={"connect_timeout": 3})
+        event.listen(self.engine, "connect", prepare_statements)
+        self.lag: Optional[float] = None
+        self.checked_at: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def check(self) -> None:
+        try:
+            with self.engine.connect() as conn:
+                lag = conn.execute(replica_lag_query).scalar()
+            self.lag = None if lag is None else float(lag)
+            self.error = None
+        except Exception as e:
+            self.lag = None
+            self.error = str(e)
+        self.checked_at = time.monotonic()
+
+
+class ReplicaRouter:
+    """
+    Sends reads to streaming replicas and everything else to the primary.
+
+    Every replica's lag is checked in the background. Reads go round-robin to the
+    replicas that are at most `max_lag_seconds` behind, and to the primary when
+    none are (or until the first check, or when no replicas are configured), so a
+    replica that falls behind or goes away only makes reads slower, never stale.
+    """
+
+    def __init__(self, primary: Engine, urls: List[str], max_lag_seconds: float, check_seconds: float):
+        self.primary = primary
+        self.replicas = [Replica(url) for url in urls]
+        self.max_lag_seconds = max_lag_seconds
+        self.check_seconds = check_seconds
+        self._turn = itertools.count()
+        self._task: Optional[asyncio.Task] = None
+        self.reads = {"replica": 0, "primary": 0}
+
+    def healthy(self) -> List[Replica]:
+        # a check that's overdue (the loop is stuck) doesn't count
+        stale = time.monotonic() - 3 * self.check_seconds
+        return [
+            r
+            for r in self.replicas
+            if r.lag is not None and r.lag <= self.max_lag_seconds and r.checked_at > stale
+        ]
+
+    def read_engine(self) -> Engine:
+        healthy = self.healthy()
+        if not healthy:
+            self.reads["primary"] += 1
+            return self.primary
+        self.reads["replica"] += 1
+        return healthy[next(self._turn) % len(healthy)].engine
+
+    def check(self) -> None:
+        for replica in self.replicas:
+            was_healthy = replica in self.healthy()
+            replica.check()
+            if was_healthy and replica not in self.healthy():
+                logger.warning(
+                    f"Replica {replica.engine.url!r} left the pool, lag {replica.lag}: {replica.error}"
+                )
+            elif not was_healthy and replica in self.healthy():
+                logger.info(f"Replica {replica.engine.url!r} joined the pool, lag {replica.lag}")
+
+    async def _check_loop(self) -> None:
+        while True:
+            await asyncio.to_thread(self.check)
+            await asyncio.sleep(self.check_seconds)
+
+    def start(self) -> None:
+        if self.replicas:
+            self._task = asyncio.create_task(self._check_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+    def stats(self) -> dict:
+        healthy = self.healthy()
+        return {
+            "reads": dict(self.reads),
+            "max_lag_seconds": self.max_lag_seconds,
+            "replicas": [
+                {
+                    # repr hides the password
+                    "url": repr(r.engine.url),
+                    "lag_seconds": r.lag,
+                    "healthy": r in healthy,
+                    "error": r.error,
+                }
+                for r in self.replicas
+            ],
+        }
+
+
+replicas = ReplicaRouter(
+    engine,
+    settings.database_replica_urls,
+    settings.replica_max_lag_seconds,
+    settings.replica_check_seconds,
+)
+
+
+def read_session() -> Session:
+    """A session for read-only work, on a replica if one is close enough to the primary."""
+    return SessionLocal(bind=replicas.read_engine())
+
+
+def get_read_db() -> Generator[Session]:
+    db = read_session()
+    try:
+        yield db
+    finally:
+        db.close()
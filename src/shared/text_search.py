@@ -0,0 +1,90 @@
+# shared/text_search.py
+"""
+Which text search configuration a post is indexed with.
+
+Every post is tokenized with the configuration of its primary language (the first
+of its `langs`), so Portuguese posts are stemmed as Portuguese and English ones as
+English. Languages Postgres has no stemmer for use `simple`, which only lowercases.
+Ingestion stores the primary language and its configuration with the post, feed
+queries build their tsquery with the same configuration per row.
+
+Chinese, Japanese and Korean are written without spaces between words, so the
+default parser sees a whole sentence as one word. Text in those scripts is split
+into overlapping character bigrams (東京タワー -> 東京 京タ タワ ワー): keywords are
+split the same way and matched as a phrase of bigrams, so a keyword matches
+wherever its characters appear in a row.
+"""
+
+import re
+from typing import List, Optional
+
+# primary language subtag -> built-in Postgres text search configuration
+LANGUAGE_CONFIGS = {
+    "ar": "arabic",
+    "ca": "catalan",
+    "da": "danish",
+    "de": "german",
+    "el": "greek",
+    "en": "english",
+    "es": "spanish",
+    "eu": "basque",
+    "fi": "finnish",
+    "fr": "french",
+    "ga": "irish",
+    "hi": "hindi",
+    "hu": "hungarian",
+    "hy": "armenian",
+    "id": "indonesian",
+    "it": "italian",
+    "lt": "lithuanian",
+    "nb": "norwegian",
+    "ne": "nepali",
+    "nl": "dutch",
+    "nn": "norwegian",
+    "no": "norwegian",
+    "pt": "portuguese",
+    "ro": "romanian",
+    "ru": "russian",
+    "sr": "serbian",
+    "sv": "swedish",
+    "ta": "tamil",
+    "tr": "turkish",
+    "yi": "yiddish",
+}
+FALLBACK_CONFIG = "simple"
+
+# Han, kana and Hangul, including half-width katakana and the compatibility ideographs
+_CJK = "぀-ヿ㐀-䶿一-鿿가-힯豈-﫿ｦ-ﾟ"
+_CJK_RUN = re.compile(f"[{_CJK}]+")
+
+_LANGUAGE = re.compile(r"^[a-z]{2,3}$")
+
+
+def primary_language(langs: Optional[List[str]]) -> str:
+    """The primary language subtag of a post's first language ('pt' for 'pt-BR'), '' if none."""
+    if not langs or not langs[0]:
+        return ""
+    return langs[0].split("-")[0].lower()
+
+
+def text_search_config(lang: str) -> str:
+    return LANGUAGE_CONFIGS.get(lang, FALLBACK_CONFIG)
+
+
+def valid_language(lang: str) -> bool:
+    return bool(_LANGUAGE.match(lang))
+
+
+def has_cjk(text: str) -> bool:
+    return _CJK_RUN.search(text) is not None
+
+
+def _bigrams(run: str) -> str:
+    if len(run) == 1:
+        return run
+    return " ".join(run[i : i + 2] for i in range(len(run) - 1))
+
+
+def segment_cjk(text: str) -> str:
+    """Text with every run of CJK characters replaced by its character bigrams."""
+    return _CJK_RUN.sub(lambda m: f" {_bigrams(m.group())} ", text)
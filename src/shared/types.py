@@ -3,9 +3,12 @@ from sqlalchemy.types import UserDefinedType
 
 class Vector(UserDefinedType):
     def get_col_spec(self, **kw):
+        # without a dimension the column takes vectors of any size
+        if self.dim is None:
+            return "vector"
         return f"vector({self.dim})"
 
-    def __init__(self, dim):
+    def __init__(self, dim=None):
         self.dim = dim
 
     def bind_processor(self, dialect):